@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+from annotation_store import AnnotationStore, atomic_write_json
+
+
+JOURNAL_FILE_NAME = ".annotations.journal"
+SQLITE_FILE_NAME = ".annotations.sqlite3"
+
+STORAGE_KINDS = ("json", "journal", "sqlite")
+
+
+def export_document(doc):
+    """Return doc in the per-video JSON layout read by cut_clip.py"""
+    return {
+        "name": doc["name"],
+        "path": doc["path"],
+        "annotations": doc.get("annotations", {}),
+        "annotations_frame": doc.get("annotations_frame", {}),
+    }
+
+
+def export_json(docs, out_dir):
+    """Write one <name>.json per document in docs to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    for doc in docs:
+        atomic_write_json(os.path.join(out_dir, doc["name"] + ".json"), export_document(doc))
+        count += 1
+    return count
+
+
+class BackendStore:
+    """Annotation store that records every edit as it happens.
+
+    Subclasses persist single edits in O(1) (put, annotate, remove) and
+    rebuild documents from them. Videos the backend has never seen are read
+    from the JSON files through json_store, and edited documents are still
+    exported to their JSON file when Player.saveAnnotation runs, so the
+    annotations directory stays usable by cut_clip.py.
+    """
+
+    def __init__(self, json_store):
+        self.json_store = json_store
+        self.docs = OrderedDict()
+        self.dirty = set()
+
+    def __contains__(self, name):
+        return name in self.docs or self.has_document(name) or name in self.json_store
+
+    def __len__(self):
+        """Number of annotated videos, in the backend or only in the JSON files"""
+        names = set(self.docs) | self.document_names()
+        return len(self.json_store) + sum(1 for name in names if name not in self.json_store)
+
+    def __getitem__(self, name):
+        doc = self.get(name)
+        if doc is None:
+            raise KeyError(name)
+        return doc
+
+    def __setitem__(self, name, doc):
+        if self.docs.get(name) is not doc:
+            self.docs[name] = doc
+            self.record_put(doc)
+
+    def get(self, name, default=None):
+        if name in self.docs:
+            return self.docs[name]
+
+        doc = self.load_document(name)
+        if doc is not None:
+            self.docs[name] = doc
+            return doc
+
+        return self.json_store.get(name, default)
+
+    def reload(self, name):
+        """Read name again from the backend or its JSON file, see AnnotationStore.reload"""
+        if name not in self.dirty:
+            self.docs.pop(name, None)
+        self.json_store.reload(name)
+
+    def record_annotate(self, doc, key):
+        self[doc["name"]] = doc
+        self.dirty.add(doc["name"])
+        self.append_annotate(doc["name"], key,
+                             doc["annotations"].get(key), doc["annotations_frame"].get(key))
+
+    def record_remove(self, doc, key, frame_key):
+        self[doc["name"]] = doc
+        self.dirty.add(doc["name"])
+        self.append_remove(doc["name"], key, frame_key)
+
+    def record_put(self, doc):
+        self.dirty.add(doc["name"])
+        self.append_put(doc)
+
+    def save(self, doc):
+        """Export doc to its JSON file if it was edited since the last export"""
+        if doc["name"] in self.dirty:
+            self.dirty.discard(doc["name"])
+            self.json_store.save(doc)
+
+    def export_dirty(self):
+        for name in list(self.dirty):
+            self.save(self.docs[name])
+
+    def close(self):
+        self.export_dirty()
+        self.json_store.close()
+
+    # Implemented by the backends
+    def has_document(self, name):
+        return False
+
+    def document_names(self):
+        return set()
+
+    def load_document(self, name):
+        return None
+
+    def append_put(self, doc):
+        raise NotImplementedError
+
+    def append_annotate(self, name, key, position, frame):
+        raise NotImplementedError
+
+    def append_remove(self, name, key, frame_key):
+        raise NotImplementedError
+
+
+def apply_record(docs, record):
+    """Apply one journal record to docs, a dict of name -> document"""
+    op = record["op"]
+    name = record["name"]
+    if op == "put":
+        docs[name] = export_document(record["doc"])
+        return
+
+    doc = docs.get(name)
+    if doc is None:
+        doc = docs[name] = {"name": name, "path": record.get("path", ""),
+                            "annotations": {}, "annotations_frame": {}}
+
+    if op == "annotate":
+        if record["position"] is not None:
+            doc["annotations"][record["key"]] = record["position"]
+        if record["frame"] is not None:
+            doc["annotations_frame"][record["key"]] = record["frame"]
+    elif op == "remove":
+        doc["annotations"].pop(record["key"], None)
+        doc["annotations_frame"].pop(record["frame_key"], None)
+    else:
+        raise ValueError(f"Unknown journal operation {op}")
+
+
+def replay_journal(journal_path):
+    """Rebuild the documents recorded in an append-only journal"""
+    docs = OrderedDict()
+    if not os.path.exists(journal_path):
+        return docs
+
+    with open(journal_path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash can leave a torn last line behind
+                print(f"Skipping corrupt journal line {line_number} in {journal_path}")
+                continue
+            apply_record(docs, record)
+    return docs
+
+
+class JournalStore(BackendStore):
+    """Append-only journal, one JSON line per edit.
+
+    The journal only has to cover edits that are not exported to the JSON
+    files yet: startup replays it, and a clean close() exports every edited
+    document and truncates it.
+    """
+
+    def __init__(self, journal_path, json_store, fsync=True):
+        super().__init__(json_store)
+        self.journal_path = journal_path
+        self.fsync = fsync
+
+        self.docs = replay_journal(journal_path)
+        # Replayed edits may be missing from the JSON files after a crash
+        self.dirty = set(self.docs)
+
+        self.journal = open(journal_path, "a")
+
+    def append(self, record):
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def append_put(self, doc):
+        self.append({"op": "put", "name": doc["name"], "doc": export_document(doc)})
+
+    def append_annotate(self, name, key, position, frame):
+        self.append({"op": "annotate", "name": name, "key": key, "position": position, "frame": frame})
+
+    def append_remove(self, name, key, frame_key):
+        self.append({"op": "remove", "name": name, "key": key, "frame_key": frame_key})
+
+    def close(self):
+        super().close()
+        # Every edit is in the JSON files now, start the next session with an empty journal
+        writer = self.json_store.writer
+        if writer is None or writer.errors == 0:
+            self.journal.truncate(0)
+        self.journal.close()
+
+
+class SQLiteStore(BackendStore):
+    """All annotations in a single SQLite database in WAL mode, one row per mark"""
+
+    def __init__(self, db_path, json_store):
+        super().__init__(json_store)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS videos (name TEXT PRIMARY KEY, path TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS marks ("
+                        "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "name TEXT NOT NULL, field TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+                        "UNIQUE (name, field, key))")
+
+        # Replay: the videos known to the database, their marks are loaded on demand
+        self.names = set(row[0] for row in self.db.execute("SELECT name FROM videos"))
+
+    def has_document(self, name):
+        return name in self.names
+
+    def document_names(self):
+        return self.names
+
+    def load_document(self, name):
+        if name not in self.names:
+            return None
+
+        path = self.db.execute("SELECT path FROM videos WHERE name = ?", (name,)).fetchone()[0]
+        doc = {"name": name, "path": path, "annotations": {}, "annotations_frame": {}}
+        rows = self.db.execute("SELECT field, key, value FROM marks WHERE name = ? ORDER BY seq", (name,))
+        for field, key, value in rows:
+            doc[field][key] = json.loads(value)
+        return doc
+
+    def all_documents(self):
+        for name in sorted(self.names):
+            yield self.load_document(name)
+
+    def append_put(self, doc):
+        name = doc["name"]
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute("INSERT OR REPLACE INTO videos (name, path) VALUES (?, ?)", (name, doc["path"]))
+            self.db.execute("DELETE FROM marks WHERE name = ?", (name,))
+            for field in ("annotations", "annotations_frame"):
+                self.db.executemany(
+                    "INSERT INTO marks (name, field, key, value) VALUES (?, ?, ?, ?)",
+                    [(name, field, key, json.dumps(value)) for key, value in doc.get(field, {}).items()])
+        self.names.add(name)
+
+    def append_annotate(self, name, key, position, frame):
+        with self.db:
+            self.db.execute("BEGIN")
+            for field, value in (("annotations", position), ("annotations_frame", frame)):
+                if value is not None:
+                    self.db.execute("INSERT OR REPLACE INTO marks (name, field, key, value) VALUES (?, ?, ?, ?)",
+                                    (name, field, key, json.dumps(value)))
+
+    def append_remove(self, name, key, frame_key):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM marks WHERE name = ? AND field = 'annotations' AND key = ?", (name, key))
+            self.db.execute("DELETE FROM marks WHERE name = ? AND field = 'annotations_frame' AND key = ?",
+                            (name, frame_key))
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+def open_annotation_store(kind, annotations_dir, writer=None):
+    """Create the annotation store for --storage kind"""
+    json_store = AnnotationStore(annotations_dir, writer=writer)
+    if kind == "json":
+        return json_store
+    if kind == "journal":
+        return JournalStore(os.path.join(annotations_dir, JOURNAL_FILE_NAME), json_store)
+    if kind == "sqlite":
+        return SQLiteStore(os.path.join(annotations_dir, SQLITE_FILE_NAME), json_store)
+    raise ValueError(f"Unknown annotation storage {kind}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Export a journal or SQLite annotation backend to per-video JSON files.')
+    parser.add_argument('annotations_dir',
+                        help=('Annotations directory holding the journal or database.'))
+    parser.add_argument('--storage', choices=STORAGE_KINDS[1:], default="journal",
+                        help=('Backend to export.'))
+    parser.add_argument('--out', default=None,
+                        help=('Output directory, defaults to the annotations directory.'))
+
+    args = parser.parse_args()
+    out_dir = args.out or args.annotations_dir
+
+    if args.storage == "journal":
+        docs = replay_journal(os.path.join(args.annotations_dir, JOURNAL_FILE_NAME)).values()
+        count = export_json(docs, out_dir)
+    else:
+        db = SQLiteStore(os.path.join(args.annotations_dir, SQLITE_FILE_NAME), json_store=None)
+        count = export_json(db.all_documents(), out_dir)
+        db.db.close()
+
+    print(f"Exported {count} annotation files to {out_dir}")
@@ -0,0 +1,305 @@
+import json
+import os
+from collections import OrderedDict
+
+
+# No .json suffix, so scripts that glob the annotations directory skip it
+INDEX_FILE_NAME = ".annotation_index"
+INDEX_VERSION = 1
+
+
+def atomic_write_text(path, text):
+    """Write text to a temp file next to path, fsync it and rename it into place.
+
+    Readers either see the previous file or the complete new one, never a
+    truncated document.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path, data):
+    atomic_write_text(path, json.dumps(data))
+
+
+def set_aside(path):
+    """Rename an annotation file that can't be parsed to <path>.corrupt, so a new document never replaces it.
+
+    Returns the new path, None if the file could not be renamed.
+    """
+    corrupt_path = f"{path}.corrupt"
+    number = 1
+    while os.path.exists(corrupt_path):
+        corrupt_path = f"{path}.{number}.corrupt"
+        number += 1
+    try:
+        os.rename(path, corrupt_path)
+    except OSError:
+        return None
+    return corrupt_path
+
+
+class AnnotationIndex:
+    """Maps video names to their annotation file and its mtime.
+
+    The index is persisted as INDEX_FILE_NAME inside the annotations directory
+    and refreshed incrementally: only files that are new or whose size/mtime
+    changed since the last refresh are opened to read the video name.
+    """
+
+    def __init__(self, annotations_dir):
+        self.annotations_dir = annotations_dir
+        self.index_path = os.path.join(annotations_dir, INDEX_FILE_NAME)
+
+        # file name -> {"name": video name, "mtime": st_mtime_ns, "size": st_size}
+        self.files = {}
+        # video name -> file name
+        self.names = {}
+        # Files that exist but could not be read, never written over
+        self.unreadable = set()
+        self.dirty = False
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def path_for(self, name):
+        return os.path.join(self.annotations_dir, self.names[name])
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") != INDEX_VERSION:
+            return
+
+        self.files = data.get("files", {})
+        self.names = {entry["name"]: file_name for file_name, entry in self.files.items()}
+
+    def refresh(self):
+        """Bring the index in line with the annotation files on disk.
+
+        Files that can't be parsed are set aside as .corrupt, files that can't
+        be read at all go to self.unreadable.
+        """
+        self.unreadable = set()
+        seen = set()
+        with os.scandir(self.annotations_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or entry.name == INDEX_FILE_NAME:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                seen.add(entry.name)
+                cached = self.files.get(entry.name)
+                if cached is not None and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                    continue
+
+                try:
+                    with open(entry.path, "r") as f:
+                        name = json.load(f)["name"]
+                except OSError as e:
+                    print(f"Skipping unreadable annotation file {entry.path}: {e}")
+                    self.unreadable.add(entry.name)
+                    continue
+                except (ValueError, KeyError, TypeError) as e:
+                    seen.discard(entry.name)
+                    corrupt_path = set_aside(entry.path)
+                    if corrupt_path is None:
+                        self.unreadable.add(entry.name)
+                    print(f"Skipping corrupt annotation file {entry.path}, kept as {corrupt_path}: {e}")
+                    continue
+
+                self.update(entry.name, name, stat)
+
+        for file_name in set(self.files) - seen:
+            self.remove(file_name)
+
+    def update(self, file_name, name, stat=None):
+        """Record that file_name holds the annotations of name.
+
+        Without a stat result the entry is stored with an unknown mtime, which
+        restat() fills in once the file was actually written.
+        """
+        previous = self.files.get(file_name)
+        if previous is not None and self.names.get(previous["name"]) == file_name:
+            del self.names[previous["name"]]
+
+        if stat is None:
+            self.files[file_name] = {"name": name, "mtime": None, "size": None}
+        else:
+            self.files[file_name] = {"name": name, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+        self.names[name] = file_name
+        self.dirty = True
+
+    def remove(self, file_name):
+        entry = self.files.pop(file_name)
+        if self.names.get(entry["name"]) == file_name:
+            del self.names[entry["name"]]
+        self.dirty = True
+
+    def restat(self):
+        for file_name, entry in self.files.items():
+            if entry["mtime"] is None:
+                try:
+                    stat = os.stat(os.path.join(self.annotations_dir, file_name))
+                except OSError:
+                    continue
+                entry["mtime"] = stat.st_mtime_ns
+                entry["size"] = stat.st_size
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        atomic_write_json(self.index_path, {"version": INDEX_VERSION, "files": self.files})
+        self.dirty = False
+
+
+class AnnotationStore:
+    """Dict-like access to the per-video annotation documents.
+
+    Documents are only parsed when they are looked up, and parsed documents
+    live in a bounded LRU cache. Documents assigned with store[name] = doc are
+    pinned in memory until they are written with save(), so unsaved edits are
+    never evicted.
+
+    With an AnnotationWriter, save() only queues the document and the write
+    happens on the writer thread; close() flushes it.
+    """
+
+    def __init__(self, annotations_dir, cache_size=64, writer=None):
+        self.annotations_dir = annotations_dir
+        self.cache_size = cache_size
+        self.writer = writer
+
+        self.index = AnnotationIndex(annotations_dir)
+        self.index.load()
+        self.index.refresh()
+        self.index.save()
+
+        self._cache = OrderedDict()
+        self._pinned = {}
+
+    def __contains__(self, name):
+        return name in self._pinned or name in self._cache or name in self.index
+
+    def __len__(self):
+        """Number of annotated videos, including documents that were not saved yet"""
+        return len(self.index) + sum(1 for name in self._pinned if name not in self.index)
+
+    def __getitem__(self, name):
+        doc = self.get(name)
+        if doc is None:
+            raise KeyError(name)
+        return doc
+
+    def __setitem__(self, name, doc):
+        self._cache.pop(name, None)
+        self._pinned[name] = doc
+
+    def get(self, name, default=None):
+        if name in self._pinned:
+            return self._pinned[name]
+
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return self._cache[name]
+
+        if name not in self.index:
+            return default
+
+        file_name = self.index.names[name]
+        path = self.index.path_for(name)
+        try:
+            with open(path, "r") as f:
+                doc = json.load(f)
+            if not isinstance(doc, dict):
+                raise ValueError("not a JSON object")
+        except OSError as e:
+            print(f"Could not load annotations of {name}: {e}")
+            self.index.unreadable.add(file_name)
+            return default
+        except ValueError as e:
+            corrupt_path = set_aside(path)
+            if corrupt_path is None:
+                self.index.unreadable.add(file_name)
+            else:
+                self.index.remove(file_name)
+            print(f"Could not load annotations of {name}, kept the file as {corrupt_path}: {e}")
+            return default
+
+        doc.setdefault("annotations", {})
+        doc.setdefault("annotations_frame", {})
+        self._remember(name, doc)
+        return doc
+
+    def reload(self, name):
+        """Forget the cached document of name and look its annotation file up again.
+
+        With leases other annotators write to the same directory, so by the
+        time a video is claimed its index entry and cached copy may be stale.
+        """
+        self._pinned.pop(name, None)
+        self._cache.pop(name, None)
+
+        file_name = self.file_name_for({"name": name})
+        self.index.unreadable.discard(file_name)
+        try:
+            stat = os.stat(os.path.join(self.annotations_dir, file_name))
+        except OSError:
+            if file_name in self.index.files:
+                self.index.remove(file_name)
+            return
+        self.index.update(file_name, name, stat)
+
+    def file_name_for(self, doc):
+        return doc["name"] + ".json"
+
+    def save(self, doc):
+        """Write doc to its JSON file and move it from the pinned set into the cache"""
+        file_name = self.file_name_for(doc)
+        if file_name in self.index.unreadable:
+            print(f"Not writing the annotations of {doc['name']} over {file_name}, which could not be read")
+            return
+        path = os.path.join(self.annotations_dir, file_name)
+        if self.writer is not None:
+            self.writer.submit(path, doc)
+            self.index.update(file_name, doc["name"])
+        else:
+            atomic_write_json(path, doc)
+            self.index.update(file_name, doc["name"], os.stat(path))
+
+        if self._pinned.get(doc["name"]) is doc:
+            del self._pinned[doc["name"]]
+        self._remember(doc["name"], doc)
+
+    def record_annotate(self, doc, key):
+        """Edits reach the JSON files through save(), see annotation_backend for per-edit storage"""
+
+    def record_remove(self, doc, key, frame_key):
+        pass
+
+    def _remember(self, name, doc):
+        self._cache[name] = doc
+        self._cache.move_to_end(name)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.index.restat()
+        self.index.save()
@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from annotation_store import atomic_write_text
+
+
+class AnnotationWriter(threading.Thread):
+    """Write-behind persistence for annotation documents.
+
+    submit() serializes the document and queues it; the writer thread writes
+    it atomically (temp file, fsync, rename). Submitting a path that is still
+    queued replaces the queued document, so repeated saves of the same video
+    cost a single write.
+    """
+
+    def __init__(self):
+        super().__init__(name="AnnotationWriter", daemon=True)
+        self._pending = OrderedDict()
+        self._in_flight = None
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+        self.start()
+
+    def submit(self, path, doc):
+        # Serialize now, the caller keeps editing doc after submitting it
+        text = json.dumps(doc)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("AnnotationWriter is closed")
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = (text, time.monotonic())
+            self._cond.notify_all()
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending) + (self._in_flight is not None)
+
+    def stats(self):
+        """Queue depth and write latencies in milliseconds, measured from submit() to rename"""
+        with self._cond:
+            return {
+                "queue_depth": len(self._pending) + (self._in_flight is not None),
+                "written": self.written,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "last_latency_ms": self.last_latency * 1000,
+                "avg_latency_ms": self.total_latency / self.written * 1000 if self.written else 0.0,
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path, (text, submitted) = self._pending.popitem(last=False)
+                self._in_flight = path
+
+            try:
+                atomic_write_text(path, text)
+                failed = False
+            except OSError as e:
+                print(f"Could not write annotations to {path}: {e}")
+                failed = True
+
+            latency = time.monotonic() - submitted
+            with self._cond:
+                self._in_flight = None
+                if failed:
+                    self.errors += 1
+                else:
+                    self.written += 1
+                    self.last_latency = latency
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                self._cond.notify_all()
+
+    def flush(self):
+        """Block until every queued document is on disk"""
+        with self._cond:
+            while self._pending or self._in_flight is not None:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.join()
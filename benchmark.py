@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import statistics
+import tempfile
+
+# The GUI benchmarks render into offscreen surfaces, set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import cv2
+
+from video_scanner import scan_videos, SUPPORTED_FORMATS
+from annotation_backend import open_annotation_store
+from annotation_store import INDEX_FILE_NAME
+from annotation_writer import AnnotationWriter
+from interval_index import IntervalIndex
+from smart_cut import ffmpeg_available, run
+
+
+# (width, height, frames, gop) of the synthetic test videos, gop None keeps the encoder default
+VIDEO_SPECS = [
+    (320, 240, 250, None),
+    (640, 360, 500, 12),
+    (1280, 720, 250, 250),
+]
+
+
+class Skipped(Exception):
+    """A benchmark that can not run in this environment, e.g. without PyQt5 or libvlc"""
+
+
+def timed(fn, repeat=5, setup=None):
+    """Run fn repeat times and return min/median/mean/max wall time in ms"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return {"min_ms": min(samples), "median_ms": statistics.median(samples),
+            "mean_ms": statistics.mean(samples), "max_ms": max(samples), "repeat": repeat}
+
+
+def make_video(path, width, height, frames, gop=None):
+    """Write a synthetic video with a moving gradient and noise, re-encoded with ffmpeg for a fixed GOP size"""
+    rng = np.random.default_rng(0)
+    ramp = np.tile(np.linspace(0, 255, width, dtype=np.float32), (height, 1))
+    raw_path = path if gop is None or not ffmpeg_available() else path + ".raw.mp4"
+
+    writer = cv2.VideoWriter(raw_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (width, height))
+    for i in range(frames):
+        shade = np.roll(ramp, i * 4, axis=1) + rng.normal(0, 8, (height, width)).astype(np.float32)
+        frame = np.clip(shade, 0, 255).astype(np.uint8)
+        writer.write(cv2.merge([frame, np.roll(frame, i, axis=0), frame[::-1]]))
+    writer.release()
+
+    if raw_path != path:
+        run(["ffmpeg", "-v", "error", "-y", "-i", raw_path, "-c:v", "libx264", "-g", str(gop),
+             "-keyint_min", str(gop), "-sc_threshold", "0", "-pix_fmt", "yuv420p", path])
+        os.remove(raw_path)
+    return path
+
+
+def make_videos(workdir):
+    videos_dir = os.path.join(workdir, "videos")
+    os.makedirs(videos_dir, exist_ok=True)
+    paths = []
+    for width, height, frames, gop in VIDEO_SPECS:
+        path = os.path.join(videos_dir, f"synthetic_{width}x{height}_{frames}_gop{gop or 'default'}.mp4")
+        if not os.path.exists(path):
+            make_video(path, width, height, frames, gop)
+        paths.append((path, frames))
+    return paths
+
+
+def make_document(name, path, events, frames, rng):
+    doc = {"name": name, "path": path, "annotations": {}, "annotations_frame": {}}
+    bounds = sorted(rng.sample(range(frames), min(2 * events, frames)))
+    for i in range(len(bounds) // 2):
+        for event, frame in (("S", bounds[2 * i]), ("E", bounds[2 * i + 1])):
+            key = f"{event}{i + 1}"
+            doc["annotations"][key] = [frame / max(frames - 1, 1)]
+            doc["annotations_frame"][key] = [frame]
+    return doc
+
+
+def make_annotation_dir(directory, count, events=5, videos=None):
+    """count annotation files, of the synthetic videos if given, otherwise of files that do not exist"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(count)
+    for i in range(count):
+        if videos:
+            path, frames = videos[i % len(videos)]
+        else:
+            path, frames = f"/synthetic/video_{i:06d}.mp4", 10000
+        name = f"{i:06d}_{os.path.basename(path)}"
+        with open(os.path.join(directory, name + ".json"), "w") as f:
+            json.dump(make_document(name, path, events, frames, rng), f)
+    return directory
+
+
+def make_video_dir(directory, count):
+    """count empty files with video extensions, the scanner only looks at names"""
+    os.makedirs(directory, exist_ok=True)
+    extensions = sorted(SUPPORTED_FORMATS)
+    for i in range(count):
+        open(os.path.join(directory, f"video_{i:06d}{extensions[i % len(extensions)]}"), "w").close()
+        if i % 7 == 0:
+            open(os.path.join(directory, f"notes_{i:06d}.txt"), "w").close()
+    return directory
+
+
+def bench_scan(workdir, sizes, repeat):
+    results = {}
+    for size in sizes:
+        directory = make_video_dir(os.path.join(workdir, f"scan_{size}"), size)
+        results[str(size)] = timed(lambda: scan_videos(directory), repeat)
+    return results
+
+
+def bench_load(workdir, sizes, repeat):
+    """Opening the annotation store as Player.__init__ does, with and without a persisted index"""
+    results = {}
+    for size in sizes:
+        directory = make_annotation_dir(os.path.join(workdir, f"annotations_{size}"), size)
+        index_path = os.path.join(directory, INDEX_FILE_NAME)
+
+        def drop_index():
+            if os.path.exists(index_path):
+                os.remove(index_path)
+
+        def load():
+            store = open_annotation_store("json", directory)
+            store.get(f"{size // 2:06d}_video_{size // 2:06d}.mp4")
+
+        results[str(size)] = {"cold": timed(load, repeat, setup=drop_index), "warm": timed(load, repeat)}
+    return results
+
+
+def bench_save(workdir, repeat):
+    """saveAnnotation latency on the GUI thread, write-behind and synchronous"""
+    directory = os.path.join(workdir, "save")
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    doc = make_document("video.mp4", "/synthetic/video.mp4", 100, 100000, random.Random(0))
+
+    results = {}
+    writer = AnnotationWriter()
+    store = open_annotation_store("json", directory, writer=writer)
+    results["write_behind"] = timed(lambda: store.save(doc), repeat * 20)
+    start = time.perf_counter()
+    writer.flush()
+    results["write_behind"]["flush_ms"] = (time.perf_counter() - start) * 1000.0
+    store.close()
+
+    store = open_annotation_store("json", directory)
+    results["sync"] = timed(lambda: store.save(doc), repeat * 20)
+    return results
+
+
+def bench_intervals(repeat):
+    """Pairing check cost: rebuilding the interval index per video switch and querying it"""
+    results = {}
+    rng = random.Random(1)
+    for events in (10, 100, 1000):
+        frames = make_document("video.mp4", "", events, 10 * events + 100, rng)["annotations_frame"]
+        index = IntervalIndex.from_annotations(frames)
+        results[str(events)] = {
+            "build": timed(lambda: IntervalIndex.from_annotations(frames), repeat),
+            "unpaired": timed(lambda: [index.unpaired() for _ in range(1000)], repeat),
+            "interval_at": timed(lambda: [index.interval_at(f) for f in range(1000)], repeat),
+        }
+        for key in ("unpaired", "interval_at"):
+            for stat in ("min_ms", "median_ms", "mean_ms", "max_ms"):
+                # Per query, the timing covers 1000 of them
+                results[str(events)][key][stat] /= 1000.0
+    return results
+
+
+def bench_draw_widget(repeat):
+    try:
+        from PyQt5 import QtWidgets
+        from main import MarkWidget
+    except ImportError as e:
+        raise Skipped(str(e))
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    results = {}
+    rng = random.Random(2)
+    for events in (10, 100, 1000):
+        doc = make_document("video.mp4", "", events, 100000, rng)
+        widget = MarkWidget()
+        widget.resize(1920, 30)
+        widget.setAnnotations(doc["annotations"])
+        results[str(events)] = {
+            "render": timed(widget.renderCache, repeat),
+            "playhead": timed(lambda: [widget.setPlayhead(i / 100.0) for i in range(100)], repeat),
+        }
+        app.processEvents()
+    return results
+
+
+def bench_open_file(videos, repeat):
+    """The media part of OpenFile: taking a cold or prefetched media and handing it to the player"""
+    try:
+        import vlc
+        from media_prefetcher import MediaPrefetcher, is_parsed
+    except (ImportError, OSError) as e:
+        raise Skipped(str(e))
+
+    instance = vlc.Instance("--no-xlib", "--vout=dummy", "--aout=dummy")
+    player = instance.media_player_new()
+    paths = [path for path, _ in videos]
+
+    def open_path(prefetcher, path):
+        media = prefetcher.take(path)
+        player.set_media(media)
+        return media
+
+    def cold():
+        prefetcher = MediaPrefetcher(instance, ahead=0, behind=0)
+        media = open_path(prefetcher, paths[0])
+        while not is_parsed(media):
+            time.sleep(0.001)
+        media.release()
+
+    prefetcher = MediaPrefetcher(instance, ahead=1, behind=0)
+
+    def warm_setup():
+        prefetcher.prefetch(paths, 0)
+        while not all(is_parsed(m) for m in prefetcher._pool.values()):
+            time.sleep(0.001)
+
+    def warm():
+        open_path(prefetcher, paths[1]).release()
+
+    results = {"cold_until_parsed": timed(cold, repeat), "prefetched": timed(warm, repeat, setup=warm_setup)}
+    prefetcher.release_all()
+    player.release()
+    instance.release()
+    return results
+
+
+def bench_cut_clip(workdir, videos, workers):
+    from cut_clip import export_clips
+
+    json_dir = make_annotation_dir(os.path.join(workdir, "clip_annotations"), len(videos) * 2, 3, videos)
+    results = {}
+    modes = ["reencode"] + (["smartcut"] if ffmpeg_available() else [])
+    for mode in modes:
+        export_path = os.path.join(workdir, f"clips_{mode}")
+        shutil.rmtree(export_path, ignore_errors=True)
+        totals = export_clips(json_dir, export_path, workers, mode=mode, force=True)
+        results[mode] = {"seconds": totals["seconds"], "clips": totals["clips"], "frames": totals["frames"],
+                         "clips_per_second": totals["clips"] / totals["seconds"],
+                         "frames_per_second": totals["frames"] / totals["seconds"]}
+
+        # Second run with everything up to date measures the manifest check
+        start = time.perf_counter()
+        export_clips(json_dir, export_path, workers, mode=mode)
+        results[mode]["incremental_seconds"] = time.perf_counter() - start
+    return results
+
+
+def compare(results, baseline, path=""):
+    """Print median_ms of every benchmark next to the baseline, slower than 1.1x is flagged"""
+    for key, value in results.items():
+        if not isinstance(value, dict) or key not in baseline or not isinstance(baseline[key], dict):
+            continue
+        name = f"{path}/{key}" if path else key
+        if "median_ms" in value and "median_ms" in baseline[key]:
+            ratio = value["median_ms"] / max(baseline[key]["median_ms"], 1e-9)
+            flag = "  SLOWER" if ratio > 1.1 else ""
+            print(f"{name:50s} {baseline[key]['median_ms']:12.4f} -> {value['median_ms']:12.4f} ms  "
+                  f"x{ratio:.2f}{flag}")
+        else:
+            compare(value, baseline[key], name)
+
+
+BENCHMARKS = ("scan", "load", "save", "intervals", "draw_widget", "open_file", "cut_clip")
+
+
+def run_benchmarks(workdir, names, sizes, repeat, workers):
+    videos = make_videos(workdir) if {"open_file", "cut_clip"} & set(names) else None
+    runners = {
+        "scan": lambda: bench_scan(workdir, sizes, repeat),
+        "load": lambda: bench_load(workdir, sizes, repeat),
+        "save": lambda: bench_save(workdir, repeat),
+        "intervals": lambda: bench_intervals(repeat),
+        "draw_widget": lambda: bench_draw_widget(repeat),
+        "open_file": lambda: bench_open_file(videos, repeat),
+        "cut_clip": lambda: bench_cut_clip(workdir, videos, workers),
+    }
+
+    results = {}
+    for name in names:
+        print(f"Running {name} ...")
+        try:
+            results[name] = runners[name]()
+        except Skipped as e:
+            print(f"Skipped {name}: {e}")
+            results[name] = {"skipped": str(e)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark the player and exporter hot paths on synthetic media.')
+    parser.add_argument('--output', default="benchmark_results.json",
+                        help=('File to write the results to.'))
+    parser.add_argument('--baseline', default=None,
+                        help=('Results of an earlier run to compare against.'))
+    parser.add_argument('--only', action='append', choices=BENCHMARKS, default=None,
+                        help=('Run only this benchmark, can be given several times.'))
+    parser.add_argument('--sizes', default="100,1000,10000",
+                        help=('Comma separated numbers of files for the scan and load benchmarks, up to 100000.'))
+    parser.add_argument('--repeat', type=int, default=5,
+                        help=('Runs per measurement.'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help=('Worker processes of the clip export benchmark.'))
+    parser.add_argument('--workdir', default=None,
+                        help=('Directory for the synthetic data, kept between runs. A temporary one by default.'))
+
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pia_benchmark_")
+    try:
+        results = run_benchmarks(workdir, args.only or list(BENCHMARKS), sizes, args.repeat, args.workers)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                 "platform": platform.platform(), "cpu_count": os.cpu_count(), "numpy": np.__version__,
+                 "opencv": cv2.__version__, "ffmpeg": ffmpeg_available(), "sizes": sizes, "repeat": args.repeat},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            compare(results, json.load(f)["results"])
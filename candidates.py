@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frame_index import cache_key
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pia_video_annotation_tool", "candidates")
+
+# Rows of a scores array
+CUT, MOTION = 0, 1
+
+# Colour histograms use the top 2 bits of each channel, 64 bins
+HISTOGRAM_BITS = 2
+
+
+def frame_chunks(video_path, width=64, chunk=256):
+    """Every frame of video_path scaled down to width pixels, in (n, h, w, 3) uint8 chunks"""
+    import cv2
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        return
+    try:
+        frames = []
+        size = None
+        while video.grab():
+            ok, frame = video.retrieve()
+            if not ok:
+                break
+            if size is None:
+                size = (width, max(int(round(frame.shape[0] * width / frame.shape[1])), 1))
+            frames.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+            if len(frames) == chunk:
+                yield np.stack(frames)
+                frames = []
+        if frames:
+            yield np.stack(frames)
+    finally:
+        video.release()
+
+
+def histograms(frames):
+    """Normalized colour histogram of each frame of a (n, h, w, 3) chunk, one bincount for the whole chunk"""
+    n = len(frames)
+    bins = 1 << (3 * HISTOGRAM_BITS)
+    levels = (frames >> (8 - HISTOGRAM_BITS)).astype(np.int32)
+    codes = (levels[..., 0] << (2 * HISTOGRAM_BITS)) | (levels[..., 1] << HISTOGRAM_BITS) | levels[..., 2]
+    codes += (np.arange(n, dtype=np.int32) * bins)[:, None, None]
+    counts = np.bincount(codes.ravel(), minlength=n * bins).reshape(n, bins)
+    return counts / float(frames.shape[1] * frames.shape[2])
+
+
+def analyze_video(video_path, scores_path, width=64):
+    """Per-frame scene change and motion scores of video_path, saved as a (2, frames) float16 array.
+
+    Runs in a worker process. Row CUT is half the L1 distance between the
+    colour histograms of a frame and the previous one (0: same colours, 1:
+    nothing in common), row MOTION the mean absolute difference of their
+    grey levels scaled to 0..1. Both are 0 for the first frame. Returns
+    scores_path, or None if the video has no readable frames.
+    """
+    cut_parts = []
+    motion_parts = []
+    previous_hist = None
+    previous_grey = None
+    for frames in frame_chunks(video_path, width):
+        grey = frames.astype(np.float32).mean(axis=3)
+        hist = histograms(frames)
+        if previous_grey is not None:
+            grey = np.concatenate([previous_grey, grey])
+            hist = np.concatenate([previous_hist, hist])
+        else:
+            cut_parts.append(np.zeros(1, np.float32))
+            motion_parts.append(np.zeros(1, np.float32))
+
+        cut_parts.append(0.5 * np.abs(np.diff(hist, axis=0)).sum(axis=1))
+        motion_parts.append(np.abs(np.diff(grey, axis=0)).mean(axis=(1, 2)) / 255.0)
+        previous_grey = grey[-1:]
+        previous_hist = hist[-1:]
+
+    if not cut_parts:
+        return None
+
+    scores = np.stack([np.concatenate(cut_parts), np.concatenate(motion_parts)]).astype(np.float16)
+    tmp_path = f"{scores_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, scores)
+    os.replace(tmp_path, scores_path)
+    return scores_path
+
+
+def find_candidates(scores, cut_threshold=0.35, motion_window=5, min_motion=1 / 1024.0, min_gap=5):
+    """Sorted frame numbers where an event likely starts or ends: scene changes and motion onsets and stops.
+
+    A scene change is a frame whose CUT score reaches cut_threshold and is the
+    highest of its neighbours. Motion is active where the MOTION score,
+    smoothed over motion_window frames, is above the median plus three
+    median absolute deviations of the video (and at least min_motion); the
+    frames where it switches on or off are candidates, unless they are
+    within min_gap frames of a scene change, whose frame differences they
+    usually are.
+    """
+    cut = scores[CUT].astype(np.float32)
+    motion = scores[MOTION].astype(np.float32)
+    if len(cut) < 3:
+        return np.zeros(0, np.int64)
+
+    peaks = (cut[1:-1] >= cut_threshold) & (cut[1:-1] >= cut[:-2]) & (cut[1:-1] >= cut[2:])
+    cuts = np.flatnonzero(peaks) + 1
+
+    motion[cut >= cut_threshold] = 0
+    smooth = np.convolve(motion, np.ones(motion_window, np.float32) / motion_window, mode="same")
+    median = np.median(smooth)
+    threshold = max(median + 3 * np.median(np.abs(smooth - median)), min_motion)
+    active = smooth > threshold
+    switches = np.flatnonzero(active[1:] != active[:-1]) + 1
+
+    if len(cuts):
+        following = np.searchsorted(cuts, switches)
+        after = cuts[np.minimum(following, len(cuts) - 1)]
+        before = cuts[np.maximum(following - 1, 0)]
+        switches = switches[np.minimum(np.abs(after - switches), np.abs(switches - before)) >= min_gap]
+    return np.union1d(cuts, switches)
+
+
+class CandidateCache:
+    """Scene change and motion scores of videos with their candidate frames, one .npy per video keyed like the frame index.
+
+    Missing scores are computed in a process pool. get() never blocks, and
+    on_ready(video_path) is called from a pool thread when scheduled scores
+    are done. Loaded scores and candidates are kept for the last few videos.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, width=64, max_workers=2, keep=8, on_ready=None):
+        self.cache_dir = cache_dir
+        self.width = width
+        self.keep = keep
+        self.on_ready = on_ready
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Forking a process that runs Qt and other threads can deadlock the child, start workers fresh
+        self._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._failed = set()
+        self._loaded = {}
+
+    def scores_path(self, video_path):
+        return os.path.join(self.cache_dir, f"{cache_key(video_path)}_{self.width}.npy")
+
+    def get(self, video_path):
+        """(scores, candidate frames) if the scores are computed, otherwise schedule them and return None"""
+        loaded = self._loaded.get(video_path)
+        if loaded is not None:
+            return loaded
+        try:
+            scores_path = self.scores_path(video_path)
+        except OSError:
+            return None
+        if os.path.exists(scores_path):
+            scores = np.load(scores_path)
+            loaded = self._loaded[video_path] = (scores, find_candidates(scores))
+            while len(self._loaded) > self.keep:
+                del self._loaded[next(iter(self._loaded))]
+            return loaded
+        with self._lock:
+            failed = video_path in self._failed
+        if failed:
+            return None
+
+        self._schedule(video_path, scores_path)
+        return None
+
+    def request(self, video_paths):
+        """Compute the scores of upcoming videos ahead of time"""
+        for video_path in video_paths:
+            with self._lock:
+                failed = video_path in self._failed
+            if video_path in self._loaded or failed:
+                continue
+            try:
+                scores_path = self.scores_path(video_path)
+            except OSError:
+                continue
+            if not os.path.exists(scores_path):
+                self._schedule(video_path, scores_path)
+
+    def _schedule(self, video_path, scores_path):
+        with self._lock:
+            if video_path in self._futures:
+                return
+            future = self._executor.submit(analyze_video, video_path, scores_path, self.width)
+            self._futures[video_path] = future
+        future.add_done_callback(lambda f, path=video_path: self._done(path, f))
+
+    def _done(self, video_path, future):
+        with self._lock:
+            self._futures.pop(video_path, None)
+
+        try:
+            scores_path = future.result()
+        except Exception as e:
+            print(f"Could not analyze {video_path}: {e}")
+            return
+
+        if scores_path is None:
+            with self._lock:
+                self._failed.add(video_path)
+        elif self.on_ready is not None:
+            self.on_ready(video_path)
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+        self._executor.shutdown(wait=False)
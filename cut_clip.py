@@ -1,44 +1,23 @@
 import os
 import json
+import time
+import fnmatch
+import argparse
+import heapq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import cv2
 
-# Define the path to the JSON files
-JSON_PATH = "C:\\Users\\rahad\\Downloads\\Abuse-20240829T064653Z-001\\Abuse"
-
-# Find all .json files in the directory
-json_files = [f for f in os.listdir(JSON_PATH) if f.endswith('.json')]
-
-export_path = "./"
-for json_file in json_files:
-    # Construct full path to the JSON file
-    json_file_path = os.path.join(JSON_PATH, json_file)
-    
-    # Load the JSON data
-    with open(json_file_path, 'r') as f:
-        json_data = json.load(f)
-    
-    # Extract the video path
-    video_path = json_data["path"]
-    video_name = os.path.basename(video_path)
-    
-    # Read the video using OpenCV
-    video = cv2.VideoCapture(video_path)
-    
-    # Check if the video was successfully opened
-    if not video.isOpened():
-        raise ValueError(f"Error opening video file: {video_path}")
-    
-    # Find the total number of frames
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    # Extract annotation pairs from the JSON data
-    annotations = json_data.get("annotations_frame", {})
-    
-    # Ensure the annotation pairs exist
-    if not annotations:
-        print(f"No annotation pairs found in {video_name}")
-        continue
-    
+from frame_index import load_frame_index
+from smart_cut import StreamInfo, ffmpeg_available, smart_cut
+from export_manifest import ExportManifest, clip_is_current, file_signature, pair_hash
+from instrumentation import metrics
+
+EXPORT_MODES = ("reencode", "smartcut")
+
+
+def annotation_pairs(annotations):
+    """Return the (start_frame, end_frame) pairs of the S<i>/E<i> keys of an annotations_frame dict"""
     # Make annotation pairs list
     pairs_list = []
     for key in annotations:
@@ -47,46 +26,322 @@ for json_file in json_files:
             E_key = f"E{index}"
             S_value = annotations[key][0]
             E_value = annotations.get(E_key, [None])[0]
-            
+
             if E_value is not None:
                 pairs_list.append((int(S_value), int(E_value)))
             else:
                 raise ValueError(f"Missing corresponding 'E' value for 'S{index}' in annotations.")
-    
-    # Print the pairs list
-    print(f"Video: {video_name}")
-    print("Annotation Pairs List:")
-    print(pairs_list)
-    
-    # Loop through each pair and create video clips
-    for pair in pairs_list:
-        start_frame = pair[0]
-        end_frame = pair[1]
-        
-        # Set the video to the start frame
-        video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-        
-        # Initialize video writer
-        clip_name = f"{video_name}_{start_frame}_{end_frame}.mp4"
-        output_path = os.path.join(export_path, clip_name)
-        fps = video.get(cv2.CAP_PROP_FPS)
-        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        # Write frames from start_frame to end_frame
-        for frame_num in range(start_frame, end_frame + 1):
+    return pairs_list
+
+
+def clip_file_name(video_name, start_frame, end_frame):
+    return f"{video_name}_{start_frame}_{end_frame}.mp4"
+
+
+def export_video(json_file_path, export_path, mode="reencode", previous=None, verify=False):
+    """Export the annotated clips of one annotation file.
+
+    Runs in a worker process. previous is the manifest entry of the last run:
+    clips it lists that are still up to date are kept, clips of pairs that no
+    longer exist are removed. Returns a dict with the video name, the number
+    of clips and frames written, the new manifest entry and an error message
+    if the video failed. Clips that could not be written completely, e.g.
+    because a mark is past the end of the video, are listed in "incomplete"
+    and left out of the manifest, so only they are tried again next time.
+    """
+    result = {"json": json_file_path, "video": None, "clips": 0, "frames": 0, "decoded": 0,
+              "skipped": 0, "removed": 0, "written": [], "incomplete": [], "entry": None, "error": None,
+              "pid": os.getpid(), "started": time.perf_counter(), "seconds": 0.0}
+    try:
+        json_signature = file_signature(json_file_path)
+
+        # Load the JSON data
+        with open(json_file_path, 'r') as f:
+            json_data = json.load(f)
+
+        # Extract the video path
+        video_path = json_data["path"]
+        video_name = os.path.basename(video_path)
+        result["video"] = video_name
+
+        # Extract annotation pairs from the JSON data
+        annotations = json_data.get("annotations_frame", {})
+
+        # Ensure the annotation pairs exist
+        if not annotations:
+            print(f"No annotation pairs found in {video_name}")
+            pairs_list = []
+            source = None
+        else:
+            pairs_list = annotation_pairs(annotations)
+            source = dict(file_signature(video_path), path=video_path)
+
+        entry = {"json": os.path.basename(json_file_path), "json_signature": json_signature, "mode": mode,
+                 "source": source, "clips": {}}
+
+        # Keep the clips that are up to date, only the others are exported
+        todo = []
+        for start_frame, end_frame in sorted(set(pairs_list)):
+            clip_name = clip_file_name(video_name, start_frame, end_frame)
+            if clip_is_current(previous, clip_name, pair_hash(start_frame, end_frame, mode), source, export_path):
+                entry["clips"][clip_name] = previous["clips"][clip_name]
+                result["skipped"] += 1
+            else:
+                todo.append((start_frame, end_frame))
+
+        # Remove the clips of pairs that changed or were deleted
+        if previous is not None:
+            wanted = set(entry["clips"]) | set(clip_file_name(video_name, s, e) for s, e in todo)
+            for clip_name, clip in previous["clips"].items():
+                if clip_name not in wanted:
+                    try:
+                        os.remove(os.path.join(export_path, clip["output"]))
+                        result["removed"] += 1
+                    except OSError:
+                        pass
+
+        if todo:
+            export_pairs_of_video(video_path, video_name, todo, export_path, mode, result, verify)
+
+        for start_frame, end_frame in result["written"]:
+            clip_name = clip_file_name(video_name, start_frame, end_frame)
+            entry["clips"][clip_name] = {
+                "start": start_frame,
+                "end": end_frame,
+                "pair_hash": pair_hash(start_frame, end_frame, mode),
+                "output": clip_name,
+                "output_size": os.path.getsize(os.path.join(export_path, clip_name)),
+            }
+        entry["incomplete"] = result["incomplete"]
+        result["entry"] = entry
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["seconds"] = time.perf_counter() - result["started"]
+    return result
+
+
+def export_pairs_of_video(video_path, video_name, pairs_list, export_path, mode, result, verify=False):
+    if mode == "smartcut":
+        info = StreamInfo(video_path)
+        if info.can_smart_cut():
+            export_pairs_smart(video_path, video_name, pairs_list, export_path, info, result, verify)
+            return
+        print(f"{video_name}: {info.codec_name} ({info.profile}) streams can not be smart cut, re-encoding")
+
+    # Read the video using OpenCV
+    video = cv2.VideoCapture(video_path)
+
+    # Check if the video was successfully opened
+    if not video.isOpened():
+        raise ValueError(f"Error opening video file: {video_path}")
+
+    try:
+        export_pairs(video, video_name, pairs_list, export_path, result)
+    finally:
+        # Release the video file
+        video.release()
+
+
+def export_pairs(video, video_name, pairs_list, export_path, result):
+    """Decode the video once from the start and feed each frame to every clip that contains it.
+
+    Pairs are sorted by start frame; a clip's writer is opened when the
+    decoder reaches its start and closed after its end, so overlapping pairs
+    share the decoded frames and no seek is needed. Frames outside every pair
+    are only grabbed, not retrieved, and decoding stops after the last end.
+    """
+    fps = video.get(cv2.CAP_PROP_FPS)
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
+    intervals = sorted(set(pairs_list))
+    last_frame = max(end_frame for _, end_frame in intervals)
+    complete = True
+
+    # (end_frame, start_frame, writer) of the clips being written, smallest end first
+    open_writers = []
+    next_interval = 0
+    frame_num = 0
+    while frame_num <= last_frame:
+        while next_interval < len(intervals) and intervals[next_interval][0] <= frame_num:
+            start_frame, end_frame = intervals[next_interval]
+            output_path = os.path.join(export_path, clip_file_name(video_name, start_frame, end_frame))
+            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+            heapq.heappush(open_writers, (end_frame, start_frame, next_interval, out))
+            next_interval += 1
+
+        while open_writers and open_writers[0][0] < frame_num:
+            end_frame, start_frame, _, out = heapq.heappop(open_writers)
+            out.release()
+            result["clips"] += 1
+            result["written"].append((start_frame, end_frame))
+
+        if open_writers:
             ret, frame = video.read()
-            if not ret:
-                print(f"Error reading frame {frame_num} from {video_name}")
-                break
+        else:
+            ret, frame = video.grab(), None
+        if not ret:
+            complete = False
+            break
+        result["decoded"] += 1
+
+        for _, _, _, out in open_writers:
             out.write(frame)
-        
-        # Release the video writer
+            result["frames"] += 1
+        frame_num += 1
+
+    # Release the video writers, those still open when a read failed are cut short
+    while open_writers:
+        end_frame, start_frame, _, out = heapq.heappop(open_writers)
         out.release()
-        print(f"Exported clip: {output_path}")
+        if complete:
+            result["clips"] += 1
+            result["written"].append((start_frame, end_frame))
+        else:
+            result["incomplete"].append(f"{clip_file_name(video_name, start_frame, end_frame)}: truncated, "
+                                        f"frame {frame_num} could not be read")
+
+    for start_frame, end_frame in intervals[next_interval:]:
+        result["incomplete"].append(f"{clip_file_name(video_name, start_frame, end_frame)}: skipped, "
+                                    f"frame {frame_num} could not be read")
+
+
+def export_pairs_smart(video_path, video_name, pairs_list, export_path, info, result, verify=False):
+    """Cut the pairs with ffmpeg, stream-copying whole GOPs and re-encoding only the edges, see smart_cut"""
+    frame_index = load_frame_index(video_path)
+    if frame_index is None:
+        raise ValueError(f"Could not index the frames of {video_path}")
+
+    frame_count = len(frame_index)
+    for start_frame, end_frame in pairs_list:
+        clip_name = clip_file_name(video_name, start_frame, end_frame)
+        if start_frame >= frame_count:
+            result["incomplete"].append(f"{clip_name}: skipped, the video has {frame_count} frames")
+            continue
+        try:
+            result["frames"] += smart_cut(video_path, start_frame, end_frame,
+                                          os.path.join(export_path, clip_name), frame_index, info, verify)
+        except RuntimeError as e:
+            result["incomplete"].append(f"{clip_name}: failed, {e}")
+            continue
+        if end_frame >= frame_count:
+            result["incomplete"].append(f"{clip_name}: truncated, the video has {frame_count} frames")
+            continue
+        result["clips"] += 1
+        result["written"].append((start_frame, end_frame))
+
+
+def select_json_files(json_dir, include="*.json", exclude=()):
+    """Annotation files in json_dir matching the include glob and none of the exclude globs"""
+    json_files = []
+    for f in sorted(os.listdir(json_dir)):
+        if not f.endswith('.json') or not fnmatch.fnmatch(f, include):
+            continue
+        if any(fnmatch.fnmatch(f, pattern) for pattern in exclude):
+            continue
+        json_files.append(os.path.join(json_dir, f))
+    return json_files
+
+
+def export_clips(json_dir, export_path, workers=None, include="*.json", exclude=(), mode="reencode", force=False,
+                 verify=False):
+    """Export the clips of every selected annotation file, one video per worker process.
+
+    Videos whose annotation file, source video and clips are unchanged since
+    the last run (according to the export manifest) are skipped, unless force.
+    """
+    json_files = select_json_files(json_dir, include, exclude)
+    os.makedirs(export_path, exist_ok=True)
+    manifest = ExportManifest(export_path)
+
+    totals = {"videos": 0, "failed": 0, "clips": 0, "frames": 0, "decoded": 0, "skipped": 0, "removed": 0,
+              "incomplete": 0, "up_to_date": 0}
+    if not force:
+        pending = [f for f in json_files if not manifest.is_current(f, mode)]
+        totals["up_to_date"] = len(json_files) - len(pending)
+        json_files = pending
+
+    start = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(export_video, json_file, export_path, mode,
+                                       None if force else manifest.get(json_file), verify): json_file
+                       for json_file in json_files}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process died, e.g. the decoder crashed on a broken file
+                    result = {"json": futures[future], "video": None, "clips": 0, "frames": 0, "decoded": 0,
+                              "skipped": 0, "removed": 0, "written": [], "incomplete": [], "entry": None,
+                              "error": f"{type(e).__name__}: {e}"}
+                totals["videos"] += 1
+                if "started" in result:
+                    # One trace row per worker process
+                    metrics.record("export_video", result["started"], result["seconds"], pid=result["pid"], tid=0)
+                for key in ("clips", "frames", "decoded", "skipped", "removed"):
+                    totals[key] += result[key]
+
+                if result["error"] is not None:
+                    totals["failed"] += 1
+                    print(f"[{totals['videos']}/{len(json_files)}] FAILED {result['json']}: {result['error']}")
+                else:
+                    manifest.record(result["entry"])
+                    print(f"[{totals['videos']}/{len(json_files)}] {result['video']}: "
+                          f"{result['clips']} clips, {result['frames']} frames, {result['decoded']} decoded, "
+                          f"{result['skipped']} up to date, {result['removed']} removed")
+                totals["incomplete"] += len(result["incomplete"])
+                for problem in result["incomplete"]:
+                    print(f"    {problem}")
+    finally:
+        manifest.close()
+
+    elapsed = max(time.monotonic() - start, 1e-9)
+    totals["seconds"] = elapsed
+    print(f"Exported {totals['clips']} clips ({totals['frames']} frames) from {totals['videos']} videos "
+          f"in {elapsed:.1f} s: {totals['clips'] / elapsed:.2f} clips/s, {totals['frames'] / elapsed:.1f} frames/s, "
+          f"{totals['decoded']} frames decoded, {totals['failed']} failed")
+    print(f"Kept {totals['up_to_date']} unchanged videos and {totals['skipped']} unchanged clips, "
+          f"removed {totals['removed']} outdated clips, {totals['incomplete']} clips incomplete")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Export the annotated S/E intervals of every video as clips.')
+    parser.add_argument('json_dir',
+                        help=('Directory with the annotation JSON files.'))
+    parser.add_argument('--output', default="./",
+                        help=('Directory to write the clips to.'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help=('Number of videos exported in parallel.'))
+    parser.add_argument('--include', default="*.json",
+                        help=('Only export annotation files matching this glob.'))
+    parser.add_argument('--exclude', action='append', default=[],
+                        help=('Skip annotation files matching this glob, can be given several times.'))
+    parser.add_argument('--mode', choices=EXPORT_MODES, default="reencode",
+                        help=('reencode decodes and re-encodes every frame with OpenCV, smartcut uses ffmpeg to '
+                              'stream-copy whole GOPs and re-encode only the edges of each clip, keeping audio.'))
+
+    parser.add_argument('--verify', action='store_true',
+                        help=('With --mode smartcut, decode every clip to check its frames instead of only counting '
+                              'its packets. Slower, also catches clips that do not decode cleanly.'))
+    parser.add_argument('--force', action='store_true',
+                        help=('Export every clip again, even if the export manifest says it is up to date.'))
+    parser.add_argument('--trace', default=None,
+                        help=('Write the export time of every video to this file as a Chrome trace.'))
 
-    # Release the video file
-    video.release()
+    args = parser.parse_args()
+    if args.mode == "smartcut" and not ffmpeg_available():
+        parser.error("--mode smartcut needs ffmpeg and ffprobe on the PATH")
+    if args.trace:
+        metrics.enable(args.trace)
+    export_clips(args.json_dir, args.output, args.workers, args.include, args.exclude, args.mode, args.force,
+                 args.verify)
+    if args.trace:
+        for name, stats in metrics.stats().items():
+            print(f"{name}: {stats['count']} runs, p50 {stats['p50']:.1f} ms, p95 {stats['p95']:.1f} ms, "
+                  f"max {stats['max']:.1f} ms")
+        metrics.close()
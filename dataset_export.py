@@ -0,0 +1,239 @@
+import os
+import json
+import math
+import time
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from frame_index import load_frame_index
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Per-interval columns, video_path and fps are looked up through video_id
+INTERVAL_COLUMNS = {
+    "video_id": np.int32,
+    "event_index": np.int32,
+    "start_frame": np.int64,
+    "end_frame": np.int64,
+    "start_position": np.float64,
+    "end_position": np.float64,
+}
+COLUMNS = ("video_id", "video_path", "event_index", "start_frame", "end_frame",
+           "start_position", "end_position", "fps")
+
+
+def document_intervals(doc):
+    """(event_index, start_frame, end_frame, start_position, end_position) of the paired S/E keys of a document.
+
+    Unpaired keys are left out, positions are NaN when the document has no
+    annotations entry for the key.
+    """
+    frames = doc.get("annotations_frame", {})
+    positions = doc.get("annotations", {})
+    intervals = []
+    for key, value in frames.items():
+        if key[:1] != "S" or not key[1:].isdigit():
+            continue
+        end = frames.get(f"E{key[1:]}")
+        if end is None:
+            continue
+        intervals.append((int(key[1:]), int(value[0]), int(end[0]),
+                          float(positions.get(key, [math.nan])[0]),
+                          float(positions.get(f"E{key[1:]}", [math.nan])[0])))
+    intervals.sort()
+    return intervals
+
+
+def video_fps(video_path):
+    """Frame rate of a video from its cached frame index, or from OpenCV. NaN if it can not be read."""
+    index = load_frame_index(video_path, build=False)
+    if index is not None and len(index) > 1:
+        duration_ms = index.time_of(len(index) - 1) - index.time_of(0)
+        if duration_ms > 0:
+            return (len(index) - 1) * 1000.0 / duration_ms
+
+    import cv2
+    video = cv2.VideoCapture(video_path)
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS) if video.isOpened() else 0
+    finally:
+        video.release()
+    return fps if fps > 0 else math.nan
+
+
+def collect_intervals(json_dir, probe_fps=True, workers=8):
+    """Read every annotation file of json_dir once and return (columns, video_paths, fps)"""
+    video_paths = []
+    rows = []
+    for entry in sorted(os.scandir(json_dir), key=lambda e: e.name):
+        if not entry.name.endswith(".json") or not entry.is_file():
+            continue
+        try:
+            with open(entry.path, "r") as f:
+                doc = json.load(f)
+            intervals = document_intervals(doc)
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            print(f"Skipping {entry.name}: {type(e).__name__}: {e}")
+            continue
+
+        video_id = len(video_paths)
+        video_paths.append(doc.get("path", ""))
+        rows.extend((video_id,) + interval for interval in intervals)
+
+    if rows:
+        table = list(zip(*rows))
+    else:
+        table = [()] * len(INTERVAL_COLUMNS)
+    columns = {name: np.asarray(values, dtype=dtype)
+               for (name, dtype), values in zip(INTERVAL_COLUMNS.items(), table)}
+
+    if probe_fps:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fps = np.fromiter(executor.map(video_fps, video_paths), np.float64, len(video_paths))
+    else:
+        fps = np.full(len(video_paths), math.nan)
+
+    return columns, video_paths, fps
+
+
+def write_npz(path, columns, video_paths, fps):
+    # Stored uncompressed so the loader can memory-map every array
+    np.savez(path, video_paths=np.asarray(video_paths, dtype=str), video_fps=fps, **columns)
+
+
+def write_parquet(path, columns, video_paths, fps):
+    video_ids = columns["video_id"]
+    table = pyarrow.table({
+        "video_id": video_ids,
+        "video_path": pyarrow.DictionaryArray.from_arrays(pyarrow.array(video_ids),
+                                                          pyarrow.array(video_paths, pyarrow.string())),
+        "event_index": columns["event_index"],
+        "start_frame": columns["start_frame"],
+        "end_frame": columns["end_frame"],
+        "start_position": columns["start_position"],
+        "end_position": columns["end_position"],
+        "fps": fps[video_ids] if len(video_ids) else np.empty(0),
+    })
+    pyarrow.parquet.write_table(table, path)
+
+
+def export_intervals(json_dir, output_path, probe_fps=True, workers=8):
+    """Write the S/E intervals of every annotation file of json_dir to output_path (.npz or .parquet)"""
+    columns, video_paths, fps = collect_intervals(json_dir, probe_fps, workers)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    if output_path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("Writing Parquet needs pyarrow")
+        write_parquet(tmp_path, columns, video_paths, fps)
+    else:
+        with open(tmp_path, "wb") as f:
+            write_npz(f, columns, video_paths, fps)
+    os.replace(tmp_path, output_path)
+    return len(columns["video_id"]), len(video_paths)
+
+
+def _mmap_npz(path):
+    """Memory-map the arrays of an uncompressed .npz, np.load ignores mmap_mode for archives"""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as raw:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+
+            with archive.open(info) as member:
+                version = np.lib.format.read_magic(member)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member)
+                header_size = member.tell()
+
+            # The data starts after the local file header, its name and extra field
+            raw.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(raw.read(4), "<u2")
+            offset = info.header_offset + 30 + int(name_length) + int(extra_length) + header_size
+
+            if dtype.hasobject or 0 in shape:
+                arrays[name] = np.empty(shape, dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
+
+
+class IntervalDataset:
+    """Read-only view of an exported interval file.
+
+    Columns are memory-mapped numpy arrays (or Arrow columns converted
+    without copying where possible), dataset[name] returns one of COLUMNS.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(".parquet"):
+            if pyarrow is None:
+                raise RuntimeError("Reading Parquet needs pyarrow")
+            table = pyarrow.parquet.read_table(path, memory_map=True)
+            self.columns = {name: table.column(name).to_numpy() for name in INTERVAL_COLUMNS}
+            paths = table.column("video_path").combine_chunks()
+            self.video_paths = np.asarray(paths.dictionary.to_pylist(), dtype=str)
+            fps = table.column("fps").to_numpy()
+            self.video_fps = np.full(len(self.video_paths), math.nan)
+            self.video_fps[self.columns["video_id"]] = fps
+        else:
+            arrays = _mmap_npz(path)
+            self.video_paths = arrays.pop("video_paths")
+            self.video_fps = arrays.pop("video_fps")
+            self.columns = arrays
+
+    def __len__(self):
+        return len(self.columns["video_id"])
+
+    def __getitem__(self, name):
+        if name == "video_path":
+            return self.video_paths[self.columns["video_id"]]
+        if name == "fps":
+            return self.video_fps[self.columns["video_id"]]
+        return self.columns[name]
+
+    def intervals_of(self, video_id):
+        """Row indices of the intervals of one video, rows are grouped by video_id"""
+        video_ids = self.columns["video_id"]
+        return np.arange(np.searchsorted(video_ids, video_id, "left"),
+                         np.searchsorted(video_ids, video_id, "right"))
+
+
+def load_intervals(path):
+    return IntervalDataset(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Export the annotated S/E intervals of a directory as one columnar file.')
+    parser.add_argument('json_dir',
+                        help=('Directory with the annotation JSON files.'))
+    parser.add_argument('--output', default="./intervals.npz",
+                        help=('Output file, .npz or .parquet (needs pyarrow).'))
+    parser.add_argument('--no_fps', action='store_true',
+                        help=('Do not read the frame rate of the videos, the fps column is NaN.'))
+    parser.add_argument('--workers', type=int, default=8,
+                        help=('Number of videos probed for their frame rate in parallel.'))
+
+    args = parser.parse_args()
+    if args.output.endswith(".parquet") and pyarrow is None:
+        parser.error("Writing Parquet needs pyarrow")
+
+    start = time.monotonic()
+    intervals, videos = export_intervals(args.json_dir, args.output, not args.no_fps, args.workers)
+    print(f"Wrote {intervals} intervals of {videos} videos to {args.output} in {time.monotonic() - start:.1f} s")
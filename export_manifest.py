@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+
+from annotation_store import atomic_write_text
+
+
+MANIFEST_FILE_NAME = ".export_manifest.jsonl"
+
+
+def pair_hash(start_frame, end_frame, mode):
+    """Hash of what a clip was exported from, a clip is rebuilt when it changes"""
+    return hashlib.sha1(f"{start_frame}:{end_frame}:{mode}".encode("utf-8")).hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def clip_is_current(previous, clip_name, clip_hash, source, export_path):
+    """Whether the clip recorded in the previous manifest entry can be kept as it is"""
+    if previous is None or previous.get("source") != source:
+        return False
+    clip = previous["clips"].get(clip_name)
+    if clip is None or clip["pair_hash"] != clip_hash:
+        return False
+    try:
+        return os.path.getsize(os.path.join(export_path, clip["output"])) == clip["output_size"]
+    except OSError:
+        return False
+
+
+class ExportManifest:
+    """Record of the clips exported to a directory, one entry per annotation file.
+
+    Entries are appended as JSON lines when a video is done, so an
+    interrupted run resumes after the last finished video. An entry holds the
+    annotation file and source video signatures (size and mtime) and, per
+    clip, the pair hash, the output path and the output size, plus the
+    clips that could not be written. close() compacts the file to one line
+    per annotation file.
+    """
+
+    def __init__(self, export_path):
+        self.export_path = export_path
+        self.manifest_path = os.path.join(export_path, MANIFEST_FILE_NAME)
+        self.entries = {}
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line of an interrupted run
+                        continue
+                    self.entries[entry["json"]] = entry
+
+        self.manifest = open(self.manifest_path, "a")
+
+    def get(self, json_file_path):
+        return self.entries.get(os.path.basename(json_file_path))
+
+    def is_current(self, json_file_path, mode):
+        """True if neither the annotation file nor its video changed and every clip is in place,
+        checked without parsing the annotation file. Videos with incomplete clips are tried again."""
+        entry = self.get(json_file_path)
+        if entry is None or entry["mode"] != mode or entry.get("incomplete"):
+            return False
+        try:
+            if file_signature(json_file_path) != entry["json_signature"]:
+                return False
+            if entry["source"] is not None and file_signature(entry["source"]["path"]) != {
+                    "size": entry["source"]["size"], "mtime": entry["source"]["mtime"]}:
+                return False
+        except OSError:
+            return False
+
+        for clip in entry["clips"].values():
+            try:
+                if os.path.getsize(os.path.join(self.export_path, clip["output"])) != clip["output_size"]:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def record(self, entry):
+        self.entries[entry["json"]] = entry
+        self.manifest.write(json.dumps(entry) + "\n")
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+
+    def close(self):
+        self.manifest.close()
+        atomic_write_text(self.manifest_path,
+                          "".join(json.dumps(entry) + "\n" for entry in self.entries.values()))
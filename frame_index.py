@@ -0,0 +1,186 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pia_video_annotation_tool", "frame_index")
+
+# Part of the cache file name, bumped when the layout of the timestamps changes (2: relative to the file start)
+INDEX_VERSION = 2
+
+
+def cache_key(video_path):
+    """Key of a video in the cache, changes whenever the file is replaced or modified"""
+    stat = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def parse_ffprobe_timestamps(output):
+    """Sorted frame times in microseconds from the start of the file, out of ffprobe's packet pts and start_time.
+
+    Packet timestamps are absolute, while VLC and OpenCV count from the start
+    of the file, so the container start_time (or, without one, the first
+    timestamp) is subtracted. MPEG-TS files and edited MP4s often start well
+    above 0.
+    """
+    timestamps = []
+    start_time = None
+    for line in output.splitlines():
+        key, _, value = line.strip().partition("=")
+        if not value or value == "N/A":
+            continue
+        if key == "pts_time":
+            timestamps.append(float(value))
+        elif key == "start_time":
+            start_time = float(value)
+
+    # Packets come in decode order, frames are numbered in presentation order
+    timestamps = np.sort(np.asarray(timestamps, dtype=np.float64))
+    if start_time is None:
+        start_time = timestamps[0] if len(timestamps) else 0.0
+    return np.round((timestamps - start_time) * 1e6).astype(np.int64)
+
+
+def probe_timestamps_ffprobe(video_path):
+    """Presentation timestamps in microseconds of every video packet, read by ffprobe without decoding"""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "packet=pts_time:format=start_time", "-of", "default=noprint_wrappers=1", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        return None
+
+    return parse_ffprobe_timestamps(result.stdout)
+
+
+def probe_timestamps_opencv(video_path):
+    """Fallback for machines without ffprobe: let OpenCV grab every frame and report its time"""
+    import cv2
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        return None
+
+    timestamps = []
+    try:
+        while video.grab():
+            timestamps.append(video.get(cv2.CAP_PROP_POS_MSEC))
+    finally:
+        video.release()
+
+    return np.round(np.asarray(timestamps, dtype=np.float64) * 1000).astype(np.int64)
+
+
+def probe_timestamps(video_path):
+    timestamps = probe_timestamps_ffprobe(video_path)
+    if timestamps is None:
+        timestamps = probe_timestamps_opencv(video_path)
+    return timestamps
+
+
+class FrameIndex:
+    """Maps between playback time and frame numbers of one video.
+
+    timestamps holds the presentation time of every frame in microseconds
+    from the start of the file (the time base of VLC's get_time/set_time),
+    sorted, so both directions are a binary search or a direct lookup. This
+    stays exact for variable frame rate footage, unlike time * fps.
+    """
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame_at(self, time_ms):
+        """Number of the frame shown at time_ms"""
+        frame = int(np.searchsorted(self.timestamps, int(round(time_ms * 1000)), side="right")) - 1
+        return min(max(frame, 0), len(self.timestamps) - 1)
+
+    def time_of(self, frame):
+        """Presentation time in milliseconds of frame, clamped to the video"""
+        frame = min(max(int(frame), 0), len(self.timestamps) - 1)
+        return int(self.timestamps[frame]) / 1000.0
+
+
+def load_frame_index(video_path, cache_dir=DEFAULT_CACHE_DIR, build=True):
+    """Return the FrameIndex of video_path from the cache, building and caching it if needed.
+
+    Cached indexes are memory-mapped. Returns None if the video has no video
+    stream or could not be read.
+    """
+    try:
+        cache_path = os.path.join(cache_dir, f"{cache_key(video_path)}_v{INDEX_VERSION}.npy")
+    except OSError:
+        return None
+
+    if os.path.exists(cache_path):
+        return FrameIndex(np.load(cache_path, mmap_mode="r"))
+
+    if not build:
+        return None
+
+    timestamps = probe_timestamps(video_path)
+    if timestamps is None or len(timestamps) == 0:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, timestamps)
+    os.replace(tmp_path, cache_path)
+
+    return FrameIndex(np.load(cache_path, mmap_mode="r"))
+
+
+class FrameIndexCache:
+    """Frame indexes of the videos in a session, built on a background worker.
+
+    get() never blocks: it returns the index if it is ready and otherwise
+    schedules it, callers fall back to time * fps in the meantime.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_workers=1):
+        self.cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._futures = {}
+
+    def request(self, video_path):
+        with self._lock:
+            if video_path in self._indexes or video_path in self._futures:
+                return
+            self._futures[video_path] = self._executor.submit(self._build, video_path)
+
+    def get(self, video_path):
+        with self._lock:
+            if video_path in self._indexes:
+                return self._indexes[video_path]
+        self.request(video_path)
+        return None
+
+    def _build(self, video_path):
+        try:
+            index = load_frame_index(video_path, self.cache_dir)
+        except Exception as e:
+            print(f"Could not build the frame index of {video_path}: {e}")
+            index = None
+
+        with self._lock:
+            self._indexes[video_path] = index
+            del self._futures[video_path]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,132 @@
+import threading
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class FrameRing(threading.Thread):
+    """Decoded, downscaled frames around the playhead for instant stepping while paused.
+
+    A decoder thread keeps frames [center - behind, center + ahead] of the
+    video in memory, where the window is sized so the frames fit in
+    max_bytes. Most of the window lies behind the playhead because stepping
+    backward is what forces a player to seek to a keyframe and decode forward
+    again. Frames are stored as RGB uint8 arrays at most max_width wide.
+    """
+
+    def __init__(self, video_path, max_bytes=DEFAULT_MAX_BYTES, max_width=640, frame_indexes=None):
+        super().__init__(name="FrameRing", daemon=True)
+        self.video_path = video_path
+        self.max_bytes = max_bytes
+        self.max_width = max_width
+        self.frame_indexes = frame_indexes
+
+        self.capacity = None
+        self.frame_count = None
+
+        self._frames = {}
+        self._center = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._frames)
+
+    def set_center(self, frame):
+        """Move the window to frame, the decoder thread fills in what is missing"""
+        with self._cond:
+            self._center = frame
+            self._cond.notify_all()
+
+    def get(self, frame):
+        with self._cond:
+            return self._frames.get(frame)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._frames.clear()
+            self._cond.notify_all()
+
+    def _window(self):
+        behind = self.capacity * 3 // 4
+        lo = max(self._center - behind, 0)
+        hi = lo + self.capacity - 1
+        if self.frame_count is not None:
+            hi = min(hi, self.frame_count - 1)
+        return lo, hi
+
+    def _next_missing(self, position):
+        """First frame of the window that is not decoded yet, preferring the one at the decoder position"""
+        lo, hi = self._window()
+        for frame in list(self._frames):
+            if frame < lo or frame > hi:
+                del self._frames[frame]
+
+        if position is not None and lo <= position <= hi and position not in self._frames:
+            return position
+        for frame in range(lo, hi + 1):
+            if frame not in self._frames:
+                return frame
+        return None
+
+    def _seek(self, video, frame):
+        import cv2
+
+        index = self.frame_indexes.get(self.video_path) if self.frame_indexes is not None else None
+        if index is not None:
+            video.set(cv2.CAP_PROP_POS_MSEC, index.time_of(frame))
+        else:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame)
+
+    def run(self):
+        import cv2
+
+        video = cv2.VideoCapture(self.video_path)
+        if not video.isOpened():
+            print(f"Scrubbing disabled, could not open {self.video_path}")
+            return
+
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        scale = min(1.0, self.max_width / max(width, 1))
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        self.capacity = max(1, self.max_bytes // (size[0] * size[1] * 3))
+
+        position = None
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed:
+                        target = self._next_missing(position) if self._center is not None else None
+                        if target is not None:
+                            break
+                        self._cond.wait()
+                    if self._closed:
+                        return
+
+                if position != target:
+                    self._seek(video, target)
+                    position = target
+
+                ok, frame = video.read()
+                if not ok:
+                    with self._cond:
+                        self.frame_count = position
+                    position = None
+                    continue
+
+                if scale < 1.0:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+                with self._cond:
+                    lo, hi = self._window()
+                    if lo <= position <= hi:
+                        self._frames[position] = frame
+                position += 1
+        finally:
+            video.release()
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+
+import cv2
+
+from cut_clip import annotation_pairs, select_json_files
+
+
+IMAGE_FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+}
+
+
+def wanted_frames(annotations, context=0, every=0):
+    """Frame numbers to extract from an annotations_frame dict.
+
+    Every S/E mark with context frames on either side, plus every `every`-th
+    frame inside each S/E interval when every > 0.
+    """
+    frames = set()
+    for key, value in annotations.items():
+        if key[:1] in ("S", "E"):
+            mark = int(value[0])
+            frames.update(range(max(mark - context, 0), mark + context + 1))
+
+    if every > 0:
+        for start_frame, end_frame in annotation_pairs(annotations):
+            frames.update(range(start_frame, end_frame + 1, every))
+    return frames
+
+
+class FrameWriterPool:
+    """Encodes and writes frames on a pool of threads, fed through a bounded queue.
+
+    put() blocks while the queue is full, which keeps the decoder from
+    running ahead of the disk. cv2.imencode and file writes release the GIL,
+    so the writer threads run in parallel with decoding.
+    """
+
+    def __init__(self, image_format="png", quality=None, workers=4, queue_size=64):
+        self.extension, self.quality_flag = IMAGE_FORMATS[image_format]
+        if quality is None:
+            quality = 3 if image_format == "png" else 95
+        self.params = [self.quality_flag, quality]
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+        self.threads = [threading.Thread(target=self.run, name=f"FrameWriter-{i}", daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, path, frame):
+        self.queue.put((path, frame))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            path, frame = item
+            try:
+                ok, data = cv2.imencode(self.extension, frame, self.params)
+                if not ok:
+                    raise ValueError("encoding failed")
+                with open(path, "wb") as f:
+                    f.write(data.tobytes())
+                with self.lock:
+                    self.written += 1
+                    self.bytes_written += len(data)
+            except Exception as e:
+                print(f"Could not write {path}: {e}")
+                with self.lock:
+                    self.errors += 1
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def extract_video(json_file_path, output_dir, writers, context=0, every=0):
+    """Decode the wanted frames of one annotated video in a single forward pass. Returns the number queued."""
+    with open(json_file_path, 'r') as f:
+        json_data = json.load(f)
+
+    video_path = json_data["path"]
+    video_name = os.path.basename(video_path)
+    frames = wanted_frames(json_data.get("annotations_frame", {}), context, every)
+    if not frames:
+        print(f"No annotations found in {video_name}")
+        return 0
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        raise ValueError(f"Error opening video file: {video_path}")
+
+    video_dir = os.path.join(output_dir, video_name)
+    os.makedirs(video_dir, exist_ok=True)
+
+    queued = 0
+    last_frame = max(frames)
+    try:
+        for frame_num in range(last_frame + 1):
+            # Frames that are not wanted are only grabbed, not converted
+            if frame_num in frames:
+                ret, frame = video.read()
+            else:
+                ret, frame = video.grab(), None
+            if not ret:
+                print(f"Error reading frame {frame_num} from {video_name}")
+                break
+
+            if frame is not None:
+                writers.put(os.path.join(video_dir, f"{video_name}_{frame_num:06d}{writers.extension}"), frame)
+                queued += 1
+    finally:
+        video.release()
+
+    return queued
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Extract the annotated frames of every video as images.')
+    parser.add_argument('json_dir',
+                        help=('Directory with the annotation JSON files.'))
+    parser.add_argument('--output', default="./frames",
+                        help=('Directory to write the frames to, one sub-directory per video.'))
+    parser.add_argument('--context', type=int, default=0,
+                        help=('Also extract this many frames before and after every S/E mark.'))
+    parser.add_argument('--every', type=int, default=0,
+                        help=('Also extract every Nth frame inside each S/E interval.'))
+    parser.add_argument('--format', choices=sorted(IMAGE_FORMATS), default="png",
+                        help=('Image format.'))
+    parser.add_argument('--quality', type=int, default=None,
+                        help=('PNG compression level (0-9) or JPEG quality (0-100).'))
+    parser.add_argument('--writers', type=int, default=os.cpu_count(),
+                        help=('Number of threads encoding and writing images.'))
+    parser.add_argument('--queue_size', type=int, default=64,
+                        help=('Decoded frames waiting to be written before decoding pauses.'))
+    parser.add_argument('--include', default="*.json",
+                        help=('Only use annotation files matching this glob.'))
+    parser.add_argument('--exclude', action='append', default=[],
+                        help=('Skip annotation files matching this glob, can be given several times.'))
+
+    args = parser.parse_args()
+
+    writers = FrameWriterPool(args.format, args.quality, args.writers, args.queue_size)
+    start = time.monotonic()
+    queued = 0
+    failed = 0
+    json_files = select_json_files(args.json_dir, args.include, args.exclude)
+    try:
+        for i, json_file in enumerate(json_files, 1):
+            try:
+                count = extract_video(json_file, args.output, writers, args.context, args.every)
+                queued += count
+                print(f"[{i}/{len(json_files)}] {json_file}: {count} frames")
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(json_files)}] FAILED {json_file}: {type(e).__name__}: {e}")
+    finally:
+        writers.close()
+
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"Wrote {writers.written} of {queued} frames ({writers.bytes_written / 1e6:.1f} MB) in {elapsed:.1f} s: "
+          f"{writers.written / elapsed:.1f} frames/s, {writers.bytes_written / 1e6 / elapsed:.1f} MB/s, "
+          f"{writers.errors} write errors, {failed} videos failed")
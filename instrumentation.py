@@ -0,0 +1,153 @@
+import os
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+
+class _NoSpan:
+    """Context manager returned while instrumentation is off, it does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Timings of named operations in rolling windows, optionally also written as a Chrome trace.
+
+    Disabled by default: span() then returns a shared no-op context manager
+    and record(), begin(), end() and event() return at once, so instrumented
+    code costs one attribute check. When enabled, every timing goes into a
+    bounded window per name for the debug panel, and, with a trace path,
+    into a list of trace events written by close() in the Chrome trace event
+    format (open it in chrome://tracing or Perfetto).
+    """
+
+    def __init__(self, window=512):
+        self.enabled = False
+        self.window = window
+        self.trace_path = None
+
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._open = {}
+        self._trace = None
+        self._origin = time.perf_counter()
+
+    def enable(self, trace_path=None):
+        self.enabled = True
+        if trace_path is not None:
+            self.trace_path = trace_path
+            self._trace = []
+
+    def span(self, name):
+        """Context manager timing the block as name"""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, duration, pid=None, tid=None):
+        """Add a timing of duration seconds that started at perf_counter() time start"""
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(duration * 1000.0)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if self._trace is not None:
+                self._trace.append({"name": name, "ph": "X", "ts": (start - self._origin) * 1e6,
+                                    "dur": duration * 1e6, "pid": os.getpid() if pid is None else pid,
+                                    "tid": threading.get_ident() if tid is None else tid})
+
+    def begin(self, name):
+        """Start a timing that ends in another call, e.g. a keypress until the first frame is shown"""
+        if self.enabled:
+            self._open[name] = time.perf_counter()
+
+    def end(self, name):
+        """End the timing started by begin(name), nothing happens if it is not running"""
+        if not self.enabled:
+            return
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.record(name, start, time.perf_counter() - start)
+
+    def cancel(self, name):
+        """Drop the timing started by begin(name), when what it measures did not happen after all"""
+        self._open.pop(name, None)
+
+    def event(self, name, **args):
+        """An instant event in the trace, for things worth a mark but not a timing"""
+        if self._trace is None:
+            return
+        with self._lock:
+            self._trace.append({"name": name, "ph": "i", "s": "t", "ts": (time.perf_counter() - self._origin) * 1e6,
+                                "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+    def stats(self):
+        """{name: {count, last, p50, p95, max}} over the rolling windows, times in ms"""
+        with self._lock:
+            windows = {name: sorted(samples) for name, samples in self._samples.items()}
+            counts = dict(self._counts)
+            last = {name: samples[-1] for name, samples in self._samples.items()}
+
+        stats = {}
+        for name, samples in sorted(windows.items()):
+            stats[name] = {"count": counts[name], "last": last[name],
+                           "p50": samples[len(samples) // 2], "p95": samples[min(int(len(samples) * 0.95),
+                                                                                   len(samples) - 1)],
+                           "max": samples[-1]}
+        return stats
+
+    def close(self):
+        """Write the trace file, if one was asked for"""
+        if self._trace is None:
+            return
+        with self._lock:
+            events = self._trace
+            self._trace = None
+        tmp_path = f"{self.trace_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, self.trace_path)
+
+
+# Shared by the player and the export tools
+metrics = Metrics()
+
+
+def timed(name):
+    """Decorator timing every call of a function as name"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            with _Span(metrics, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,124 @@
+import bisect
+
+
+def parse_mark_key(key):
+    """("S" | "E", index) of an S<i>/E<i> annotation key, None for any other key"""
+    if key[:1] in ("S", "E") and key[1:].isdigit():
+        return key[0], int(key[1:])
+    return None
+
+
+class IntervalIndex:
+    """The S/E marks of one video, kept up to date with add() and remove().
+
+    Holds the frame of every mark by index, the set of unpaired keys, the
+    sorted indices in use and the closed intervals sorted by start frame, so
+    the pairing check, the next free index, overlap tests and the interval
+    at a frame need no rescan of the annotation keys.
+
+    Intervals may overlap and an E mark may come before its S mark (the
+    interval then covers the frames between them): next to the sorted
+    intervals, max_ends holds the largest end frame of every prefix, which
+    keeps the queries a binary search on such data too.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+        self.unpaired_keys = set()
+        self.indices = []
+        # (start_frame, end_frame, index) of the paired marks with start_frame <= end_frame, sorted
+        self.intervals = []
+        # max_ends[i]: the largest end_frame of intervals[:i + 1]
+        self.max_ends = []
+
+    @classmethod
+    def from_annotations(cls, annotations_frame):
+        index = cls()
+        for key, value in annotations_frame.items():
+            index.add(key, value[0])
+        return index
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _marks(self, event):
+        return self.starts if event == "S" else self.ends
+
+    def _interval(self, index):
+        start_frame, end_frame = int(self.starts[index]), int(self.ends[index])
+        return (min(start_frame, end_frame), max(start_frame, end_frame), index)
+
+    def _update_max_ends(self, i):
+        """Recompute max_ends from position i on, after intervals changed there"""
+        del self.max_ends[i:]
+        running = self.max_ends[-1] if self.max_ends else float("-inf")
+        for _, end_frame, _ in self.intervals[i:]:
+            running = max(running, end_frame)
+            self.max_ends.append(running)
+
+    def add(self, key, frame):
+        parsed = parse_mark_key(key)
+        if parsed is None:
+            return
+        event, index = parsed
+        if index in self._marks(event):
+            self.remove(key)
+
+        if index not in self.starts and index not in self.ends:
+            bisect.insort(self.indices, index)
+        self._marks(event)[index] = frame
+
+        if index in self.starts and index in self.ends:
+            self.unpaired_keys.discard(f"{'E' if event == 'S' else 'S'}{index}")
+            interval = self._interval(index)
+            i = bisect.bisect_left(self.intervals, interval)
+            self.intervals.insert(i, interval)
+            self._update_max_ends(i)
+        else:
+            self.unpaired_keys.add(key)
+
+    def remove(self, key):
+        parsed = parse_mark_key(key)
+        if parsed is None or parsed[1] not in self._marks(parsed[0]):
+            return
+        event, index = parsed
+
+        if index in self.starts and index in self.ends:
+            i = bisect.bisect_left(self.intervals, self._interval(index))
+            del self.intervals[i]
+            self._update_max_ends(i)
+            self.unpaired_keys.add(f"{'E' if event == 'S' else 'S'}{index}")
+        else:
+            self.unpaired_keys.discard(key)
+            del self.indices[bisect.bisect_left(self.indices, index)]
+        del self._marks(event)[index]
+
+    def unpaired(self):
+        """Sorted unpaired keys, None if every mark is paired"""
+        if not self.unpaired_keys:
+            return None
+        return sorted(self.unpaired_keys, key=lambda key: (int(key[1:]), key[0] != "S"))
+
+    def next_index(self):
+        """One past the highest index in use"""
+        return self.indices[-1] + 1 if self.indices else 1
+
+    def overlaps(self, start_frame, end_frame):
+        """Whether [start_frame, end_frame] overlaps a paired interval"""
+        # Intervals starting after end_frame can't overlap, of the others one has to reach start_frame
+        i = bisect.bisect_right(self.intervals, (end_frame, float("inf"), float("inf")))
+        return i > 0 and self.max_ends[i - 1] >= start_frame
+
+    def interval_at(self, frame):
+        """(start_frame, end_frame, index) of the paired interval containing frame, or None.
+
+        Of several intervals containing frame, the one starting last.
+        """
+        i = bisect.bisect_right(self.intervals, (frame, float("inf"), float("inf")))
+        if i == 0 or self.max_ends[i - 1] < frame:
+            return None
+        # Some interval of intervals[:i] reaches frame, walk back to the last one
+        while self.intervals[i - 1][1] < frame:
+            i -= 1
+        return self.intervals[i - 1]
@@ -0,0 +1,214 @@
+import getpass
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+LEASE_DIR_NAME = ".leases"
+
+
+def parse_shard(text):
+    """(index, count) of a "i/n" shard argument, 0 <= i < n"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/n, not {text!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}")
+    return index, count
+
+
+def in_shard(video_name, shard):
+    """Whether video_name belongs to shard (index, count), by a hash of the name so every machine agrees"""
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.sha1(video_name.encode("utf-8")).hexdigest()[:8], 16) % count == index
+
+
+class LeaseManager:
+    """Claims videos for one annotator with lease files in a shared directory.
+
+    A lease is a small JSON file named after the video, created with O_EXCL
+    so only one annotator can create it. Held leases are renewed by a
+    heartbeat thread; a lease whose expiry passed (its holder crashed or
+    lost the share) can be taken over. Leaving a video with done=True keeps
+    the file as a marker, so no one is handed that video again. Everything
+    goes through plain file operations, so it works on NFS and SMB shares
+    without a lock server.
+    """
+
+    def __init__(self, lease_dir, ttl=600, heartbeat=60):
+        self.lease_dir = lease_dir
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = f"{getpass.getuser()}@{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        os.makedirs(lease_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._held = set()
+        # Done markers stay, so videos seen done are skipped without touching the share again
+        self._done = set()
+        self.lost = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew_loop, name="LeaseHeartbeat", daemon=True)
+        self._thread.start()
+
+    def lease_path(self, name):
+        return os.path.join(self.lease_dir, name + ".lease")
+
+    def _read(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Being written by its holder right now, or left empty by a holder that crashed before writing it
+            try:
+                modified = os.stat(path).st_mtime
+            except OSError:
+                return None
+            return {"owner": None, "expires": modified + self.ttl}
+
+    def _lease(self, done=False):
+        return {"owner": self.owner, "expires": time.time() + self.ttl, "done": done}
+
+    def _write(self, path, lease):
+        tmp_path = f"{path}.{self.owner.replace(':', '_').replace('@', '_')}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(lease, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def status(self, name):
+        """None if free, "mine", "other" (a live lease of someone else) or "done\""""
+        lease = self._read(self.lease_path(name))
+        if lease is None:
+            return None
+        if lease.get("done"):
+            return "done"
+        if lease["owner"] == self.owner:
+            return "mine"
+        if lease["expires"] < time.time():
+            return None
+        return "other"
+
+    def try_acquire(self, name, reopen=False):
+        """Claim name, True if this annotator holds its lease afterwards.
+
+        Videos marked done are only claimed again with reopen=True, e.g. when
+        going back to a previous video.
+        """
+        if name in self._done and not reopen:
+            return False
+        path = self.lease_path(name)
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                lease = self._read(path)
+                if lease is None:
+                    continue
+                if lease["owner"] == self.owner and not lease.get("done"):
+                    with self._lock:
+                        self._held.add(name)
+                    return True
+                if lease.get("done") and not reopen:
+                    self._done.add(name)
+                    return False
+                if not lease.get("done") and lease["expires"] >= time.time():
+                    return False
+                if not self._break(path, lease):
+                    return False
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._lease(), f)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self._held.add(name)
+                self.lost.discard(name)
+            self._done.discard(name)
+            return True
+        return False
+
+    def _break(self, path, expired):
+        """Remove an expired lease so it can be created again, False if someone else got there first"""
+        stale_path = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            # Rename is atomic, of several annotators breaking the same lease only one succeeds
+            os.rename(path, stale_path)
+        except OSError:
+            return True
+
+        if self._read(stale_path) == expired:
+            os.remove(stale_path)
+            return True
+
+        # Someone broke and recreated the lease in between, put theirs back
+        try:
+            os.link(stale_path, path)
+        except OSError:
+            pass
+        os.remove(stale_path)
+        return False
+
+    def release(self, name, done=False):
+        """Give up the lease of name, with done=True the video is marked as finished instead"""
+        with self._lock:
+            held = name in self._held
+            self._held.discard(name)
+        if not held:
+            return
+
+        path = self.lease_path(name)
+        lease = self._read(path)
+        if lease is None or lease["owner"] != self.owner:
+            return
+        if done:
+            self._write(path, self._lease(done=True))
+            self._done.add(name)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def renew(self):
+        """Push the expiry of every held lease forward, leases taken over by someone else go to self.lost"""
+        with self._lock:
+            held = list(self._held)
+
+        for name in held:
+            path = self.lease_path(name)
+            lease = self._read(path)
+            if lease is None or lease["owner"] != self.owner:
+                with self._lock:
+                    self._held.discard(name)
+                    self.lost.add(name)
+                print(f"Lost the lease of {name}")
+                continue
+            try:
+                self._write(path, self._lease())
+            except OSError as e:
+                print(f"Could not renew the lease of {name}: {e}")
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.heartbeat):
+            self.renew()
+
+    def close(self):
+        """Stop the heartbeat and release the leases still held, unfinished videos become free again"""
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            held = list(self._held)
+        for name in held:
+            self.release(name)
@@ -7,18 +7,47 @@ import vlc
 from functools import partial
 import time
 import random
+import multiprocessing
 
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtCore import QSize, Qt
 from PyQt5.QtGui import QIcon, QKeySequence, QPainter, QFont, QColor, QPen
 from PyQt5.QtWidgets import QToolBar, QAction, QStatusBar, QShortcut, QFileDialog
 
-import glob
+import heapq
+import bisect
+import numpy as np
+
+from video_scanner import iter_video_batches, video_name_from_path
+from annotation_backend import open_annotation_store, export_document, STORAGE_KINDS
+from annotation_writer import AnnotationWriter
+from media_prefetcher import MediaPrefetcher, is_parsed
+from playback_state import PlaybackStateMachine
+from frame_index import FrameIndexCache
+from frame_ring import FrameRing
+from thumbnails import ThumbnailCache
+from candidates import CandidateCache, CUT, MOTION
+from interval_index import IntervalIndex
+from snapshot_writer import SnapshotWriter, SNAPSHOT_FORMATS
+from instrumentation import metrics, timed
+from session import load_session, save_session, load_cached_scan, save_cached_scan
+from leases import LeaseManager, LEASE_DIR_NAME, in_shard, parse_shard
+from sync_client import SyncClient, parse_address
 
 
 class Player(QtWidgets.QMainWindow):
 
-    def __init__(self, muted=False, save_frames=False, master=None):
+    # Emitted from libvlc's thread when the current media finished parsing
+    mediaParsed = QtCore.pyqtSignal(str)
+    # Emitted from a worker thread when the filmstrip of a video is built
+    thumbnailReady = QtCore.pyqtSignal(str, str)
+    # Emitted from a worker thread when the scene change and motion scores of a video are computed
+    candidatesReady = QtCore.pyqtSignal(str)
+
+    def __init__(self, muted=False, save_frames=False, recursive=False, storage="json", scrub_cache_mb=256,
+                 filmstrip=False, snapshot_format="png", snapshot_quality=None, videos_dir=None,
+                 annotations_dir=None, resume=False, leases=False, shard=None, sync=None, candidates=False,
+                 master=None):
         QtWidgets.QMainWindow.__init__(self, master)
         # self.setWindowIcon(QIcon("icons/app.svg"))
         self.setWindowIcon(QIcon(self.resource_path("icons/piaspace-crop.jpg")))
@@ -26,49 +55,62 @@ class Player(QtWidgets.QMainWindow):
 
         self.muted = muted
         self.save_frames = save_frames
+        self.recursive = recursive
+        self.storage = storage
+        self.scrub_cache_mb = scrub_cache_mb
+        self.filmstrip = filmstrip
+        self.candidates = candidates
+        self.snapshot_format = snapshot_format
+        self.snapshot_quality = snapshot_quality
+        # (index, count) of --shard, only the videos of this shard are listed
+        self.shard = shard
 
         self.setWindowTitle(self.title)
-        options = QFileDialog.Options()
-        options |= QFileDialog.ShowDirsOnly
-        options |= QFileDialog.Directory
 
-        # options |= QFileDialog.DontUseNativeDialog
+        # Directories given on the command line, or those of the last session with --resume, skip the dialogs
+        session = load_session()
+        if resume:
+            videos_dir = videos_dir or session.get("videos_dir")
+            annotations_dir = annotations_dir or session.get("annotations_dir")
+        if videos_dir and os.path.isdir(videos_dir):
+            self.videos_dir = videos_dir
+        else:
+            self.videos_dir = self.selectDirectory("Select Videos Directory",
+                                                   "Please select a directory containing videos.")
+        if annotations_dir and os.path.isdir(annotations_dir):
+            self.annotations_dir = annotations_dir
+        else:
+            self.annotations_dir = self.selectDirectory("Select Annotations Directory",
+                                                        "Please select a directory for annotations")
 
-        supported_formats = [".mp3", ".mp4", ".avi", ".wmv", ".mp4", ".mov", ".ogg", ".wav", ".ogm"]
+        # Video and annotation cursor to reopen, if the last session used the same directories
+        self.resume = None
+        if (session.get("videos_dir") == self.videos_dir and session.get("annotations_dir") == self.annotations_dir
+                and session.get("recursive") == self.recursive):
+            self.resume = session
 
+        # Filled in by the background scanner, see onVideoBatch
         self.video_paths = []
-        while len(self.video_paths) == 0:
-            videos_dir = str(QFileDialog.getExistingDirectory(self, "Select Videos Directory", options=options))
-            self.video_paths = []
-            for fmt in supported_formats:
-                self.video_paths += [f for f in glob.glob(videos_dir + "**/*"+fmt, recursive=False)]
-            self.video_paths = sorted(set(self.video_paths))
-            print(self.video_paths)
-
-            if len(self.video_paths) == 0 or len(videos_dir) == 0:
-                QtWidgets.QMessageBox.question(self, 'No videos exist', "Please select a directory containing videos.",
-                                                             QtWidgets.QMessageBox.Ok)
-
-        self.annotations_dir = ""
-        while len(self.annotations_dir) == 0:
-            self.annotations_dir = str(QFileDialog.getExistingDirectory(self, "Select Annotations Directory", options=options))
-            print(self.annotations_dir)
-            self.annotation_paths = [f for f in glob.glob(self.annotations_dir + "**/*.json", recursive=False)]
-            if len(self.annotations_dir) == 0:
-                QtWidgets.QMessageBox.question(self, 'No directory selected.', "Please select a directory for annotations",
-                                                             QtWidgets.QMessageBox.Ok)
-
-
-        self.num_videos = len(self.video_paths)
+        self.num_videos = 0
         self.current_video = 0
+        self.current_video_attrs = None
+        # S/E marks of the current video, updated by annotate and removeAnnotations
+        self.intervals = IntervalIndex()
 
-        self.annotations = {}
+        # With --leases, videos are claimed in the annotations directory so annotators sharing it never collide
+        self.leases = None
+        if leases:
+            self.leases = LeaseManager(os.path.join(self.annotations_dir, LEASE_DIR_NAME))
 
-        for annotation_path in self.annotation_paths:
-            j = json.load(open(annotation_path, "r"))
-            self.annotations[j["name"]] = j
+        # With --sync, edits are also pushed to a sync server (host, port), see sync_server.py
+        self.sync = None
+        if sync is not None:
+            self.sync = SyncClient(*sync)
 
-        print(self.annotation_paths)
+        # Annotation documents are parsed lazily when their video is opened
+        self.annotation_writer = AnnotationWriter()
+        self.annotations = open_annotation_store(self.storage, self.annotations_dir, writer=self.annotation_writer)
+        metrics.event("annotations_loaded", videos=len(self.annotations), annotations_dir=self.annotations_dir)
 
         self.createVideoPlayer()
 
@@ -80,53 +122,225 @@ class Player(QtWidgets.QMainWindow):
 
         self.setStatusBar(self.statusbar)
 
+        # Pending annotation writes and their latency, refreshed by writer_stats_timer
+        self.writer_stats_label = QtWidgets.QLabel(self)
+        self.statusbar.addPermanentWidget(self.writer_stats_label)
+        self.writer_stats_timer = QtCore.QTimer(self)
+        self.writer_stats_timer.setInterval(1000)
+        self.writer_stats_timer.timeout.connect(self.updateWriterStats)
+        self.writer_stats_timer.start()
+
+        if metrics.enabled:
+            self.createMetricsPanel()
+
         self.current_event = "S"
         self.current_ann_idx = 1
         self.current_annotation = self.current_event + str(self.current_ann_idx)
 
-        self.statusbar.showMessage("Current Annotation: " + self.current_annotation)
+        self.statusbar.showMessage("Scanning " + self.videos_dir + " ...")
 
-        self.createShortcuts()
+        self.next_visible = False
+        self.prev_visible = False
 
+        # Toolbar and shortcuts are enabled once the first video is opened
+        self.toolbar.setEnabled(False)
+        self.scan_thread = None
+        # After the window is shown
+        QtCore.QTimer.singleShot(0, self.loadVideos)
 
-        is_video_set = False
-        for i, video_path in enumerate(self.video_paths):
+    def selectDirectory(self, caption, message):
+        options = QFileDialog.Options()
+        options |= QFileDialog.ShowDirsOnly
+        options |= QFileDialog.Directory
 
-            if "\\" in video_path:
-                video_name = video_path.split("\\")[-1]
-            else:
-                video_name = video_path.split("/")[-1]
+        # options |= QFileDialog.DontUseNativeDialog
 
-            if video_name not in self.annotations:
-                self.file = self.OpenFile(video_path)
+        directory = ""
+        while len(directory) == 0:
+            directory = str(QFileDialog.getExistingDirectory(self, caption, options=options))
+            if len(directory) == 0:
+                QtWidgets.QMessageBox.question(self, 'No directory selected.', message,
+                                                             QtWidgets.QMessageBox.Ok)
+        return directory
 
-                self.current_video_attrs = self.annotations.get(video_name, {
-                    "name": video_name,
-                    "path": video_path,
-                    "annotations": {},
-                    "annotations_frame": {}
-                })
-                self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
-                self.current_video = i
+    def loadVideos(self):
+        """Open the resume point right away if the last scan of the videos directory is still valid, scan otherwise"""
+        cached = load_cached_scan(self.videos_dir, self.recursive, shard=self.shard)
+        if not cached:
+            self.startVideoScan()
+            return
 
-                # is_video_set = True # Disable this feature for opening the video based on current annotation
+        self.video_paths = cached
+        self.num_videos = len(cached)
+        self.progress.setMaximum(self.num_videos)
+        index = self.resumeIndex()
+        self.openFirstVideo(index if index is not None else 0)
 
-                break
+    def resumeIndex(self):
+        """Index of the video of the last session in self.video_paths, None if it is not (yet) there"""
+        if self.resume is None:
+            return None
+        index = bisect.bisect_left(self.video_paths, self.resume.get("video_path", ""))
+        if index < len(self.video_paths) and self.video_paths[index] == self.resume["video_path"]:
+            return index
+        return None
 
-        if not is_video_set:
-            video_path = self.video_paths[0]
-            if "\\" in video_path:
-                video_name = video_path.split("\\")[-1]
-            else:
-                video_name = video_path.split("/")[-1]
-            self.file = self.OpenFile(video_path)
-            self.current_video_attrs = self.annotations.get(video_name, {
+    def claimVideo(self, start, step, wrap=True):
+        """Index of the first video from start on (going in step direction) whose lease could be taken, or None.
+
+        Videos others are working on are skipped; going backward (step < 0)
+        also reopens videos that were marked done.
+        """
+        for offset in range(self.num_videos):
+            index = start + offset * step
+            if wrap:
+                index %= self.num_videos
+            elif not 0 <= index < self.num_videos:
+                return None
+            if self.current_video_attrs is not None and index == self.current_video:
+                continue
+            if self.leases.try_acquire(video_name_from_path(self.video_paths[index]), reopen=step < 0):
+                return index
+        return None
+
+    def loadVideoAnnotations(self, video_name, video_path):
+        """Make the annotations of video_name current, an empty document if it has none or they can't be read"""
+        if self.leases is not None:
+            # Someone else may have annotated the video since we last saw it
+            self.annotations.reload(video_name)
+        self.current_video_attrs = self.annotations.get(video_name)
+        if self.current_video_attrs is None:
+            self.current_video_attrs = {
                 "name": video_name,
                 "path": video_path,
-                "annotations": {}
+                "annotations": {},
+                "annotations_frame": {}
+            }
+            self.annotations[video_name] = self.current_video_attrs
+
+        self.intervals = IntervalIndex.from_annotations(self.current_video_attrs["annotations_frame"])
+        if self.intervals.indices:
+            self.current_event = "S"
+            self.current_ann_idx = self.intervals.next_index()
+
+    def releaseCurrentVideo(self, done):
+        """Give the lease of the current video up, done when moving on to the next one (marks or not), free otherwise"""
+        if self.leases is not None and self.current_video_attrs is not None:
+            # The next annotator reads the file as soon as the lease is gone
+            self.annotation_writer.flush()
+            self.leases.release(self.current_video_attrs["name"], done=done)
+
+    def saveSession(self):
+        if self.current_video_attrs is None:
+            return
+        try:
+            save_session({
+                "videos_dir": self.videos_dir,
+                "annotations_dir": self.annotations_dir,
+                "recursive": self.recursive,
+                "video_path": self.video_paths[self.current_video],
+                "current_event": self.current_event,
+                "current_ann_idx": self.current_ann_idx,
             })
+        except OSError as e:
+            metrics.event("session_save_failed", error=str(e))
+            self.statusbar.showMessage(f"Could not save the session: {e}")
 
-            self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
+    def startVideoScan(self):
+        """Scan self.videos_dir on a worker thread, videos are streamed into onVideoBatch
+        """
+        self.scan_thread = VideoScanThread(self.videos_dir, recursive=self.recursive, parent=self)
+        self.scan_thread.batchFound.connect(self.onVideoBatch)
+        self.scan_thread.scanFinished.connect(self.onVideoScanFinished)
+        self.scan_thread.start()
+
+    def onVideoBatch(self, batch):
+        current_path = self.video_paths[self.current_video] if self.current_video_attrs is not None else None
+        if self.shard is not None:
+            batch = [path for path in batch if in_shard(video_name_from_path(path), self.shard)]
+            if not batch:
+                return
+
+        # Both lists are sorted, so merging keeps self.video_paths sorted in O(n)
+        self.video_paths = list(heapq.merge(self.video_paths, batch))
+        self.num_videos = len(self.video_paths)
+        self.progress.setMaximum(self.num_videos)
+
+        if current_path is None:
+            # Wait for the batch holding the video of the last session, onVideoScanFinished opens the first otherwise
+            index = self.resumeIndex()
+            if index is not None:
+                self.openFirstVideo(index)
+            elif self.resume is None:
+                self.openFirstVideo()
+        else:
+            self.current_video = bisect.bisect_left(self.video_paths, current_path)
+            self.progress.setValue(self.current_video)
+            self.setPrevNextVisibility()
+            self.media_prefetcher.prefetch(self.video_paths, self.current_video)
+
+    def onVideoScanFinished(self, count):
+        metrics.event("video_scan_finished", videos=count, videos_dir=self.videos_dir)
+
+        if self.num_videos > 0:
+            if self.current_video_attrs is None:
+                self.openFirstVideo()
+                if self.current_video_attrs is None:
+                    QtWidgets.QMessageBox.question(self, "No unclaimed videos left.",
+                                                   "Every video is done or being annotated by someone else.",
+                                                   QtWidgets.QMessageBox.Ok)
+            try:
+                save_cached_scan(self.videos_dir, self.recursive, self.video_paths, self.scan_thread.directories,
+                                 shard=self.shard)
+            except OSError as e:
+                metrics.event("scan_cache_failed", videos_dir=self.videos_dir, error=str(e))
+                self.statusbar.showMessage(f"Could not cache the scan of {self.videos_dir}: {e}")
+        else:
+            QtWidgets.QMessageBox.question(self, 'No videos exist', "Please select a directory containing videos.",
+                                                         QtWidgets.QMessageBox.Ok)
+            self.videos_dir = self.selectDirectory("Select Videos Directory",
+                                                   "Please select a directory containing videos.")
+            self.startVideoScan()
+
+    def openFirstVideo(self, index=0):
+        if self.leases is not None:
+            claimed = self.claimVideo(index, 1)
+            if claimed is None:
+                # Someone else may hold the lease of index, opening it anyway would let two people edit one file
+                self.statusbar.showMessage("Every video is done or being annotated by someone else")
+                return
+            index = claimed
+        self.current_video = index
+        video_path = self.video_paths[self.current_video]
+        video_name = video_name_from_path(video_path)
+
+        self.file = self.OpenFile(video_path)
+        if self.leases is not None:
+            self.annotations.reload(video_name)
+        self.current_video_attrs = self.annotations.get(video_name, {
+            "name": video_name,
+            "path": video_path,
+            "annotations": {},
+            "annotations_frame": {}
+        })
+
+        self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
+        self.intervals = IntervalIndex.from_annotations(self.current_video_attrs["annotations_frame"])
+
+        # Continue where the last session stopped, or after the last index of the video
+        if self.resume is not None and self.resume.get("video_path") == video_path:
+            self.current_event = self.resume["current_event"]
+            self.current_ann_idx = self.resume["current_ann_idx"]
+        elif self.intervals.indices:
+            self.current_event = "S"
+            self.current_ann_idx = self.intervals.next_index()
+        self.current_annotation = self.current_event + str(self.current_ann_idx)
+        self.statusbar.showMessage("Current Annotation: " + self.current_annotation)
+        self.resume = None
+        self.progress.setValue(self.current_video)
+
+        self.toolbar.setEnabled(True)
+        self.createShortcuts()
 
         self.play()
 
@@ -134,6 +348,70 @@ class Player(QtWidgets.QMainWindow):
         self.prev_visible = True
         self.setVisibilities()
 
+    def updateWriterStats(self):
+        stats = self.annotation_writer.stats()
+        self.writer_stats_label.setText(
+            f"Pending writes: {stats['queue_depth']} | Write latency: {stats['last_latency_ms']:.1f} ms"
+            f" (avg {stats['avg_latency_ms']:.1f}, max {stats['max_latency_ms']:.1f})"
+            + (f" | Pending snapshots: {self.snapshots.queue_depth()}" if self.snapshots is not None else "")
+            + (f" | Sync: {self.sync.pending()} pending{'' if self.sync.connected else ', offline'}"
+               if self.sync is not None else ""))
+        if self.leases is not None and self.current_video_attrs is not None \
+                and self.current_video_attrs["name"] in self.leases.lost:
+            self.statusbar.showMessage("Someone else took over this video after its lease expired, "
+                                       "move on to avoid overwriting their annotations")
+
+    def createMetricsPanel(self):
+        """Dock showing the rolling timings of the instrumented operations, see --profile"""
+        self.metrics_label = QtWidgets.QLabel(self)
+        self.metrics_label.setFont(QFont("Monospace", 9))
+        self.metrics_label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+        self.metrics_dock = QtWidgets.QDockWidget("Timings", self)
+        self.metrics_dock.setWidget(self.metrics_label)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.metrics_dock)
+
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.setInterval(1000)
+        self.metrics_timer.timeout.connect(self.updateMetricsPanel)
+        self.metrics_timer.start()
+
+    def updateMetricsPanel(self):
+        rows = [f"{'operation':24s} {'count':>6s} {'last':>8s} {'p50':>8s} {'p95':>8s} {'max':>8s}"]
+        for name, stats in metrics.stats().items():
+            rows.append(f"{name:24s} {stats['count']:6d} {stats['last']:8.1f} {stats['p50']:8.1f} "
+                        f"{stats['p95']:8.1f} {stats['max']:8.1f}")
+        self.metrics_label.setText("\n".join(rows) + "\n(ms)")
+
+    def closeEvent(self, event):
+        if self.scan_thread is not None and self.scan_thread.isRunning():
+            self.scan_thread.requestInterruption()
+            self.scan_thread.wait()
+
+        # Flush the write-behind queue, including the video that is still open
+        if self.current_video_attrs is not None:
+            self.saveAnnotation(self.current_video_attrs)
+        self.saveSession()
+        self.annotations.close()
+        if self.sync is not None:
+            self.sync.close()
+        if self.leases is not None:
+            self.leases.close()
+        if self.instance is not None:
+            self.media_prefetcher.release_all()
+            self.playback.detach()
+        self.frame_indexes.close()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+        if self.candidate_cache is not None:
+            self.candidate_cache.close()
+        if self.snapshots is not None:
+            self.snapshots.close()
+        metrics.event("annotation_writer", **self.annotation_writer.stats())
+        metrics.close()
+        QtWidgets.QMainWindow.closeEvent(self, event)
+
     def resource_path(self, relative_path):
         """ Get the absolute path to a resource, works for dev and PyInstaller """
         if hasattr(sys, '_MEIPASS'):
@@ -192,6 +470,17 @@ class Player(QtWidgets.QMainWindow):
         self.shortcut_frame_backward = QShortcut(QKeySequence(QtCore.Qt.Key_Q), self)
         self.shortcut_frame_backward.activated.connect(partial(self.moveFrameBackward, unit=10))
 
+        # Scene changes and motion onsets/stops found by --candidates
+        if self.candidate_cache is not None:
+            self.shortcut_next_candidate = QShortcut(QKeySequence(QtCore.Qt.Key_D), self)
+            self.shortcut_next_candidate.activated.connect(partial(self.jumpToCandidate, direction=1))
+
+            self.shortcut_previous_candidate = QShortcut(QKeySequence(QtCore.Qt.Key_A), self)
+            self.shortcut_previous_candidate.activated.connect(partial(self.jumpToCandidate, direction=-1))
+
+            self.shortcut_snap_annotate = QShortcut(QKeySequence(QtCore.Qt.SHIFT + QtCore.Qt.Key_Return), self)
+            self.shortcut_snap_annotate.activated.connect(self.snapAnnotate)
+
         # for s in string.ascii_uppercase:
         #     key = getattr(QtCore.Qt, "Key_" + s)
         #     shortcut = QShortcut(QKeySequence(key), self)
@@ -209,6 +498,8 @@ class Player(QtWidgets.QMainWindow):
 
     def removeAnnotations(self):
         annotation_keys = None
+        removed_key = None
+        removed_frame_key = None
         # Remove the latest annotation
         if self.current_video_attrs["annotations"]:
             # Get the keys and sort them to find the last added annotation
@@ -216,6 +507,7 @@ class Player(QtWidgets.QMainWindow):
             if annotation_keys:
                 last_annotation_key = annotation_keys[-1]  # Get the last key
                 del self.current_video_attrs["annotations"][last_annotation_key]  # Remove the last annotation
+                removed_key = last_annotation_key
 
         if self.current_video_attrs["annotations_frame"]:
             # Get the keys and sort them to find the last added annotation
@@ -223,8 +515,15 @@ class Player(QtWidgets.QMainWindow):
             if annotation_keys:
                 last_annotation_key = annotation_keys[-1]  # Get the last key
                 del self.current_video_attrs["annotations_frame"][last_annotation_key]  # Remove the last annotation
+                removed_frame_key = last_annotation_key
+                self.intervals.remove(removed_frame_key)
                 
         self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
+        if removed_key is not None or removed_frame_key is not None:
+            self.annotations.record_remove(self.current_video_attrs, removed_key, removed_frame_key)
+            if self.sync is not None:
+                self.sync.push({"op": "remove", "name": self.current_video_attrs["name"],
+                                "key": removed_key, "frame_key": removed_frame_key})
 
         if self.current_video_attrs["annotations_frame"]:
             self.current_annotation = last_annotation_key
@@ -246,38 +545,6 @@ class Player(QtWidgets.QMainWindow):
         else:
             return None
     
-    def check_paired_ts_key(self, annotations_frame_dict):
-        if annotations_frame_dict:
-            keys = list(annotations_frame_dict.keys())
-            
-            # Extract all indices that appear in the keys
-            indices = sorted(set(int(key[1:]) for key in keys if key[1:].isdigit()))
-            
-            # Initialize lists to hold paired and unpaired keys
-            paired = []
-            unpaired = []
-
-            # Loop to find paired and unpaired keys
-            for i in indices:
-                s_key = f"S{i}"
-                e_key = f"E{i}"
-                if s_key in keys and e_key in keys:
-                    paired.append((s_key, e_key))
-                else:
-                    if s_key in keys:
-                        unpaired.append(s_key)
-                    if e_key in keys:
-                        unpaired.append(e_key)
-
-            # Check if there are any unpaired keys
-            if not unpaired:
-                return None
-            else:
-                return unpaired
-        else:
-            return None
-
-
     def trigger_paired_warning(self, text = ""):
         msg_box = QtWidgets.QMessageBox()
         msg_box.setIcon(QtWidgets.QMessageBox.Warning)
@@ -289,23 +556,133 @@ class Player(QtWidgets.QMainWindow):
     
     def previousShortcut(self):
         if self.prev_visible:
-            unpaired = self.check_paired_ts_key(self.current_video_attrs["annotations_frame"])
+            unpaired = self.intervals.unpaired()
             if unpaired:
                 self.trigger_paired_warning(text=unpaired)
             else:
-                time.sleep(0.3)
                 self.previous()
 
     def nextShortcut(self):
         if self.next_visible:
-            unpaired = self.check_paired_ts_key(self.current_video_attrs["annotations_frame"])
+            unpaired = self.intervals.unpaired()
             if unpaired:
                 self.trigger_paired_warning(text=unpaired)
             else:
-                time.sleep(0.3)
                 self.next()
             
+    def currentFrame(self):
+        """Frame number at the current playback time"""
+        if self.isPaused and self.step_frame is not None:
+            return self.step_frame
+
+        current_time = self.mediaplayer.get_time()
+        index = self.frame_indexes.get(self.media_path)
+        if index is not None:
+            return index.frame_at(current_time)
+
+        # Get FPS (Frames Per Second)
+        fps = self.mediaplayer.get_fps()
+        return int((current_time / 1000) * fps)
+
+    def stepFrames(self, unit):
+        """Seek unit frames forward (or backward if negative), returns False without a frame index"""
+        index = self.frame_indexes.get(self.media_path)
+        if index is None:
+            return False
+
+        self.seekFrame(min(max(self.currentFrame() + unit, 0), len(index) - 1))
+        return True
+
+    def seekFrame(self, frame):
+        """Seek to frame through the frame index of the current video, which has to be built"""
+        index = self.frame_indexes.get(self.media_path)
+        self.mediaplayer.set_time(int(index.time_of(frame)))
+        # get_time() lags behind seeks while paused, remember where we stepped to
+        self.step_frame = frame
+        self.positionslider.setValue(int(frame / max(len(index) - 1, 1) * 1000))
+        self.markwidget.setPlayhead(frame / max(len(index) - 1, 1))
+
+        if self.isPaused:
+            self.showScrubFrame(frame)
+
+    def currentPosition(self):
+        """Playback position between 0 and 1, of the stepped-to frame while paused like currentFrame"""
+        if self.isPaused and self.step_frame is not None:
+            index = self.frame_indexes.get(self.media_path)
+            length = self.mediaplayer.get_length()
+            if index is not None and length > 0:
+                return index.time_of(self.step_frame) / length
+        return self.mediaplayer.get_position()
+
+    def jumpToCandidate(self, direction):
+        """Seek to the next (direction 1) or previous (-1) candidate frame of the current video"""
+        if self.candidate_frames is None or self.frame_indexes.get(self.media_path) is None:
+            self.statusbar.showMessage("Candidates of this video are not computed yet")
+            return
+
+        frame = self.currentFrame()
+        if direction > 0:
+            i = bisect.bisect_right(self.candidate_frames, frame)
+        else:
+            i = bisect.bisect_left(self.candidate_frames, frame) - 1
+        if not 0 <= i < len(self.candidate_frames):
+            self.statusbar.showMessage("No more candidates in this direction")
+            return
+        self.seekFrame(int(self.candidate_frames[i]))
+
+    def nearestCandidate(self, frame):
+        """The candidate frame closest to frame, None if there is none within snap_frames"""
+        i = bisect.bisect_left(self.candidate_frames, frame)
+        nearest = [int(self.candidate_frames[j]) for j in (i - 1, i) if 0 <= j < len(self.candidate_frames)]
+        nearest = min(nearest, key=lambda candidate: abs(candidate - frame), default=None)
+        if nearest is None or abs(nearest - frame) > self.snap_frames:
+            return None
+        return nearest
+
+    def snapAnnotate(self):
+        """Annotate at the candidate frame nearest to the current one instead of the current frame"""
+        if self.candidate_frames is None or self.frame_indexes.get(self.media_path) is None:
+            self.statusbar.showMessage("Candidates of this video are not computed yet")
+            return
+
+        frame = self.nearestCandidate(self.currentFrame())
+        if frame is None:
+            self.statusbar.showMessage(f"No candidate within {self.snap_frames} frames")
+            return
+        # Paused, currentFrame and currentPosition return the frame seeked to
+        if not self.isPaused:
+            self.pause()
+        self.seekFrame(frame)
+        self.annotate()
+
+    def scrubRing(self):
+        """The decoded frame ring of the current video, created the first time it is needed"""
+        if self.frame_ring is None:
+            self.frame_ring = FrameRing(self.media_path, max_bytes=self.scrub_cache_mb * 1024 * 1024,
+                                        frame_indexes=self.frame_indexes)
+        return self.frame_ring
+
+    def showScrubFrame(self, frame):
+        ring = self.scrubRing()
+        ring.set_center(frame)
+
+        image = ring.get(frame)
+        if image is None:
+            # Not decoded yet, let vlc show the frame it seeks to
+            self.videostack.setCurrentWidget(self.videoframe)
+            return
+
+        height, width = image.shape[:2]
+        qimage = QtGui.QImage(image.data, width, height, 3 * width, QtGui.QImage.Format_RGB888)
+        pixmap = QtGui.QPixmap.fromImage(qimage).scaled(self.scrub_label.size(), Qt.KeepAspectRatio,
+                                                        Qt.FastTransformation)
+        self.scrub_label.setPixmap(pixmap)
+        self.videostack.setCurrentWidget(self.scrub_label)
+
     def moveFrameForward(self, unit):
+        if self.stepFrames(unit):
+            return
+
         # Move the slider 1 unit forward
         current_position = self.positionslider.value()
         new_position = min(current_position + unit, 1000)
@@ -313,6 +690,9 @@ class Player(QtWidgets.QMainWindow):
         self.setPosition(new_position)
 
     def moveFrameBackward(self, unit):
+        if self.stepFrames(-unit):
+            return
+
         # Move the slider 1 unit backward
         current_position = self.positionslider.value()
         new_position = max(current_position - unit, 0)
@@ -359,44 +739,47 @@ class Player(QtWidgets.QMainWindow):
             msg_box.exec()  # This will display the message box
 
         else:
-            self.current_video_attrs["annotations"][self.current_annotation] = [self.mediaplayer.get_position()] + self.current_video_attrs["annotations"].get(self.current_annotation, [])
+            with metrics.span("annotate"):
+                annotated_key = self.current_annotation
+                position = self.currentPosition()
+                self.current_video_attrs["annotations"][self.current_annotation] = [position] + self.current_video_attrs["annotations"].get(self.current_annotation, [])
             
-            ## New
-            # Get current time position in milliseconds
-            current_time = self.mediaplayer.get_time()
+                ## New
+                # Frame number from the frame index of the video, time * fps until it is built
+                current_frame = self.currentFrame()
 
-            # Get FPS (Frames Per Second)
-            fps = self.mediaplayer.get_fps()
+                self.current_video_attrs["annotations_frame"][self.current_annotation] = [current_frame]
+                self.intervals.add(self.current_annotation, current_frame)
 
-            # Calculate current frame number
-            current_frame = int((current_time / 1000) * fps)
 
-            self.current_video_attrs["annotations_frame"][self.current_annotation] = [current_frame]
-
-
-            self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
+                self.annotations[self.current_video_attrs["name"]] = self.current_video_attrs
+                self.annotations.record_annotate(self.current_video_attrs, self.current_annotation)
+                if self.sync is not None:
+                    self.sync.push({"op": "annotate", "name": self.current_video_attrs["name"],
+                                    "path": self.current_video_attrs["path"], "key": annotated_key,
+                                    "position": self.current_video_attrs["annotations"][annotated_key],
+                                    "frame": self.current_video_attrs["annotations_frame"][annotated_key]})
             
-            self.update_loaded_event_idx(self.current_event, self.current_ann_idx)
-            self.current_annotation = self.current_event + str(self.current_ann_idx)
-
-            self.setVisibilities()
+                self.update_loaded_event_idx(self.current_event, self.current_ann_idx)
+                self.current_annotation = self.current_event + str(self.current_ann_idx)
 
-            if self.save_frames:
-                self.writeFrameToFile()
+                self.setVisibilities()
 
-    def writeFrameToFile(self):
-        path_to_save = os.path.join(self.annotations_dir, self.current_annotation)
-        if not os.path.exists(path_to_save):
-            os.mkdir(path_to_save)
+                if self.save_frames:
+                    self.writeFrameToFile(annotated_key, current_frame, position)
 
-        frame_file_name = os.path.join(path_to_save, 
-                                       f'{self.current_video_attrs["name"]}_{str(self.mediaplayer.get_position())}'.replace(".", "_") + '.png')
+    def writeFrameToFile(self, key, frame, position):
+        """Queue frame of the current video to be saved under <annotations dir>/<key>/"""
+        frame_file_name = os.path.join(self.annotations_dir, key,
+                                       f'{self.current_video_attrs["name"]}_{str(position)}'.replace(".", "_"))
 
-        self.mediaplayer.video_take_snapshot(0, frame_file_name, 0 , 0)
+        self.snapshots.submit(self.media_path, frame, frame_file_name)
 
+    @timed("saveAnnotation")
     def saveAnnotation(self, annotation):
-        with open(os.path.join(self.annotations_dir, annotation["name"] + ".json"), "w+") as f:
-            json.dump(annotation, f)
+        self.annotations.save(annotation)
+        if self.sync is not None:
+            self.sync.push({"op": "put", "name": annotation["name"], "doc": export_document(annotation)})
 
     def playPauseShortcut(self):
         if self.isPaused:
@@ -406,19 +789,71 @@ class Player(QtWidgets.QMainWindow):
 
     def createVideoPlayer(self):
 
+        # libvlc is loaded by createMediaPlayer when the first video is opened
+        self.instance = None
+        self.mediaplayer = None
+        self.media_prefetcher = None
+        self.playback = None
+
+        self.media = None
+        self.media_path = None
+        self.mediaParsed.connect(self.setMediaTitle)
+
+        # Frame-exact time <-> frame mapping, built in the background per video
+        self.frame_indexes = FrameIndexCache()
+        self.step_frame = None
+        self.frame_ring = None
+
+        # Annotated frames saved with --save_frames, decoded and written off the GUI thread
+        self.snapshots = None
+        if self.save_frames:
+            self.snapshots = SnapshotWriter(self.snapshot_format, self.snapshot_quality,
+                                            frame_indexes=self.frame_indexes)
+
+        # Thumbnail sprites drawn behind the marks, built in worker processes
+        self.thumbnails = None
+        self.filmstrip_ahead = 5
+        if self.filmstrip:
+            self.thumbnailReady.connect(self.onThumbnailReady)
+            self.thumbnails = ThumbnailCache(on_ready=lambda video_path, sprite_path:
+                                             self.thumbnailReady.emit(video_path, sprite_path))
+
+        # Scene change and motion scores drawn with the marks, computed in worker processes
+        self.candidate_cache = None
+        self.candidate_frames = None
+        self.candidates_ahead = 3
+        # Shift+Return snaps to a candidate at most this many frames away
+        self.snap_frames = 15
+        if self.candidates:
+            self.candidatesReady.connect(self.onCandidatesReady)
+            self.candidate_cache = CandidateCache(on_ready=lambda video_path: self.candidatesReady.emit(video_path))
+
+        self.isPaused = False
+
+    def createMediaPlayer(self):
+        """Create the libvlc instance and player, the window is shown before libvlc loads its plugins"""
+        if self.instance is not None:
+            return
+
         self.instance = vlc.Instance()
 
         self.mediaplayer = self.instance.media_player_new()
 
+        self.media_prefetcher = MediaPrefetcher(self.instance, ahead=2, behind=1)
+
+        # Slider updates and end-of-video handling are driven by libvlc events
+        self.playback = PlaybackStateMachine(self.mediaplayer, self)
+        self.playback.positionChanged.connect(self.updatePosition)
+        self.playback.endReached.connect(self.onEndReached)
+
         if self.muted:
             self.mediaplayer.audio_set_volume(0)
 
-        self.isPaused = False
-
 
     def createToolbar(self):
         toolbar = QToolBar("Manage Video")
         toolbar.setIconSize(QSize(32, 32))
+        self.toolbar = toolbar
 
         self.addToolBar(toolbar)
 
@@ -462,11 +897,11 @@ class Player(QtWidgets.QMainWindow):
 
 
     def play(self):
-        print("Play clicked")
+        metrics.event("play")
         self.PlayPause()
 
     def pause(self):
-        print("Pause clicked")
+        metrics.event("pause")
         self.PlayPause()
 
 
@@ -490,11 +925,18 @@ class Player(QtWidgets.QMainWindow):
 
     def previous(self):
 
-        print("Previous clicked")
+        metrics.event("previous")
+        metrics.begin("video_switch")
+
+        if self.leases is not None:
+            index = self.claimVideo(self.current_video - 1, -1, wrap=False)
+        else:
+            index = self.current_video - 1
 
         self.reset_annotation()
 
-        if self.current_video - 1 < 0:
+        if index is None or index < 0:
+            metrics.cancel("video_switch")
             return
 
         self.saveAnnotation(self.current_video_attrs)
@@ -502,41 +944,36 @@ class Player(QtWidgets.QMainWindow):
         if not self.isPaused:
             self.Stop()
 
-        self.current_video -= 1
+        # Going back did not finish the video, leave it free for others
+        self.releaseCurrentVideo(done=False)
+        self.current_video = index
         video_path = self.video_paths[self.current_video]
-        if "\\" in video_path:
-            video_name = video_path.split("\\")[-1]
-        else:
-            video_name = video_path.split("/")[-1]
+        video_name = video_name_from_path(video_path)
 
 
         self.file = self.OpenFile(video_path)
-
-        if video_name in self.annotations:
-            self.current_video_attrs = self.annotations[video_name]
-            if self.current_video_attrs["annotations_frame"]:
-                keys = list(self.current_video_attrs["annotations_frame"].keys())
-                idx_keys = sorted([int(key[1:]) for key in keys])
-                self.current_event = "S"
-                self.current_ann_idx = max(idx_keys) + 1
-        else:
-            self.current_video_attrs = {
-                "name": video_name,
-                "path": video_path,
-                "annotations": {},
-                "annotations_frame": {}
-            }
-
-            self.annotations[video_name] = self.current_video_attrs
+        self.loadVideoAnnotations(video_name, video_path)
 
         self.progress.setValue(self.current_video)
 
         self.setVisibilities()
         self.play()
+        self.saveSession()
 
     def next(self):
-        print("Next clicked")
+        metrics.event("next")
+        metrics.begin("video_switch")
         
+        index = None
+        if self.leases is not None:
+            index = self.claimVideo(self.current_video + 1, 1)
+            if index is None:
+                QtWidgets.QMessageBox.question(self, "No unclaimed videos left.",
+                                               "Every other video is done or being annotated by someone else.",
+                                               QtWidgets.QMessageBox.Ok)
+                metrics.cancel("video_switch")
+                return
+
         self.reset_annotation()
 
         self.saveAnnotation(self.current_video_attrs)
@@ -544,7 +981,12 @@ class Player(QtWidgets.QMainWindow):
         if not self.isPaused:
             self.Stop()
 
-        self.current_video += 1
+        if index is not None:
+            # Reviewed, with or without events, so no one is handed it again
+            self.releaseCurrentVideo(done=True)
+            self.current_video = index
+        else:
+            self.current_video += 1
 
         if self.current_video == self.num_videos:
             QtWidgets.QMessageBox.question(self, "No more videos left.", "All videos are annotated. Now, opening the first video...",
@@ -553,29 +995,10 @@ class Player(QtWidgets.QMainWindow):
 
         video_path = self.video_paths[self.current_video]
 
-        if "\\" in video_path:
-            video_name = video_path.split("\\")[-1]
-        else:
-            video_name = video_path.split("/")[-1]
+        video_name = video_name_from_path(video_path)
 
         self.file = self.OpenFile(video_path)
-
-        if video_name in self.annotations:
-            self.current_video_attrs = self.annotations[video_name]
-            if self.current_video_attrs["annotations_frame"]:
-                keys = list(self.current_video_attrs["annotations_frame"].keys())
-                idx_keys = sorted([int(key[1:]) for key in keys])
-                self.current_event = "S"
-                self.current_ann_idx = max(idx_keys) + 1
-        else:
-            self.current_video_attrs = {
-                "name": video_name,
-                "path": video_path,
-                "annotations": {},
-                "annotations_frame": {}
-            }
-
-            self.annotations[video_name] = self.current_video_attrs
+        self.loadVideoAnnotations(video_name, video_path)
 
         self.current_annotation = self.current_event + str(self.current_ann_idx)
 
@@ -583,6 +1006,7 @@ class Player(QtWidgets.QMainWindow):
 
         self.setVisibilities()
         self.play()
+        self.saveSession()
 
     def createUI(self):
         """Set up the user interface, signals & slots
@@ -608,10 +1032,22 @@ class Player(QtWidgets.QMainWindow):
         self.positionslider.sliderMoved.connect(self.setPosition)
 
         self.vboxlayout = QtWidgets.QVBoxLayout()
-        self.vboxlayout.addWidget(self.videoframe)
+        # While paused, frames stepped to from the scrub ring are shown in
+        # scrub_label instead of waiting for vlc to seek and decode
+        self.scrub_label = QtWidgets.QLabel()
+        self.scrub_label.setAlignment(Qt.AlignCenter)
+        self.scrub_label.setStyleSheet("background-color: black")
+        self.scrub_label.setMinimumSize(1, 1)
+
+        self.videostack = QtWidgets.QStackedWidget()
+        self.videostack.addWidget(self.videoframe)
+        self.videostack.addWidget(self.scrub_label)
+
+        self.vboxlayout.addWidget(self.videostack)
         self.vboxlayout.addWidget(self.positionslider)
 
         self.markwidget = MarkWidget()
+        self.markwidget.setFilmstripMode(self.filmstrip)
 
         self.vboxlayout.addWidget(self.markwidget)
 
@@ -622,10 +1058,6 @@ class Player(QtWidgets.QMainWindow):
         self.progress.setMaximum(self.num_videos)
         self.vboxlayout.addWidget(self.progress)
 
-        self.timer = QtCore.QTimer(self)
-        self.timer.setInterval(100)
-        self.timer.timeout.connect(self.updateUI)
-
 
     def PlayPause(self):
         """Toggle play/pause status
@@ -635,12 +1067,15 @@ class Player(QtWidgets.QMainWindow):
             self.action_play.setVisible(True)
             self.action_pause.setVisible(False)
             self.isPaused = True
+            # Start decoding the frames around the pause position
+            self.scrubRing().set_center(self.currentFrame())
         else:
             self.mediaplayer.play()
             self.action_play.setVisible(False)
             self.action_pause.setVisible(True)
-            self.timer.start()
             self.isPaused = False
+            self.step_frame = None
+            self.videostack.setCurrentWidget(self.videoframe)
 
     def Stop(self):
         """Stop player
@@ -648,28 +1083,63 @@ class Player(QtWidgets.QMainWindow):
         self.mediaplayer.stop()
 
 
+    @timed("OpenFile")
     def OpenFile(self, filename=None):
         """Open a media file in a MediaPlayer
         """
         if filename is None or filename is False:
-            print("Attempt to openup OpenFile")
             filenameraw = QtWidgets.QFileDialog.getOpenFileName(self, "Open File", os.path.expanduser('~'))
             filename = filenameraw[0]
 
         if not filename:
             return
 
+        self.createMediaPlayer()
+
         # create the media
         if sys.version < '3':
             filename = unicode(filename)
-        self.media = self.instance.media_new(filename)
+        previous_media = self.media
+        # usually already parsed by the prefetcher, otherwise parsed asynchronously
+        self.media = self.media_prefetcher.take(filename)
+        self.media_path = filename
         # put the media in the media player
         self.mediaplayer.set_media(self.media)
 
-        # parse the metadata of the file
-        self.media.parse()
-        # set the title of the track as window title
-        self.setWindowTitle(self.title + " | " + self.media.get_meta(0))
+        if previous_media is not None:
+            previous_media.event_manager().event_detach(vlc.EventType.MediaParsedChanged)
+            previous_media.release()
+
+        # set the title of the track as window title once the metadata is parsed
+        if is_parsed(self.media):
+            metrics.event("media.parse prefetched")
+            self.setMediaTitle(filename)
+        else:
+            metrics.begin("media.parse")
+            self.media.event_manager().event_attach(vlc.EventType.MediaParsedChanged,
+                                                    lambda event, path=filename: self.mediaParsed.emit(path))
+
+        self.media_prefetcher.prefetch(self.video_paths, self.current_video)
+
+        self.step_frame = None
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring = None
+
+        self.videostack.setCurrentWidget(self.videoframe)
+        self.frame_indexes.request(filename)
+        if self.current_video + 1 < len(self.video_paths):
+            self.frame_indexes.request(self.video_paths[self.current_video + 1])
+
+        if self.thumbnails is not None:
+            sprite_path = self.thumbnails.get(filename)
+            self.markwidget.setFilmstrip(QtGui.QPixmap(sprite_path) if sprite_path is not None else None)
+            self.thumbnails.request(self.video_paths[self.current_video + 1:self.current_video + 1 + self.filmstrip_ahead])
+
+        if self.candidate_cache is not None:
+            self.showCandidates(self.candidate_cache.get(filename))
+            self.candidate_cache.request(
+                self.video_paths[self.current_video + 1:self.current_video + 1 + self.candidates_ahead])
 
         # the media player has to be 'connected' to the QFrame
         # (otherwise a video would be displayed in it's own window)
@@ -684,44 +1154,109 @@ class Player(QtWidgets.QMainWindow):
             self.mediaplayer.set_nsobject(int(self.videoframe.winId()))
 
 
+    def onThumbnailReady(self, video_path, sprite_path):
+        if video_path == self.media_path:
+            self.markwidget.setFilmstrip(QtGui.QPixmap(sprite_path))
+
+    def showCandidates(self, loaded):
+        """Use the (scores, candidate frames) of CandidateCache.get for the current video, None clears them"""
+        scores, self.candidate_frames = loaded if loaded is not None else (None, None)
+        self.markwidget.setScores(scores, self.candidate_frames)
+
+    def onCandidatesReady(self, video_path):
+        if video_path == self.media_path:
+            self.showCandidates(self.candidate_cache.get(video_path))
+
+    def setMediaTitle(self, path):
+        # Parse notifications of a media that is no longer current are ignored
+        if path != self.media_path:
+            return
+        metrics.end("media.parse")
+        title = self.media.get_meta(0) or os.path.basename(path)
+        self.setWindowTitle(self.title + " | " + title)
+
     def setPosition(self, position):
         """Set the position
         """
+        if self.mediaplayer is None:
+            return
         # setting the position to where the slider was dragged
         self.mediaplayer.set_position(position / 1000.0)
+        self.step_frame = None
+        self.markwidget.setPlayhead(position / 1000.0)
+        self.videostack.setCurrentWidget(self.videoframe)
         # the vlc MediaPlayer needs a float value between 0 and 1, Qt
         # uses integer variables, so you need a factor; the higher the
         # factor, the more precise are the results
         # (1000 should be enough)
 
-    def updateUI(self):
-        """updates the user interface"""
-        # setting the slider to the desired position
-        self.positionslider.setValue(self.mediaplayer.get_position() * 1000)
-
-        if not self.mediaplayer.is_playing():
-            # no need to call this function if nothing is played
-            self.timer.stop()
-
-            if not self.isPaused:
-                self.Stop()
-                unpaired = self.check_paired_ts_key(self.current_video_attrs["annotations_frame"])
-                if unpaired:
-                    self.trigger_paired_warning(text=unpaired)
-                    self.positionslider.setValue(0 * 1000)
-                    self.play()
-                else:
-                    self.next()
-                    print("Next based on Update UI")
+    def updatePosition(self, position):
+        """Move the slider along with the playback position"""
+        if not self.positionslider.isSliderDown():
+            self.positionslider.setValue(int(position * 1000))
+        self.markwidget.setPlayhead(position)
+        # Keypress on next/previous until the new video plays
+        metrics.end("video_switch")
+
+    def onEndReached(self):
+        """Advance to the next video, unless the current one has unpaired time stamps"""
+        self.Stop()
+        unpaired = self.intervals.unpaired()
+        if unpaired:
+            self.trigger_paired_warning(text=unpaired)
+            self.positionslider.setValue(0 * 1000)
+            self.play()
+        else:
+            metrics.event("end_of_video")
+            self.next()
+
+class VideoScanThread(QtCore.QThread):
+    """Scans a videos directory off the GUI thread and streams sorted batches of paths
+    """
+    batchFound = QtCore.pyqtSignal(list)
+    scanFinished = QtCore.pyqtSignal(int)
+
+    def __init__(self, videos_dir, recursive=False, parent=None):
+        super().__init__(parent)
+        self.videos_dir = videos_dir
+        self.recursive = recursive
+        # mtime of every scanned directory, for the scan cache
+        self.directories = {}
+
+    def run(self):
+        count = 0
+        for batch in iter_video_batches(self.videos_dir, self.recursive, directories=self.directories):
+            if self.isInterruptionRequested():
+                return
+            count += len(batch)
+            self.batchFound.emit(batch)
+        self.scanFinished.emit(count)
+
 
 class MarkWidget(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
 
         self.annotations = {}
+        self.filmstrip = None
+        self.scores = None
+        self.candidates = None
+        self.playhead = None
         self.setMaximumSize(5000, 30)
         random.seed(102)
 
+        self.label_font = QFont('Serif', 10, QFont.Light)
+        self.font_metrics = QtGui.QFontMetrics(self.label_font)
+        self.label_widths = {}
+        self.pens = {}
+        self.playhead_pen = QPen(QColor(255, 0, 0), 1, Qt.SolidLine)
+        self.motion_pen = QPen(QColor(30, 90, 200, 160), 1, Qt.SolidLine)
+        self.cut_pen = QPen(QColor(230, 120, 0, 160), 1, Qt.SolidLine)
+        self.candidate_pen = QPen(QColor(0, 120, 40), 2, Qt.SolidLine)
+
+        self.cache = None
+        self.cache_size = None
+
         self.index_color_map = {
             "1": [104, 67, 31],
             "2": [112, 254, 249],
@@ -826,52 +1361,182 @@ class MarkWidget(QtWidgets.QWidget):
 
 
 
+    def pen_for_index(self, index):
+        """QPen of the marks with index, created once per index"""
+        pen = self.pens.get(index)
+        if pen is None:
+            pen = self.pens[index] = QPen(self.get_color_for_index(index), 1.5, Qt.SolidLine)
+        return pen
+
+    def label_width(self, key):
+        width = self.label_widths.get(key)
+        if width is None:
+            width = self.label_widths[key] = self.font_metrics.width(key)
+        return width
+
+    @timed("MarkWidget.paintEvent")
     def paintEvent(self, e):
+        # Marks are rendered into self.cache only when they or the size change,
+        # a paint event just blits it and draws the playhead on top
+        if self.cache is None or self.cache_size != self.size():
+            self.cache = self.renderCache()
+            self.cache_size = self.size()
+
         qp = QPainter()
         qp.begin(self)
+        qp.drawPixmap(0, 0, self.cache)
+        self.drawPlayhead(qp)
+        qp.end()
+
+    def renderCache(self):
+        ratio = self.devicePixelRatioF()
+        pixmap = QtGui.QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+
+        qp = QPainter()
+        qp.begin(pixmap)
         self.drawWidget(qp)
         qp.end()
+        return pixmap
+
+    def invalidate(self):
+        self.cache = None
+        self.update()
+
+    def resizeEvent(self, e):
+        self.cache = None
+        super().resizeEvent(e)
 
     def setAnnotations(self, annotations):
         self.annotations = annotations
-        self.repaint()
+        self.invalidate()
 
+    def setFilmstripMode(self, enabled):
+        """Make room for the thumbnail sprite drawn behind the marks"""
+        if enabled:
+            self.setMinimumHeight(54)
+            self.setMaximumSize(5000, 54)
+        else:
+            self.setMinimumHeight(0)
+            self.setMaximumSize(5000, 30)
+
+    def setFilmstrip(self, pixmap):
+        self.filmstrip = pixmap
+        self.invalidate()
+
+    def setScores(self, scores, candidates):
+        """Per-frame scores (see candidates.analyze_video) drawn as curves, and candidate frames as ticks"""
+        self.scores = scores
+        self.candidates = candidates
+        self.invalidate()
+
+    def drawScores(self, qp, w, h):
+        frames = self.scores.shape[1]
+        if frames == 0 or w <= 0:
+            return
+
+        # The highest score of the frames under each pixel column
+        columns = np.arange(w) * frames // w
+        cut = np.maximum.reduceat(self.scores[CUT].astype(np.float32), columns)
+        motion = np.maximum.reduceat(self.scores[MOTION].astype(np.float32), columns)
+        motion /= max(float(motion.max()), 1e-6)
+
+        qp.setPen(self.motion_pen)
+        qp.drawPolyline(QtGui.QPolygonF([QtCore.QPointF(x, h - 1 - value * (h - 2))
+                                         for x, value in enumerate(motion.tolist())]))
+        qp.setPen(self.cut_pen)
+        qp.drawLines([QtCore.QLineF(x, h - 1, x, h - 1 - value * (h - 2))
+                      for x, value in enumerate(cut.tolist()) if value > 0.05])
+
+        if self.candidates is not None and len(self.candidates):
+            qp.setPen(self.candidate_pen)
+            scale = w / max(frames - 1, 1)
+            qp.drawLines([QtCore.QLine(int(frame * scale), h - 5, int(frame * scale), h - 1)
+                          for frame in self.candidates.tolist()])
+
+    def playheadX(self):
+        if self.playhead is None:
+            return None
+        return int(self.width() * self.playhead)
+
+    def setPlayhead(self, position):
+        """Move the playhead, only the columns it leaves and enters are repainted"""
+        old_x = self.playheadX()
+        self.playhead = position
+        new_x = self.playheadX()
+        if old_x == new_x:
+            return
+
+        h = self.height()
+        if old_x is not None:
+            self.update(old_x - 1, 0, 3, h)
+        if new_x is not None:
+            self.update(new_x - 1, 0, 3, h)
+
+    def drawPlayhead(self, qp):
+        x = self.playheadX()
+        if x is not None:
+            qp.setPen(self.playhead_pen)
+            qp.drawLine(x, 0, x, self.height())
 
     def drawWidget(self, qp):
         MAX_CAPACITY  = 1000
-        font = QFont('Serif', 10, QFont.Light)
-        qp.setFont(font)
+        qp.setFont(self.label_font)
         size = self.size()
         w    = size.width()
         h    = size.height()
-        step = int(round(w / 1000))
         full = int(((w / MAX_CAPACITY) * MAX_CAPACITY))
 
-        qp.setPen(QColor(255, 255, 255))
-        qp.setBrush(QColor(255, 255, 184))
-        qp.drawRect(0, 0, full, h)
+        if self.filmstrip is not None:
+            qp.drawPixmap(QtCore.QRect(0, 0, full, h), self.filmstrip)
+        else:
+            qp.setPen(QColor(255, 255, 255))
+            qp.setBrush(QColor(255, 255, 184))
+            qp.drawRect(0, 0, full, h)
+
+        if self.scores is not None:
+            self.drawScores(qp, full, h)
 
         pen = QPen(QColor(20, 20, 20), 1, Qt.SolidLine)
         qp.setPen(pen)
         qp.setBrush(Qt.NoBrush)
         qp.drawRect(0, 0, w-1, h-1)
-        j = 0
-        
+
+        # Group the lines by index, so each colour costs a single drawLines call
+        lines = {}
+        labels = []
         for key, poslist in self.annotations.items():
             current_idx = int(key[1:])
-            qp.setPen(QPen(self.get_color_for_index(current_idx), 1.5, Qt.SolidLine))
+            idx_lines = lines.setdefault(current_idx, [])
 
             for pos in poslist:
                 x = int(w*pos)
-                metrics = qp.fontMetrics()
-                qp.drawLine(x, 0, x, h)
-                fw = metrics.width(key)
-                qp.drawText(x+fw/2, h/2, key)
+                idx_lines.append(QtCore.QLine(x, 0, x, h))
+                labels.append((x, key, current_idx))
+
+        for current_idx, idx_lines in lines.items():
+            qp.setPen(self.pen_for_index(current_idx))
+            qp.drawLines(idx_lines)
+
+        # Draw labels left to right and skip those that would overlap the previous one
+        labels.sort()
+        label_end = None
+        for x, key, current_idx in labels:
+            fw = self.label_width(key)
+            left = x + fw / 2
+            if label_end is not None and left < label_end:
+                continue
+            qp.setPen(self.pen_for_index(current_idx))
+            qp.drawText(QtCore.QPointF(left, h / 2), key)
+            label_end = left + fw + 2
 
 
 
 
 if __name__ == "__main__":
+    # Thumbnails are built in worker processes, also from the frozen executable
+    multiprocessing.freeze_support()
     # os.environ["VLC_PLUGIN_PATH"] = "/usr/lib64/vlc/plugins"
     parser = argparse.ArgumentParser(
         description='PIASPACE video annotation.')
@@ -879,11 +1544,55 @@ if __name__ == "__main__":
                         help=('Run muted.'))
     parser.add_argument('--save_frames', action='store_true',
                         help=('Save video frames as png files during annotation.'))
+    parser.add_argument('--profile', action='store_true',
+                        help=('Time video switches, file opening, saving, annotating and drawing, '
+                              'and show the timings in a panel.'))
+    parser.add_argument('--trace', default=None,
+                        help=('Also write the timings to this file as a Chrome trace, implies --profile.'))
+    parser.add_argument('--videos_dir', '--videos-dir', default=None,
+                        help=('Directory containing the videos, skips the dialog.'))
+    parser.add_argument('--annotations_dir', '--annotations-dir', default=None,
+                        help=('Directory for the annotations, skips the dialog.'))
+    parser.add_argument('--resume', action='store_true',
+                        help=('Reopen the directories of the last session without asking.'))
+    parser.add_argument('--leases', action='store_true',
+                        help=('Claim videos with lease files in the annotations directory, so several annotators '
+                              'can share the directories without working on the same video.'))
+    parser.add_argument('--shard', default=None,
+                        help=('Only annotate the videos of shard i/n, e.g. 0/4, split by a hash of the video name.'))
+    parser.add_argument('--sync', default=None,
+                        help=('Also push every annotation edit to the sync server at host:port (see sync_server.py), '
+                              'edits made while it is unreachable are sent later.'))
+    parser.add_argument('--recursive', action='store_true',
+                        help=('Also look for videos in sub-directories of the videos directory.'))
+    parser.add_argument('--storage', choices=STORAGE_KINDS, default="json",
+                        help=('Where annotation edits are recorded: rewrite the per-video JSON files, '
+                              'an append-only journal or a SQLite database.'))
+    parser.add_argument('--scrub_cache_mb', type=int, default=256,
+                        help=('Memory cap in MB for decoded frames kept around the playhead while paused.'))
+    parser.add_argument('--filmstrip', action='store_true',
+                        help=('Show video thumbnails behind the annotation marks.'))
+    parser.add_argument('--candidates', action='store_true',
+                        help=('Find scene changes and motion onsets/stops in the background, draw their scores under '
+                              'the marks, and jump to them with D/A or annotate at the nearest one with Shift+Return.'))
+    parser.add_argument('--snapshot_format', choices=SNAPSHOT_FORMATS, default="png",
+                        help=('Image format of the frames saved with --save_frames.'))
+    parser.add_argument('--snapshot_quality', type=int, default=None,
+                        help=('PNG compression level (0-9) or JPEG quality (0-100) of saved frames.'))
 
     args = parser.parse_args()
-    
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+        sync = parse_address(args.sync) if args.sync else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.profile or args.trace:
+        metrics.enable(args.trace)
+
     app = QtWidgets.QApplication(sys.argv)
-    player = Player(args.muted, args.save_frames)
+    player = Player(args.muted, args.save_frames, args.recursive, args.storage, args.scrub_cache_mb,
+                    args.filmstrip, args.snapshot_format, args.snapshot_quality, args.videos_dir,
+                    args.annotations_dir, args.resume, args.leases, shard, sync, args.candidates)
     player.show()
     player.resize(640, 480)
     sys.exit(app.exec_())
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+import vlc
+
+
+PARSE_FLAGS = vlc.MediaParseFlag.local.value | vlc.MediaParseFlag.network.value
+
+
+def is_parsed(media):
+    return media.get_parsed_status() == vlc.MediaParsedStatus.done
+
+
+class MediaPrefetcher:
+    """A small pool of vlc.Media objects for the videos around the current one.
+
+    prefetch() creates the media of the next `ahead` and previous `behind`
+    paths and starts libvlc's asynchronous parse on them, so switching to one
+    of them with take() needs no blocking parse. Media that leave the window
+    are released.
+    """
+
+    def __init__(self, instance, ahead=2, behind=1, timeout=-1):
+        self.instance = instance
+        self.ahead = ahead
+        self.behind = behind
+        self.timeout = timeout
+        self._pool = OrderedDict()
+
+    def __len__(self):
+        return len(self._pool)
+
+    def create(self, path):
+        """Create a media for path and start parsing it in the background"""
+        media = self.instance.media_new(path)
+        media.parse_with_options(PARSE_FLAGS, self.timeout)
+        return media
+
+    def take(self, path):
+        """Hand the media of path over to the caller, which becomes responsible for releasing it"""
+        media = self._pool.pop(path, None)
+        if media is None:
+            media = self.create(path)
+        return media
+
+    def prefetch(self, paths, current):
+        """Keep the media of paths[current - behind:current + ahead + 1] (without current) in the pool"""
+        window = []
+        for offset in range(1, self.ahead + 1):
+            if current + offset < len(paths):
+                window.append(paths[current + offset])
+        for offset in range(1, self.behind + 1):
+            if current - offset >= 0:
+                window.append(paths[current - offset])
+
+        keep = set(window)
+        for path in [p for p in self._pool if p not in keep]:
+            self.release(self._pool.pop(path))
+
+        for path in window:
+            if path not in self._pool:
+                self._pool[path] = self.create(path)
+
+    def release(self, media):
+        if not is_parsed(media):
+            media.parse_stop()
+        media.release()
+
+    def release_all(self):
+        while self._pool:
+            self.release(self._pool.popitem()[1])
@@ -0,0 +1,89 @@
+import threading
+
+import vlc
+from PyQt5 import QtCore
+
+
+class PlaybackState:
+    IDLE = "idle"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    STOPPED = "stopped"
+    ENDED = "ended"
+
+
+VLC_EVENT_STATES = {
+    vlc.EventType.MediaPlayerPlaying.value: PlaybackState.PLAYING,
+    vlc.EventType.MediaPlayerPaused.value: PlaybackState.PAUSED,
+    vlc.EventType.MediaPlayerStopped.value: PlaybackState.STOPPED,
+    vlc.EventType.MediaPlayerEndReached.value: PlaybackState.ENDED,
+}
+
+
+class PlaybackStateMachine(QtCore.QObject):
+    """Tracks the playback state of a vlc.MediaPlayer from its event manager.
+
+    libvlc calls back on its own threads; every event is forwarded to the
+    thread of this object through a queued signal, so the public signals are
+    always emitted on the Qt thread. Position updates are coalesced: while one
+    is waiting in the queue, newer positions only replace its value.
+    """
+
+    stateChanged = QtCore.pyqtSignal(str)
+    positionChanged = QtCore.pyqtSignal(float)
+    endReached = QtCore.pyqtSignal()
+
+    _stateEvent = QtCore.pyqtSignal(str)
+    _positionEvent = QtCore.pyqtSignal()
+
+    def __init__(self, mediaplayer, parent=None):
+        super().__init__(parent)
+        self.mediaplayer = mediaplayer
+        self.state = PlaybackState.IDLE
+
+        self._position_lock = threading.Lock()
+        self._position = 0.0
+        self._position_pending = False
+
+        self._stateEvent.connect(self._onStateEvent, QtCore.Qt.QueuedConnection)
+        self._positionEvent.connect(self._onPositionEvent, QtCore.Qt.QueuedConnection)
+
+        self.event_manager = mediaplayer.event_manager()
+        for event_type in (vlc.EventType.MediaPlayerPlaying, vlc.EventType.MediaPlayerPaused,
+                           vlc.EventType.MediaPlayerStopped, vlc.EventType.MediaPlayerEndReached):
+            self.event_manager.event_attach(event_type, self._vlcStateCallback)
+        self.event_manager.event_attach(vlc.EventType.MediaPlayerPositionChanged, self._vlcPositionCallback)
+
+    def isPlaying(self):
+        return self.state == PlaybackState.PLAYING
+
+    def _vlcStateCallback(self, event):
+        # libvlc thread
+        self._stateEvent.emit(VLC_EVENT_STATES[event.type.value])
+
+    def _vlcPositionCallback(self, event):
+        # libvlc thread
+        with self._position_lock:
+            self._position = event.u.new_position
+            if self._position_pending:
+                return
+            self._position_pending = True
+        self._positionEvent.emit()
+
+    def _onStateEvent(self, state):
+        self.state = state
+        self.stateChanged.emit(state)
+        if state == PlaybackState.ENDED:
+            self.endReached.emit()
+
+    def _onPositionEvent(self):
+        with self._position_lock:
+            position = self._position
+            self._position_pending = False
+        self.positionChanged.emit(position)
+
+    def detach(self):
+        for event_type in (vlc.EventType.MediaPlayerPlaying, vlc.EventType.MediaPlayerPaused,
+                           vlc.EventType.MediaPlayerStopped, vlc.EventType.MediaPlayerEndReached,
+                           vlc.EventType.MediaPlayerPositionChanged):
+            self.event_manager.event_detach(event_type)
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+
+from annotation_store import atomic_write_json
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pia_video_annotation_tool")
+SESSION_FILE_NAME = "session.json"
+
+
+def load_session(cache_dir=DEFAULT_CACHE_DIR):
+    """The session saved by the last run: directories, current video and annotation cursor. {} if there is none."""
+    try:
+        with open(os.path.join(cache_dir, SESSION_FILE_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_session(session, cache_dir=DEFAULT_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    atomic_write_json(os.path.join(cache_dir, SESSION_FILE_NAME), session)
+
+
+def scan_cache_path(videos_dir, recursive, cache_dir=DEFAULT_CACHE_DIR, shard=None):
+    key = hashlib.sha1(f"{os.path.abspath(videos_dir)}|{bool(recursive)}|{shard}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "scans", key + ".json")
+
+
+def load_cached_scan(videos_dir, recursive, cache_dir=DEFAULT_CACHE_DIR, shard=None):
+    """The sorted video paths of the last scan of videos_dir, or None if a scanned directory changed since.
+
+    Adding, removing or renaming an entry changes the mtime of its
+    directory, so the scan is still valid if every directory it entered has
+    the mtime it had then. Only those directories are stat'ed, nothing is
+    listed.
+    """
+    try:
+        with open(scan_cache_path(videos_dir, recursive, cache_dir, shard), "r") as f:
+            scan = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    for directory, mtime in scan["directories"].items():
+        try:
+            if os.stat(directory).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    return scan["paths"]
+
+
+def save_cached_scan(videos_dir, recursive, paths, directories, cache_dir=DEFAULT_CACHE_DIR, shard=None):
+    """Remember the result of a full scan, directories maps every scanned directory to its mtime before listing.
+
+    Scans limited to a shard (see leases.in_shard) are cached separately.
+    """
+    path = scan_cache_path(videos_dir, recursive, cache_dir, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write_json(path, {"videos_dir": videos_dir, "recursive": bool(recursive),
+                             "directories": directories, "paths": paths})
@@ -0,0 +1,280 @@
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+# Encoders used for the re-encoded edges, they have to produce the codec of
+# the stream-copied middle part so the segments can be concatenated
+ENCODERS = {
+    "h264": ("libx264", ["-crf", "18", "-preset", "veryfast"]),
+    "hevc": ("libx265", ["-crf", "20", "-preset", "veryfast"]),
+    "mpeg4": ("mpeg4", ["-q:v", "2"]),
+}
+
+# ffprobe profile names -> encoder profiles. Streams whose profile is not
+# listed can't be matched and are re-encoded as a whole.
+PROFILES = {
+    "h264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high",
+             "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"},
+    "hevc": {"Main": "main", "Main 10": "main10", "Main Still Picture": "mainstillpicture"},
+    "mpeg4": None,
+}
+
+# ffprobe reports levels as integers: level_idc for h264 (41 = 4.1), general_level_idc for hevc (123 = 4.1)
+LEVEL_SCALE = {"h264": 10.0, "hevc": 30.0}
+
+COLOR_OPTIONS = (("color_range", "-color_range"), ("color_space", "-colorspace"),
+                 ("color_primaries", "-color_primaries"), ("color_transfer", "-color_trc"))
+
+# Audio codecs an MP4 clip can take as they are. Every audio packet decodes on
+# its own, so a copy is off by less than one audio frame (about 21 ms for AAC).
+COPY_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "alac", "opus", "flac"}
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def run(command):
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(command[0])} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+class StreamInfo:
+    """What smart cutting needs to know about the video stream of a file"""
+
+    def __init__(self, video_path):
+        output = run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                      "-show_entries", "stream=codec_name,profile,level,pix_fmt,time_base,"
+                                       + ",".join(name for name, _ in COLOR_OPTIONS) + ":format=start_time",
+                      "-of", "default=noprint_wrappers=1", video_path])
+        values = dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+        self.codec_name = values.get("codec_name")
+        self.profile = values.get("profile")
+        self.level = values.get("level")
+        self.pix_fmt = values.get("pix_fmt")
+        self.time_base = values.get("time_base")
+        self.colors = {name: values[name] for name, _ in COLOR_OPTIONS
+                       if values.get(name) not in (None, "unknown", "N/A")}
+        start_time = values.get("start_time", "N/A")
+        self.start_time = float(start_time) if start_time != "N/A" else 0.0
+
+        output = run(["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name",
+                      "-of", "csv=p=0", video_path])
+        self.audio_codec = output.strip() or None
+
+        # Keyframe presentation and decode times in seconds, read from the packets without decoding
+        output = run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                      "-show_entries", "packet=pts_time,dts_time,flags", "-of", "csv=p=0", video_path])
+        self.keyframe_times = []
+        self.keyframe_dts_times = []
+        for line in output.splitlines():
+            fields = line.strip().split(",")
+            if len(fields) >= 3 and fields[0] != "N/A" and fields[2].startswith("K"):
+                self.keyframe_times.append(float(fields[0]))
+                self.keyframe_dts_times.append(float(fields[1]) if fields[1] != "N/A" else float(fields[0]))
+
+    def can_smart_cut(self):
+        return self.codec_name in ENCODERS and self.encoder_options() is not None
+
+    def encoder_options(self):
+        """Options that make the re-encoded edges match this stream, None if they can't be matched.
+
+        Profile, level, pixel format and colour description of the edges
+        have to be those of the copied GOPs, otherwise decoders may break at
+        the joins.
+        """
+        options = ["-pix_fmt", self.pix_fmt]
+        for name, option in COLOR_OPTIONS:
+            if name in self.colors:
+                options += [option, self.colors[name]]
+
+        profiles = PROFILES[self.codec_name]
+        if profiles is None:
+            return options
+        profile = profiles.get(self.profile)
+        if profile is None:
+            return None
+        options += ["-profile:v", profile]
+
+        try:
+            level = int(self.level) / LEVEL_SCALE[self.codec_name]
+        except (TypeError, ValueError):
+            return None
+        if level <= 0:
+            return None
+        if self.codec_name == "h264":
+            options += ["-level:v", f"{level:.1f}"]
+        else:
+            options += ["-x265-params", f"level-idc={level:.1f}"]
+        return options
+
+    def audio_options(self):
+        """Copy the audio when MP4 can hold its codec, otherwise re-encode it to AAC"""
+        return ["-c:a", "copy" if self.audio_codec in COPY_AUDIO_CODECS else "aac"]
+
+    def timescale_options(self):
+        """Keep the time scale of the source track, so the frame timestamps stay exact"""
+        try:
+            return ["-video_track_timescale", str(int(self.time_base.split("/")[1]))]
+        except (AttributeError, IndexError, ValueError):
+            return []
+
+
+def plan_segments(start_frame, end_frame, keyframes, frame_count):
+    """Split the clip [start_frame, end_frame] into ("copy" | "encode", first, last) segments.
+
+    Whole GOPs inside the clip are stream-copied, only the partial GOPs at
+    the edges are re-encoded. keyframes are the sorted frame numbers of the
+    keyframes.
+    """
+    i = bisect.bisect_left(keyframes, start_frame)
+    if i == len(keyframes) or keyframes[i] > end_frame:
+        return [("encode", start_frame, end_frame)]
+    first_key = keyframes[i]
+
+    # The copied part ends where the last GOP starting inside the clip would run past it
+    if end_frame + 1 >= frame_count:
+        last_key = frame_count
+    else:
+        last_key = keyframes[bisect.bisect_right(keyframes, end_frame + 1) - 1]
+
+    if last_key <= first_key:
+        return [("encode", start_frame, end_frame)]
+
+    segments = []
+    if start_frame < first_key:
+        segments.append(("encode", start_frame, first_key - 1))
+    segments.append(("copy", first_key, last_key - 1))
+    if last_key <= end_frame:
+        segments.append(("encode", last_key, end_frame))
+    return segments
+
+
+def packet_count(path):
+    """Number of video packets of path, counted by ffprobe from the container without decoding"""
+    output = run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                  "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", path])
+    try:
+        return int(output.strip().rstrip(","))
+    except ValueError:
+        return 0
+
+
+def decoded_frames(path):
+    """(number of video frames that decode, ffmpeg error output) of path"""
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-f", "framemd5", "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    frames = sum(1 for line in result.stdout.splitlines() if line and not line.startswith("#"))
+    errors = result.stderr.strip()
+    if result.returncode != 0 and not errors:
+        errors = f"ffmpeg exited with {result.returncode}"
+    return frames, errors
+
+
+def count_frames(path, verify=False):
+    """(frames, errors) of path: its packets, or with verify what a full decode yields"""
+    if verify:
+        return decoded_frames(path)
+    return packet_count(path), ""
+
+
+def reencode_clip(video_path, start_frame, end_frame, output_path, frame_index, info):
+    """Re-encode every frame of [start_frame, end_frame], the fallback when a smart cut does not decode cleanly"""
+    encoder, encoder_options = ENCODERS[info.codec_name]
+    command = ["ffmpeg", "-v", "error", "-y",
+               "-ss", f"{frame_index.time_of(start_frame) / 1000.0:.6f}", "-i", video_path,
+               "-map", "0:v:0", "-map", "0:a?", "-frames:v", str(end_frame - start_frame + 1),
+               "-c:v", encoder, "-pix_fmt", info.pix_fmt] + encoder_options
+    if end_frame + 1 < len(frame_index):
+        command += ["-t", f"{(frame_index.time_of(end_frame + 1) - frame_index.time_of(start_frame)) / 1000.0:.6f}"]
+    run(command + ["-c:a", "aac"] + info.timescale_options() + [output_path])
+
+
+def smart_cut(video_path, start_frame, end_frame, output_path, frame_index, info, verify=False):
+    """Write frames [start_frame, end_frame] of video_path to output_path with as little re-encoding as possible.
+
+    Frame numbers are mapped to times with frame_index, so the cut is frame
+    exact. Copied GOPs are bounded by time, not by a frame count, because
+    with B-frames packets are stored out of presentation order. Edges are
+    re-encoded with the profile, level and pixel format of the stream and
+    every segment goes through MPEG-TS, so each one carries its parameter
+    sets in-band. If ffmpeg fails or the result does not hold exactly
+    end_frame - start_frame + 1 video packets, the clip is re-encoded as a
+    whole; with verify the result is decoded instead, which also catches
+    frames that don't decode, at the cost of a full decode per clip. Audio
+    of the interval is copied when the codec allows it. Returns the number
+    of video frames written.
+    """
+    frame_count = len(frame_index)
+    end_frame = min(end_frame, frame_count - 1)
+    expected = end_frame - start_frame + 1
+    # Packet times are absolute, the frame index and -ss count from the start of the file
+    keyframe_dts = {frame_index.frame_at((t - info.start_time) * 1000): dts - info.start_time
+                    for t, dts in zip(info.keyframe_times, info.keyframe_dts_times)}
+    segments = plan_segments(start_frame, end_frame, sorted(keyframe_dts), frame_count)
+
+    def seek_time(frame):
+        return f"{frame_index.time_of(frame) / 1000.0:.6f}"
+
+    def duration_options(first, last):
+        """-t covering the presentation times of frames first..last, nothing if last is the last frame"""
+        if last + 1 >= frame_count:
+            return []
+        return ["-t", f"{(frame_index.time_of(last + 1) - frame_index.time_of(first)) / 1000.0:.6f}"]
+
+    def copy_duration_options(first, last):
+        """-t ending a stream copy of first..last right before the keyframe last + 1.
+
+        A stream copy stops at the first packet whose decode timestamp
+        reaches -ss + -t. With B-frames the keyframe after the copied GOPs
+        is decoded before the last frames shown, so the bound is its decode
+        time, not its presentation time.
+        """
+        if last + 1 >= frame_count:
+            return []
+        return ["-t", f"{keyframe_dts[last + 1] - frame_index.time_of(first) / 1000.0:.6f}"]
+
+    encoder, encoder_options = ENCODERS[info.codec_name]
+    tmp_dir = tempfile.mkdtemp(prefix=".smartcut_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        segment_paths = []
+        for number, (kind, first, last) in enumerate(segments):
+            segment_path = os.path.join(tmp_dir, f"{number}.ts")
+            command = ["ffmpeg", "-v", "error", "-y", "-ss", seek_time(first), "-i", video_path,
+                       "-map", "0:v:0", "-an"]
+            if kind == "copy":
+                command += ["-c", "copy"] + copy_duration_options(first, last)
+            else:
+                # Decoded frames come out in presentation order, so a frame count is exact here
+                command += ["-frames:v", str(last - first + 1), "-c:v", encoder] \
+                    + info.encoder_options() + encoder_options
+            run(command + ["-f", "mpegts", segment_path])
+            segment_paths.append(segment_path)
+
+        list_path = os.path.join(tmp_dir, "segments.txt")
+        with open(list_path, "w") as f:
+            for segment_path in segment_paths:
+                f.write(f"file '{segment_path}'\n")
+
+        # Audio of the interval comes from the source, -ss and -t apply to its input
+        command = ["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                   "-ss", seek_time(start_frame)] + duration_options(start_frame, end_frame)
+        command += ["-i", video_path, "-map", "0:v", "-map", "1:a?", "-c:v", "copy"] + info.audio_options()
+        run(command + info.timescale_options() + [output_path])
+        frames, errors = count_frames(output_path, verify)
+    except RuntimeError as e:
+        frames, errors = 0, str(e)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if frames != expected or errors:
+        print(f"Smart cut of frames {start_frame}-{end_frame} of {video_path} decoded to {frames} frames"
+              f"{', with errors' if errors else ''}, re-encoding the clip")
+        reencode_clip(video_path, start_frame, end_frame, output_path, frame_index, info)
+        frames, errors = count_frames(output_path, verify)
+    return frames
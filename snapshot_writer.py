@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+SNAPSHOT_FORMATS = ("png", "jpg")
+
+# Frames read forward instead of seeking when the next snapshot is a little ahead
+MAX_READ_AHEAD = 30
+
+
+class SnapshotWriter(threading.Thread):
+    """Saves annotated frames without stalling the GUI thread.
+
+    submit() only queues the video path and frame number. A decoder thread
+    opens the video with OpenCV, seeks to the frame (through the frame index
+    when there is one) and hands the full resolution frame to a small thread
+    pool that encodes and writes it. At most max_pending decoded frames wait
+    for the encoders, beyond that the decoder waits, so memory stays bounded
+    while queue_depth() shows how far behind the pipeline is.
+    """
+
+    def __init__(self, image_format="png", quality=None, workers=2, max_pending=8, frame_indexes=None):
+        super().__init__(name="SnapshotWriter", daemon=True)
+        import cv2
+
+        self.extension = "." + image_format
+        if image_format == "png":
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, 3 if quality is None else quality]
+        else:
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, 95 if quality is None else quality]
+        self.frame_indexes = frame_indexes
+
+        self._requests = queue.Queue()
+        self._encoders = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SnapshotEncoder")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._dirs = set()
+
+        self.written = 0
+        self.errors = 0
+        self.last_latency_ms = 0.0
+
+        self.start()
+
+    def submit(self, video_path, frame, output_path):
+        """Save frame of video_path to output_path + the format extension, returns at once"""
+        with self._lock:
+            self._pending += 1
+        self._requests.put((video_path, frame, output_path + self.extension, time.monotonic()))
+
+    def queue_depth(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            return {"queue_depth": self._pending, "written": self.written, "errors": self.errors,
+                    "last_latency_ms": self.last_latency_ms}
+
+    def close(self):
+        """Write what is queued and stop"""
+        self._requests.put(None)
+        self.join()
+        self._encoders.shutdown(wait=True)
+
+    def _seek(self, video, video_path, frame):
+        import cv2
+
+        index = self.frame_indexes.get(video_path) if self.frame_indexes is not None else None
+        if index is not None:
+            video.set(cv2.CAP_PROP_POS_MSEC, index.time_of(frame))
+        else:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame)
+
+    def _failed(self, output_path, error):
+        print(f"Could not save snapshot {output_path}: {error}")
+        with self._lock:
+            self._pending -= 1
+            self.errors += 1
+
+    def run(self):
+        import cv2
+
+        video = None
+        video_path = None
+        position = None
+        try:
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    return
+                path, frame, output_path, submitted = request
+
+                # Keep the last video open, annotations of one video come in a row
+                if path != video_path:
+                    if video is not None:
+                        video.release()
+                    video = cv2.VideoCapture(path)
+                    video_path = path
+                    position = None
+                if not video.isOpened():
+                    self._failed(output_path, f"could not open {path}")
+                    continue
+
+                if position is None or not 0 <= frame - position <= MAX_READ_AHEAD:
+                    self._seek(video, path, frame)
+                    position = frame
+                while position < frame and video.grab():
+                    position += 1
+                ok, image = video.read()
+                position = position + 1 if ok else None
+                if not ok:
+                    self._failed(output_path, f"could not decode frame {frame}")
+                    continue
+
+                self._slots.acquire()
+                self._encoders.submit(self._write, image, output_path, submitted)
+        finally:
+            if video is not None:
+                video.release()
+
+    def _write(self, image, output_path, submitted):
+        import cv2
+
+        try:
+            directory = os.path.dirname(output_path)
+            if directory not in self._dirs:
+                os.makedirs(directory, exist_ok=True)
+                self._dirs.add(directory)
+
+            ok, data = cv2.imencode(self.extension, image, self.params)
+            if not ok:
+                raise ValueError("encoding failed")
+            with open(output_path, "wb") as f:
+                f.write(data.tobytes())
+        except Exception as e:
+            self._failed(output_path, e)
+            return
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self._pending -= 1
+            self.written += 1
+            self.last_latency_ms = (time.monotonic() - submitted) * 1000.0
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from annotation_store import atomic_write_json
+from session import DEFAULT_CACHE_DIR
+
+
+def parse_address(text):
+    """(host, port) of a "host:port" argument"""
+    host, _, port = text.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"Sync address must look like host:port, not {text!r}")
+    if not host or not 0 < port < 65536:
+        raise ValueError(f"Sync address must look like host:port, not {text!r}")
+    return host, port
+
+
+def spool_dir(host, port, cache_dir=DEFAULT_CACHE_DIR):
+    key = hashlib.sha1(f"{host}:{port}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "sync", key)
+
+
+class SyncClient:
+    """Pushes annotation edits to a sync server (see sync_server.py) from a background asyncio loop.
+
+    push() only appends the record to an in-memory queue under a lock and,
+    when a full batch is waiting, wakes the loop, so the GUI thread never
+    waits on the network or the disk. The loop thread appends queued records
+    to a spool file, sends them in batches of newline-delimited JSON and
+    drops them once the server acknowledged their sequence number. While the
+    server is unreachable records pile up in the spool and the loop
+    reconnects with exponential backoff; the spool is replayed on the next
+    start, so edits made offline or before a crash are sent later. Records
+    carry a sequence number per client, which lets the server skip the ones
+    it already stored when a batch is resent.
+    """
+
+    def __init__(self, host, port, batch_size=256, flush_interval=0.5, cache_dir=DEFAULT_CACHE_DIR,
+                 max_backoff=30.0):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+
+        self.spool_dir = spool_dir(host, port, cache_dir)
+        self.spool_path = os.path.join(self.spool_dir, "spool.jsonl")
+        self.state_path = os.path.join(self.spool_dir, "state.json")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        # The client id and sequence numbers survive restarts, so a replayed spool is deduplicated by the server
+        state = self._read_state()
+        self.client_id = state.get("client") or uuid.uuid4().hex
+        self.acked = state.get("acked", 0)
+        self._unacked = deque(record for record in self._read_spool() if record["seq"] > self.acked)
+        self._seq = self._unacked[-1]["seq"] if self._unacked else self.acked
+
+        self._lock = threading.Lock()
+        self._queue = []
+        self.connected = False
+        self.sent = 0
+        self.last_error = None
+
+        self._loop = asyncio.new_event_loop()
+        # Created by _sync(), an Event made on this thread would bind to its loop on Python < 3.10
+        self._wake = None
+        self._stopping = False
+        self._task = self._loop.create_task(self._sync())
+        self._thread = threading.Thread(target=self._run_loop, name="SyncClient", daemon=True)
+        self._thread.start()
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_spool(self):
+        records = []
+        try:
+            with open(self.spool_path, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A crash can leave a torn last line behind
+                        continue
+        except OSError:
+            pass
+        return records
+
+    def push(self, record):
+        """Queue an edit record (the journal layout of annotation_backend) for the server, returns at once"""
+        with self._lock:
+            self._seq += 1
+            self._queue.append(dict(record, seq=self._seq, ts=time.time()))
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def pending(self):
+        """Records not acknowledged by the server yet"""
+        with self._lock:
+            return len(self._queue) + len(self._unacked)
+
+    def stats(self):
+        return {"connected": self.connected, "pending": self.pending(), "sent": self.sent,
+                "acked": self.acked, "last_error": self.last_error}
+
+    def close(self, timeout=2.0):
+        """Try to send what is queued for up to timeout seconds, the rest stays in the spool for the next start"""
+        self._loop.call_soon_threadsafe(self._begin_stop)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join()
+        self._spool_queued()
+
+    def _begin_stop(self):
+        self._stopping = True
+        self._notify()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def _spool_queued(self):
+        """Move queued records to the spool file and the unacknowledged list"""
+        with self._lock:
+            records = self._queue
+            self._queue = []
+        if not records:
+            return
+        try:
+            with open(self.spool_path, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+        except OSError as e:
+            self.last_error = f"spool: {e}"
+        with self._lock:
+            self._unacked.extend(records)
+
+    def _acknowledge(self, acked):
+        with self._lock:
+            while self._unacked and self._unacked[0]["seq"] <= acked:
+                self._unacked.popleft()
+                self.sent += 1
+            empty = not self._unacked and not self._queue
+        self.acked = max(self.acked, acked)
+        atomic_write_json(self.state_path, {"client": self.client_id, "acked": self.acked})
+        if empty:
+            # Everything is on the server, start the spool over
+            open(self.spool_path, "w").close()
+
+    async def _wait(self, timeout):
+        """Sleep until timeout or a wake up by push() or close()"""
+        timer = self._loop.call_later(timeout, self._wake.set)
+        await self._wake.wait()
+        timer.cancel()
+        self._wake.clear()
+
+    async def _sync(self):
+        self._wake = asyncio.Event()
+        backoff = 0.5
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                self.last_error = str(e)
+                self._spool_queued()
+                if self._stopping:
+                    # Offline, the spool is sent on the next start
+                    return
+                await self._wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            self.connected = True
+            backoff = 0.5
+            try:
+                await self._send_loop(reader, writer)
+                return
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                self.last_error = str(e)
+                if self._stopping:
+                    return
+                await self._wait(backoff)
+            finally:
+                self.connected = False
+                writer.close()
+
+    async def _send_loop(self, reader, writer):
+        """Send batches until everything is acknowledged after close() was called"""
+        while True:
+            self._spool_queued()
+            with self._lock:
+                batch = [self._unacked[i] for i in range(min(self.batch_size, len(self._unacked)))]
+
+            if not batch:
+                if self._stopping:
+                    return
+                await self._wait(self.flush_interval)
+                continue
+
+            message = {"client": self.client_id, "events": batch}
+            writer.write(json.dumps(message).encode("utf-8") + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError("sync server closed the connection")
+            reply = json.loads(line)
+            if "error" in reply:
+                raise ValueError(f"sync server: {reply['error']}")
+            self._acknowledge(reply["ack"])
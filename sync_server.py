@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Lines are whole batches, allow for a few hundred full documents
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+
+class SyncDatabase:
+    """The aggregated annotations, in the videos/marks layout of annotation_backend.SQLiteStore.
+
+    Every received record is also kept in the events table with the client
+    that sent it, and clients holds the highest sequence number stored per
+    client, so resent records are skipped.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS videos (name TEXT PRIMARY KEY, path TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS marks ("
+                        "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "name TEXT NOT NULL, field TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+                        "UNIQUE (name, field, key))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS events ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "client TEXT NOT NULL, seq INTEGER NOT NULL, ts REAL, op TEXT NOT NULL, name TEXT NOT NULL, "
+                        "record TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS clients (client TEXT PRIMARY KEY, acked INTEGER NOT NULL)")
+        self.acked = dict(self.db.execute("SELECT client, acked FROM clients"))
+
+    def apply(self, record):
+        op = record["op"]
+        name = record["name"]
+        if op == "put":
+            doc = record["doc"]
+            self.db.execute("INSERT OR REPLACE INTO videos (name, path) VALUES (?, ?)", (name, doc["path"]))
+            self.db.execute("DELETE FROM marks WHERE name = ?", (name,))
+            for field in ("annotations", "annotations_frame"):
+                self.db.executemany(
+                    "INSERT INTO marks (name, field, key, value) VALUES (?, ?, ?, ?)",
+                    [(name, field, key, json.dumps(value)) for key, value in doc.get(field, {}).items()])
+        elif op == "annotate":
+            self.db.execute("INSERT OR IGNORE INTO videos (name, path) VALUES (?, ?)", (name, record.get("path", "")))
+            for field, value in (("annotations", record["position"]), ("annotations_frame", record["frame"])):
+                if value is not None:
+                    self.db.execute("INSERT OR REPLACE INTO marks (name, field, key, value) VALUES (?, ?, ?, ?)",
+                                    (name, field, record["key"], json.dumps(value)))
+        elif op == "remove":
+            self.db.execute("DELETE FROM marks WHERE name = ? AND field = 'annotations' AND key = ?",
+                            (name, record["key"]))
+            self.db.execute("DELETE FROM marks WHERE name = ? AND field = 'annotations_frame' AND key = ?",
+                            (name, record["frame_key"]))
+        else:
+            raise ValueError(f"Unknown operation {op}")
+
+    def store(self, batches):
+        """Apply [(client, records)] in one transaction, returns the acknowledged sequence number of each batch"""
+        acked = dict(self.acked)
+        with self.db:
+            self.db.execute("BEGIN")
+            for client, records in batches:
+                last = acked.get(client, 0)
+                new = [record for record in records if record["seq"] > last]
+                for record in new:
+                    self.apply(record)
+                self.db.executemany(
+                    "INSERT INTO events (client, seq, ts, op, name, record) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(client, record["seq"], record.get("ts"), record["op"], record["name"], json.dumps(record))
+                     for record in new])
+                if new:
+                    acked[client] = max(last, new[-1]["seq"])
+            self.db.executemany("INSERT OR REPLACE INTO clients (client, acked) VALUES (?, ?)",
+                                [(client, seq) for client, seq in acked.items() if seq != self.acked.get(client)])
+        self.acked = acked
+        return [acked.get(client, 0) for client, _ in batches]
+
+    def close(self):
+        self.db.close()
+
+
+class SyncServer:
+    """Reference server for sync_client.SyncClient, newline-delimited JSON over TCP.
+
+    Connections only parse lines and queue them; a single writer task takes
+    every batch waiting at that moment and commits them together in a worker
+    thread (group commit), then acknowledges each one. Under load a commit
+    covers the batches of all clients that arrived during the previous one,
+    so throughput grows with the number of clients instead of being bound by
+    one commit per batch.
+    """
+
+    def __init__(self, db_path):
+        self.database = SyncDatabase(db_path)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SyncDatabase")
+        self.batches = None
+        self.stored = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    return
+                if not line:
+                    return
+                try:
+                    message = json.loads(line)
+                    client = str(message["client"])
+                    records = message["events"]
+                except (ValueError, KeyError, TypeError) as e:
+                    writer.write(json.dumps({"error": f"bad batch: {e}"}).encode("utf-8") + b"\n")
+                    await writer.drain()
+                    return
+
+                done = asyncio.get_running_loop().create_future()
+                await self.batches.put((client, records, done))
+                try:
+                    reply = {"ack": await done}
+                except Exception as e:
+                    reply = {"error": str(e)}
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def write_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            waiting = [await self.batches.get()]
+            while not self.batches.empty():
+                waiting.append(self.batches.get_nowait())
+            batches = [(client, records) for client, records, _ in waiting]
+            try:
+                acked = await loop.run_in_executor(self.executor, self.database.store, batches)
+            except Exception:
+                # A bad record fails the whole commit, store the batches one by one to fail only its own
+                for client, records, done in waiting:
+                    try:
+                        done.set_result((await loop.run_in_executor(
+                            self.executor, self.database.store, [(client, records)]))[0])
+                    except Exception as e:
+                        done.set_exception(e)
+                continue
+            for (_, records, done), seq in zip(waiting, acked):
+                self.stored += len(records)
+                done.set_result(seq)
+
+    async def serve(self, host, port, ready=None):
+        """Serve until cancelled, ready (a threading.Event) is set once the port is listening"""
+        self.batches = asyncio.Queue()
+        writer_task = asyncio.create_task(self.write_batches())
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_BYTES)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"Sync server listening on {host}:{self.port}")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Collect the annotation edits pushed by players started with --sync into a SQLite database.')
+    parser.add_argument('--host', default="127.0.0.1",
+                        help=('Address to listen on.'))
+    parser.add_argument('--port', type=int, default=8765,
+                        help=('Port to listen on.'))
+    parser.add_argument('--db', default="annotations_sync.sqlite3",
+                        help=('SQLite database the edits are stored in.'))
+
+    args = parser.parse_args()
+    server = SyncServer(args.db)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"Stored {server.stored} events")
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from annotation_backend import JOURNAL_FILE_NAME, SQLITE_FILE_NAME, open_annotation_store, replay_journal
+
+
+def new_doc(name):
+    return {"name": name, "path": f"/videos/{name}", "annotations": {}, "annotations_frame": {}}
+
+
+def annotate(store, doc, key, position, frame):
+    doc["annotations"][key] = position
+    doc["annotations_frame"][key] = [frame]
+    store.record_annotate(doc, key)
+
+
+def crash(store):
+    """Drop the store without close(), as a killed process would"""
+    if hasattr(store, "journal"):
+        store.journal.close()
+    else:
+        store.db.close()
+
+
+def test_journal_replays_edits_after_a_crash(tmp_path):
+    store = open_annotation_store("journal", str(tmp_path))
+    doc = new_doc("a")
+    store["a"] = doc
+    annotate(store, doc, "S1", 0.1, 10)
+    annotate(store, doc, "E1", 0.2, 20)
+    annotate(store, doc, "S2", 0.3, 30)
+    doc["annotations"].pop("S2")
+    doc["annotations_frame"].pop("S2")
+    store.record_remove(doc, "S2", "S2")
+    crash(store)
+
+    docs = replay_journal(str(tmp_path / JOURNAL_FILE_NAME))
+    assert docs["a"]["annotations_frame"] == {"S1": [10], "E1": [20]}
+
+    store = open_annotation_store("journal", str(tmp_path))
+    assert store.get("a")["annotations"] == {"S1": 0.1, "E1": 0.2}
+    # Nothing reached the JSON file before the crash, close() exports it and empties the journal
+    store.close()
+    assert json.loads((tmp_path / "a.json").read_text())["annotations_frame"] == {"S1": [10], "E1": [20]}
+    assert os.path.getsize(tmp_path / JOURNAL_FILE_NAME) == 0
+
+
+def test_journal_skips_a_torn_last_line(tmp_path):
+    path = tmp_path / JOURNAL_FILE_NAME
+    records = [{"op": "put", "name": "a", "doc": new_doc("a")},
+               {"op": "annotate", "name": "a", "key": "S1", "position": 0.5, "frame": [5]}]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records) + '{"op": "annot')
+    assert replay_journal(str(path))["a"]["annotations_frame"] == {"S1": [5]}
+
+
+def test_sqlite_keeps_edits_without_close(tmp_path):
+    store = open_annotation_store("sqlite", str(tmp_path))
+    doc = new_doc("a")
+    store["a"] = doc
+    annotate(store, doc, "S1", 0.1, 10)
+    annotate(store, doc, "S1", 0.15, 15)
+    crash(store)
+    store.json_store.close()
+
+    store = open_annotation_store("sqlite", str(tmp_path))
+    assert os.path.exists(tmp_path / SQLITE_FILE_NAME)
+    assert store.get("a")["annotations_frame"] == {"S1": [15]}
+    assert len(store) == 1
+    store.close()
+
+
+@pytest.mark.parametrize("kind", ["json", "journal", "sqlite"])
+def test_every_backend_counts_videos_in_the_json_files_and_the_backend(tmp_path, kind):
+    store = open_annotation_store(kind, str(tmp_path))
+    saved = new_doc("saved")
+    store["saved"] = saved
+    annotate(store, saved, "S1", 0.1, 1)
+    store.save(saved)
+    store["unsaved"] = new_doc("unsaved")
+    assert len(store) == 2
+    store.close()
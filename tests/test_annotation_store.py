@@ -0,0 +1,69 @@
+import json
+import os
+
+from annotation_store import INDEX_FILE_NAME, AnnotationStore, atomic_write_json
+
+
+def write_doc(directory, name, frames):
+    atomic_write_json(os.path.join(directory, name + ".json"),
+                      {"name": name, "path": f"/videos/{name}", "annotations": {}, "annotations_frame": frames})
+
+
+def test_index_is_persisted_and_refreshed(tmp_path):
+    write_doc(str(tmp_path), "a", {"S1": [1]})
+    store = AnnotationStore(str(tmp_path))
+    assert "a" in store and len(store) == 1
+    assert os.path.exists(tmp_path / INDEX_FILE_NAME)
+
+    write_doc(str(tmp_path), "b", {})
+    os.remove(tmp_path / "a.json")
+    store = AnnotationStore(str(tmp_path))
+    assert "a" not in store and "b" in store
+
+
+def test_unsaved_documents_are_pinned(tmp_path):
+    store = AnnotationStore(str(tmp_path), cache_size=1)
+    doc = {"name": "new", "path": "/videos/new", "annotations": {}, "annotations_frame": {}}
+    store["new"] = doc
+    for name in "abc":
+        write_doc(str(tmp_path), name, {})
+    assert store.get("new") is doc
+    assert len(store) == 1
+
+    store.save(doc)
+    assert json.loads((tmp_path / "new.json").read_text())["name"] == "new"
+
+
+def test_corrupt_file_is_set_aside_not_overwritten(tmp_path):
+    write_doc(str(tmp_path), "a", {"S1": [1]})
+    store = AnnotationStore(str(tmp_path))
+    (tmp_path / "a.json").write_text("{not json")
+
+    assert store.get("a") is None
+    assert (tmp_path / "a.json.corrupt").read_text() == "{not json"
+
+    doc = {"name": "a", "path": "/videos/a", "annotations": {}, "annotations_frame": {}}
+    store["a"] = doc
+    store.save(doc)
+    assert (tmp_path / "a.json.corrupt").read_text() == "{not json"
+
+
+def test_corrupt_file_found_at_startup_is_set_aside(tmp_path):
+    (tmp_path / "b.json").write_text("[1, 2")
+    store = AnnotationStore(str(tmp_path))
+    assert "b" not in store
+    assert (tmp_path / "b.json.corrupt").exists()
+
+
+def test_reload_sees_files_written_by_someone_else(tmp_path):
+    store = AnnotationStore(str(tmp_path))
+    assert store.get("a") is None
+
+    write_doc(str(tmp_path), "a", {"S1": [4], "E1": [9]})
+    assert store.get("a") is None
+    store.reload("a")
+    assert store.get("a")["annotations_frame"] == {"S1": [4], "E1": [9]}
+
+    write_doc(str(tmp_path), "a", {})
+    store.reload("a")
+    assert store.get("a")["annotations_frame"] == {}
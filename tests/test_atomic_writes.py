@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+import annotation_store
+from annotation_store import atomic_write_json, atomic_write_text
+from annotation_writer import AnnotationWriter
+
+
+def test_atomic_write_replaces_the_file_and_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "a.json"
+    atomic_write_json(str(path), {"name": "a"})
+    atomic_write_json(str(path), {"name": "b"})
+    assert json.loads(path.read_text()) == {"name": "b"}
+    assert os.listdir(tmp_path) == ["a.json"]
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path, monkeypatch):
+    path = tmp_path / "a.json"
+    atomic_write_text(str(path), "old")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(annotation_store.os, "replace", fail)
+    with pytest.raises(OSError):
+        atomic_write_text(str(path), "new")
+    assert path.read_text() == "old"
+
+
+def test_writer_writes_the_last_submitted_document(tmp_path):
+    writer = AnnotationWriter()
+    path = str(tmp_path / "a.json")
+    doc = {"name": "a", "annotations_frame": {}}
+    for i in range(50):
+        doc["annotations_frame"][f"S{i}"] = [i]
+        writer.submit(path, doc)
+    writer.flush()
+
+    assert len(json.loads(open(path).read())["annotations_frame"]) == 50
+    stats = writer.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["written"] + stats["coalesced"] == 50
+    writer.close()
+
+
+def test_writer_snapshots_the_document_at_submit(tmp_path):
+    writer = AnnotationWriter()
+    path = str(tmp_path / "a.json")
+    doc = {"name": "a"}
+    writer.submit(path, doc)
+    doc["name"] = "changed after submit"
+    writer.close()
+    assert json.loads(open(path).read()) == {"name": "a"}
+
+
+def test_closed_writer_refuses_documents(tmp_path):
+    writer = AnnotationWriter()
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(str(tmp_path / "a.json"), {})
@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+from export_manifest import MANIFEST_FILE_NAME, ExportManifest, clip_is_current, file_signature, pair_hash
+
+
+@pytest.fixture
+def exported(tmp_path):
+    """An annotation file, its video and one exported clip recorded in the manifest"""
+    video = tmp_path / "v.avi"
+    video.write_bytes(b"video")
+    annotation = tmp_path / "v.json"
+    annotation.write_text(json.dumps({"name": "v.avi", "path": str(video)}))
+    export_path = tmp_path / "out"
+    export_path.mkdir()
+    (export_path / "v.avi_10_20.mp4").write_bytes(b"clip")
+
+    source = dict(file_signature(str(video)), path=str(video))
+    entry = {"json": "v.json", "json_signature": file_signature(str(annotation)), "mode": "reencode",
+             "source": source, "clips": {"v.avi_10_20.mp4": {
+                 "start": 10, "end": 20, "pair_hash": pair_hash(10, 20, "reencode"),
+                 "output": "v.avi_10_20.mp4", "output_size": 4}}}
+    manifest = ExportManifest(str(export_path))
+    manifest.record(entry)
+    yield manifest, annotation, video, export_path, entry
+    manifest.close()
+
+
+def test_unchanged_video_is_current(exported):
+    manifest, annotation, _, _, _ = exported
+    assert manifest.is_current(str(annotation), "reencode")
+    assert not manifest.is_current(str(annotation), "smartcut")
+
+
+def test_changed_annotation_file_is_not_current(exported):
+    manifest, annotation, _, _, _ = exported
+    annotation.write_text(annotation.read_text() + " ")
+    assert not manifest.is_current(str(annotation), "reencode")
+
+
+def test_changed_source_video_is_not_current(exported):
+    manifest, annotation, video, _, _ = exported
+    video.write_bytes(b"another video")
+    assert not manifest.is_current(str(annotation), "reencode")
+
+
+def test_missing_or_modified_clip_is_not_current(exported):
+    manifest, annotation, _, export_path, entry = exported
+    clip = export_path / "v.avi_10_20.mp4"
+    clip.write_bytes(b"truncated cl")
+    assert not manifest.is_current(str(annotation), "reencode")
+    assert not clip_is_current(entry, "v.avi_10_20.mp4", pair_hash(10, 20, "reencode"), entry["source"],
+                               str(export_path))
+    clip.unlink()
+    assert not manifest.is_current(str(annotation), "reencode")
+
+
+def test_video_with_incomplete_clips_is_tried_again(exported):
+    manifest, annotation, _, _, entry = exported
+    manifest.record(dict(entry, incomplete=["v.avi_300_320.mp4: skipped, the video has 250 frames"]))
+    assert not manifest.is_current(str(annotation), "reencode")
+
+
+def test_clip_is_current_only_for_the_same_pair(exported):
+    _, _, _, export_path, entry = exported
+    assert clip_is_current(entry, "v.avi_10_20.mp4", pair_hash(10, 20, "reencode"), entry["source"],
+                           str(export_path))
+    assert not clip_is_current(entry, "v.avi_10_20.mp4", pair_hash(10, 20, "smartcut"), entry["source"],
+                               str(export_path))
+    assert not clip_is_current(None, "v.avi_10_20.mp4", pair_hash(10, 20, "reencode"), entry["source"],
+                               str(export_path))
+
+
+def test_manifest_survives_a_torn_line_and_compacts_on_close(exported):
+    manifest, annotation, _, export_path, entry = exported
+    manifest.record(entry)
+    manifest.manifest.write('{"json": "v.js')
+    manifest.manifest.flush()
+
+    reopened = ExportManifest(str(export_path))
+    assert reopened.is_current(str(annotation), "reencode")
+    reopened.close()
+    lines = (export_path / MANIFEST_FILE_NAME).read_text().splitlines()
+    assert len(lines) == 1 and json.loads(lines[0])["json"] == "v.json"
+
+
+def test_export_keeps_valid_clips_when_a_mark_is_past_the_end(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    np = pytest.importorskip("numpy")
+    from cut_clip import export_video
+
+    video = str(tmp_path / "v.avi")
+    writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*"MJPG"), 25, (32, 24))
+    for i in range(50):
+        writer.write(np.full((24, 32, 3), i, np.uint8))
+    writer.release()
+    annotation = tmp_path / "v.json"
+    annotation.write_text(json.dumps({"name": "v.avi", "path": video, "annotations": {},
+                                      "annotations_frame": {"S1": [10], "E1": [20], "S2": [60], "E2": [70]}}))
+    export_path = tmp_path / "out"
+    export_path.mkdir()
+
+    result = export_video(str(annotation), str(export_path))
+    assert result["error"] is None
+    assert result["clips"] == 1
+    assert list(result["entry"]["clips"]) == ["v.avi_10_20.mp4"]
+    assert len(result["entry"]["incomplete"]) == 1
+
+    again = export_video(str(annotation), str(export_path), previous=result["entry"])
+    assert again["skipped"] == 1 and again["clips"] == 0
@@ -0,0 +1,42 @@
+import numpy as np
+
+from frame_index import FrameIndex, parse_ffprobe_timestamps
+
+
+def test_timestamps_count_from_the_container_start():
+    # Decode order with B-frames, a 1.4 s start time as in MPEG-TS
+    output = "\n".join(["pts_time=1.400000", "pts_time=1.480000", "pts_time=1.440000", "pts_time=1.520000",
+                        "pts_time=N/A", "start_time=1.400000"])
+    timestamps = parse_ffprobe_timestamps(output)
+    assert timestamps.tolist() == [0, 40000, 80000, 120000]
+
+
+def test_timestamps_without_start_time_count_from_the_first_frame():
+    timestamps = parse_ffprobe_timestamps("pts_time=10.080000\npts_time=10.000000\npts_time=10.040000\n")
+    assert timestamps.tolist() == [0, 40000, 80000]
+
+
+def test_container_start_before_the_first_frame_is_kept():
+    # Audio starting first: the first video frame is shown 0.2 s into the file
+    timestamps = parse_ffprobe_timestamps("start_time=0.800000\npts_time=1.000000\npts_time=1.040000\n")
+    assert timestamps.tolist() == [200000, 240000]
+
+
+def test_frame_index_maps_player_times_to_frames():
+    index = FrameIndex(parse_ffprobe_timestamps("start_time=5.000000\n"
+                                                + "".join(f"pts_time={5 + i * 0.04:.6f}\n" for i in range(10))))
+    assert len(index) == 10
+    assert index.frame_at(0) == 0
+    assert index.frame_at(39.9) == 0
+    assert index.frame_at(40) == 1
+    assert index.frame_at(10000) == 9
+    assert index.time_of(3) == 120.0
+    assert [index.frame_at(index.time_of(frame)) for frame in range(10)] == list(range(10))
+
+
+def test_frame_index_accepts_variable_frame_rates():
+    index = FrameIndex(np.array([0, 40000, 120000, 130000], dtype=np.int64))
+    assert index.frame_at(119) == 1
+    assert index.frame_at(125) == 2
+    assert index.time_of(-3) == 0.0
+    assert index.time_of(99) == 130.0
@@ -0,0 +1,71 @@
+import random
+
+from interval_index import IntervalIndex
+
+
+def brute_force(pairs, frame):
+    containing = [(min(s, e), max(s, e), i) for i, (s, e) in pairs.items() if min(s, e) <= frame <= max(s, e)]
+    return max(containing) if containing else None
+
+
+def test_pairing_and_next_index():
+    index = IntervalIndex.from_annotations({"S1": [10], "E1": [20], "S2": [30], "foo": [1]})
+    assert len(index) == 1
+    assert index.unpaired() == ["S2"]
+    assert index.next_index() == 3
+
+    index.add("E2", 40)
+    assert index.unpaired() is None
+    index.remove("S1")
+    assert index.unpaired() == ["E1"]
+    assert len(index) == 1
+
+
+def test_nested_and_overlapping_intervals():
+    index = IntervalIndex.from_annotations({"S1": [0], "E1": [100], "S2": [10], "E2": [20], "S3": [50], "E3": [60]})
+    assert index.interval_at(80) == (0, 100, 1)
+    assert index.interval_at(15) == (10, 20, 2)
+    assert index.interval_at(101) is None
+    assert index.overlaps(70, 90)
+    assert not index.overlaps(101, 200)
+
+    index.remove("E1")
+    assert index.interval_at(80) is None
+    assert not index.overlaps(70, 90)
+
+
+def test_end_before_start_covers_the_frames_between():
+    index = IntervalIndex.from_annotations({"S1": [50], "E1": [30]})
+    assert index.interval_at(40) == (30, 50, 1)
+    assert index.overlaps(45, 60)
+    assert not index.overlaps(0, 29)
+
+
+def test_moving_a_mark_updates_the_queries():
+    index = IntervalIndex.from_annotations({"S1": [0], "E1": [100], "S2": [10], "E2": [20]})
+    index.add("E1", 5)
+    assert index.interval_at(50) is None
+    assert index.interval_at(15) == (10, 20, 2)
+    assert not index.overlaps(30, 40)
+
+
+def test_queries_match_a_scan_on_random_marks():
+    rng = random.Random(7)
+    index = IntervalIndex()
+    pairs = {}
+    for _ in range(500):
+        i = rng.randint(1, 20)
+        if i in pairs and rng.random() < 0.3:
+            index.remove(f"S{i}")
+            index.remove(f"E{i}")
+            del pairs[i]
+        else:
+            start, end = rng.randint(0, 300), rng.randint(0, 300)
+            index.add(f"S{i}", start)
+            index.add(f"E{i}", end)
+            pairs[i] = (start, end)
+
+        frame = rng.randint(0, 300)
+        assert index.interval_at(frame) == brute_force(pairs, frame)
+        lo, hi = sorted((rng.randint(0, 300), rng.randint(0, 300)))
+        assert index.overlaps(lo, hi) == any(min(s, e) <= hi and max(s, e) >= lo for s, e in pairs.values())
@@ -0,0 +1,88 @@
+import os
+import time
+
+import pytest
+
+from leases import LeaseManager, in_shard, parse_shard
+
+
+@pytest.fixture
+def managers(tmp_path):
+    opened = []
+
+    def manager(ttl=600):
+        lease_manager = LeaseManager(str(tmp_path), ttl=ttl, heartbeat=3600)
+        opened.append(lease_manager)
+        return lease_manager
+
+    yield manager
+    for lease_manager in opened:
+        lease_manager.close()
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_only_one_annotator_gets_a_video(managers):
+    alice, bob = managers(), managers()
+    assert alice.try_acquire("v")
+    assert not bob.try_acquire("v")
+    assert bob.status("v") == "other"
+    assert alice.status("v") == "mine"
+
+    alice.release("v")
+    assert bob.try_acquire("v")
+
+
+def test_done_videos_are_only_claimed_when_reopened(managers):
+    alice, bob = managers(), managers()
+    assert alice.try_acquire("v")
+    alice.release("v", done=True)
+    assert bob.status("v") == "done"
+    assert not bob.try_acquire("v")
+    assert bob.try_acquire("v", reopen=True)
+
+
+def test_expired_lease_can_be_taken_over(managers):
+    alice, bob = managers(ttl=0.05), managers()
+    assert alice.try_acquire("v")
+    assert not bob.try_acquire("v")
+    time.sleep(0.1)
+    assert bob.try_acquire("v")
+
+    # The heartbeat of the old holder notices it lost the video
+    alice.renew()
+    assert "v" in alice.lost
+
+
+def test_renewed_lease_does_not_expire(managers):
+    alice, bob = managers(ttl=1.0), managers()
+    assert alice.try_acquire("v")
+    for _ in range(3):
+        time.sleep(0.5)
+        alice.renew()
+        assert not bob.try_acquire("v")
+
+
+def test_empty_lease_left_by_a_crash_expires(managers):
+    alice = managers(ttl=600)
+    path = alice.lease_path("v")
+    open(path, "w").close()
+    # Possibly being written right now
+    assert not alice.try_acquire("v")
+
+    age(path, 601)
+    assert alice.try_acquire("v")
+    assert alice.status("v") == "mine"
+
+
+def test_shards_split_the_names():
+    names = [f"video_{i}.mp4" for i in range(200)]
+    shards = [set(name for name in names if in_shard(name, (index, 3))) for index in range(3)]
+    assert set().union(*shards) == set(names)
+    assert sum(len(shard) for shard in shards) == len(names)
+    assert parse_shard("1/3") == (1, 3)
+    with pytest.raises(ValueError):
+        parse_shard("3/3")
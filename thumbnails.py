@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from frame_index import cache_key
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pia_video_annotation_tool", "thumbnails")
+
+
+def build_sprite(video_path, sprite_path, count=20, height=54):
+    """Extract count evenly spaced thumbnails of video_path into one horizontal sprite sheet.
+
+    Runs in a worker process. Returns sprite_path, or None if the video has
+    no readable frames.
+    """
+    import cv2
+    import numpy as np
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        return None
+
+    try:
+        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        video_height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if total_frames <= 0 or width <= 0 or video_height <= 0:
+            return None
+
+        thumb_size = (max(int(width * height / video_height), 1), height)
+        thumbs = []
+        for i in range(count):
+            video.set(cv2.CAP_PROP_POS_FRAMES, int((i + 0.5) * total_frames / count))
+            ok, frame = video.read()
+            if ok:
+                thumbs.append(cv2.resize(frame, thumb_size, interpolation=cv2.INTER_AREA))
+            elif thumbs:
+                thumbs.append(thumbs[-1])
+            else:
+                thumbs.append(np.zeros((thumb_size[1], thumb_size[0], 3), np.uint8))
+    finally:
+        video.release()
+
+    tmp_path = f"{sprite_path}.{os.getpid()}.tmp.jpg"
+    if not cv2.imwrite(tmp_path, np.hstack(thumbs), [cv2.IMWRITE_JPEG_QUALITY, 80]):
+        return None
+    os.replace(tmp_path, sprite_path)
+    return sprite_path
+
+
+class ThumbnailCache:
+    """Filmstrip sprite sheets of videos, one JPEG per video keyed by path, size and mtime.
+
+    Missing sprites are built in a process pool. get() never blocks, and
+    on_ready(video_path, sprite_path) is called from a pool thread when a
+    scheduled sprite is done.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, count=20, height=54, max_workers=2, on_ready=None):
+        self.cache_dir = cache_dir
+        self.count = count
+        self.height = height
+        self.on_ready = on_ready
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Spawned, not forked: a fork of the Qt process could inherit a lock held by one of its threads
+        self._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._failed = set()
+
+    def sprite_path(self, video_path):
+        return os.path.join(self.cache_dir, f"{cache_key(video_path)}_{self.count}x{self.height}.jpg")
+
+    def get(self, video_path):
+        """Path of the sprite sheet if it is built, otherwise schedule it and return None"""
+        try:
+            sprite_path = self.sprite_path(video_path)
+        except OSError:
+            return None
+        if os.path.exists(sprite_path):
+            return sprite_path
+        with self._lock:
+            failed = video_path in self._failed
+        if failed:
+            return None
+
+        self._schedule(video_path, sprite_path)
+        return None
+
+    def request(self, video_paths):
+        """Build the sprites of upcoming videos ahead of time"""
+        for video_path in video_paths:
+            self.get(video_path)
+
+    def _schedule(self, video_path, sprite_path):
+        with self._lock:
+            if video_path in self._futures:
+                return
+            future = self._executor.submit(build_sprite, video_path, sprite_path, self.count, self.height)
+            self._futures[video_path] = future
+        future.add_done_callback(lambda f, path=video_path: self._done(path, f))
+
+    def _done(self, video_path, future):
+        with self._lock:
+            self._futures.pop(video_path, None)
+
+        try:
+            sprite_path = future.result()
+        except Exception as e:
+            print(f"Could not build the filmstrip of {video_path}: {e}")
+            return
+
+        if sprite_path is None:
+            with self._lock:
+                self._failed.add(video_path)
+        elif self.on_ready is not None:
+            self.on_ready(video_path, sprite_path)
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+        self._executor.shutdown(wait=False)
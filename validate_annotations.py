@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frame_index import load_frame_index
+
+
+# Upper edges of the interval length histogram, in frames
+LENGTH_BINS = [0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000]
+
+
+def video_frame_count(video_path):
+    """Number of frames of a video from its cached frame index, or from OpenCV. None if unknown."""
+    index = load_frame_index(video_path, build=False)
+    if index is not None:
+        return len(index)
+
+    import cv2
+    video = cv2.VideoCapture(video_path)
+    try:
+        count = int(video.get(cv2.CAP_PROP_FRAME_COUNT)) if video.isOpened() else 0
+    finally:
+        video.release()
+    return count if count > 0 else None
+
+
+def mark_keys(annotations):
+    """{(event, index): key} of the S<i>/E<i> keys of an annotations dict, other keys are ignored"""
+    keys = {}
+    for key in annotations:
+        if key[:1] in ("S", "E") and key[1:].isdigit():
+            keys[(key[0], int(key[1:]))] = key
+    return keys
+
+
+def validate_file(json_file_path, check_videos=True, tolerance=25):
+    """Check one annotation file, returns a dict of its issues and the numbers the statistics are built from"""
+    result = {"json": os.path.basename(json_file_path), "video": None, "frame_count": None,
+              "events": 0, "interval_lengths": [], "issues": []}
+
+    def issue(kind, **details):
+        result["issues"].append(dict(details, type=kind))
+
+    try:
+        with open(json_file_path, "r") as f:
+            doc = json.load(f)
+        frames = doc["annotations_frame"]
+        positions = doc.get("annotations", {})
+        video_path = doc["path"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        issue("unreadable", error=f"{type(e).__name__}: {e}")
+        return result
+    result["video"] = doc.get("name")
+
+    frame_keys = mark_keys(frames)
+    starts = {index for event, index in frame_keys if event == "S"}
+    ends = {index for event, index in frame_keys if event == "E"}
+    for index in sorted(starts ^ ends):
+        issue("unpaired", key=f"S{index}" if index in starts else f"E{index}")
+
+    intervals = []
+    for index in sorted(starts & ends):
+        start_frame, end_frame = int(frames[f"S{index}"][0]), int(frames[f"E{index}"][0])
+        if end_frame < start_frame:
+            issue("end_before_start", index=index, start_frame=start_frame, end_frame=end_frame)
+        else:
+            intervals.append((start_frame, end_frame, index))
+            result["interval_lengths"].append(end_frame - start_frame + 1)
+    result["events"] = len(starts & ends)
+
+    # Sorted by start, an interval overlaps if it starts before the furthest end seen so far
+    intervals.sort()
+    furthest = None
+    for start_frame, end_frame, index in intervals:
+        if furthest is not None and start_frame <= furthest[0]:
+            issue("overlap", index=index, other=furthest[1], start_frame=start_frame, other_end_frame=furthest[0])
+        if furthest is None or end_frame > furthest[0]:
+            furthest = (end_frame, index)
+
+    position_keys = mark_keys(positions)
+    for event, index in sorted(set(position_keys) ^ set(frame_keys)):
+        issue("key_mismatch", key=f"{event}{index}",
+              missing_in="annotations_frame" if (event, index) in position_keys else "annotations")
+
+    if not check_videos:
+        return result
+
+    if not os.path.exists(video_path):
+        issue("missing_video", path=video_path)
+        return result
+
+    frame_count = video_frame_count(video_path)
+    result["frame_count"] = frame_count
+    if frame_count is None:
+        issue("unreadable_video", path=video_path)
+        return result
+
+    for key in sorted(frame_keys.values()):
+        frame = int(frames[key][0])
+        if frame < 0 or frame >= frame_count:
+            issue("frame_out_of_range", key=key, frame=frame, frame_count=frame_count)
+        elif key in positions:
+            expected = float(positions[key][0]) * (frame_count - 1)
+            if abs(expected - frame) > tolerance:
+                issue("position_mismatch", key=key, frame=frame, position_frame=int(round(expected)))
+    return result
+
+
+def histogram(values, edges):
+    """{"<=edge": count} with a last ">edge" bucket"""
+    counts = np.bincount(np.searchsorted(edges, values, "left"), minlength=len(edges) + 1)
+    labels = [f"<={edge}" for edge in edges] + [f">{edges[-1]}"]
+    return dict(zip(labels, (int(c) for c in counts)))
+
+
+def summarize(results):
+    lengths = np.fromiter((n for r in results for n in r["interval_lengths"]), np.int64)
+    events = np.fromiter((r["events"] for r in results), np.int64, len(results))
+    issue_counts = Counter(issue["type"] for r in results for issue in r["issues"])
+
+    stats = {
+        "files": len(results),
+        "files_with_issues": sum(1 for r in results if r["issues"]),
+        "issues": dict(sorted(issue_counts.items())),
+        "events": int(events.sum()),
+        "events_per_video": histogram(events, [0, 1, 2, 5, 10, 25, 50, 100, 250]),
+        "interval_length_frames": histogram(lengths, LENGTH_BINS),
+    }
+    if len(lengths):
+        stats["interval_length_summary"] = {
+            "min": int(lengths.min()), "median": float(np.median(lengths)),
+            "mean": float(lengths.mean()), "p95": float(np.percentile(lengths, 95)), "max": int(lengths.max()),
+        }
+    return stats
+
+
+def validate_directory(json_dir, workers=None, check_videos=True, tolerance=25):
+    json_files = [entry.path for entry in sorted(os.scandir(json_dir), key=lambda e: e.name)
+                  if entry.name.endswith(".json") and entry.is_file()]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(json_files) // ((workers or os.cpu_count() or 1) * 8))
+        results = list(executor.map(validate_file, json_files, [check_videos] * len(json_files),
+                                    [tolerance] * len(json_files), chunksize=chunksize))
+
+    return {
+        "directory": os.path.abspath(json_dir),
+        "statistics": summarize(results),
+        "files": [{"json": r["json"], "video": r["video"], "frame_count": r["frame_count"], "issues": r["issues"]}
+                  for r in results if r["issues"]],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Check every annotation file of a directory and report issues and statistics as JSON.')
+    parser.add_argument('json_dir',
+                        help=('Directory with the annotation JSON files.'))
+    parser.add_argument('--output', default=None,
+                        help=('File to write the report to, stdout if not given.'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help=('Number of worker processes.'))
+    parser.add_argument('--no_videos', action='store_true',
+                        help=('Do not open the videos, skips the missing video and frame range checks.'))
+    parser.add_argument('--tolerance', type=int, default=25,
+                        help=('Frames a mark position may differ from its frame number.'))
+
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    report = validate_directory(args.json_dir, args.workers, not args.no_videos, args.tolerance)
+    report["seconds"] = time.monotonic() - start
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        statistics = report["statistics"]
+        print(f"Checked {statistics['files']} files in {report['seconds']:.1f} s, "
+              f"{statistics['files_with_issues']} with issues: {statistics['issues']}")
+
+    sys.exit(1 if report["files"] else 0)
@@ -0,0 +1,72 @@
+import os
+import time
+
+
+SUPPORTED_FORMATS = frozenset([".mp3", ".mp4", ".avi", ".wmv", ".mov", ".ogg", ".wav", ".ogm"])
+
+
+def iter_video_paths(videos_dir, recursive=False, extensions=SUPPORTED_FORMATS, directories=None):
+    """Walk videos_dir once with os.scandir and yield every supported media path.
+
+    Extensions are matched case-insensitively against a set, so each directory
+    entry is looked at exactly once no matter how many formats are supported.
+    Sub-directories are only entered when recursive is True. If directories
+    is a dict, the mtime of every directory is stored in it before the
+    directory is listed, see session.load_cached_scan.
+    """
+    pending = [videos_dir]
+    while pending:
+        current_dir = pending.pop()
+        try:
+            if directories is not None:
+                directories[current_dir] = os.stat(current_dir).st_mtime_ns
+            entries = os.scandir(current_dir)
+        except OSError as e:
+            print(f"Could not scan {current_dir}: {e}")
+            continue
+
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if recursive:
+                            pending.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+
+                if os.path.splitext(entry.name)[1].lower() in extensions:
+                    yield entry.path
+
+
+def iter_video_batches(videos_dir, recursive=False, extensions=SUPPORTED_FORMATS,
+                       batch_size=512, max_latency=0.1, directories=None):
+    """Group the paths of iter_video_paths into sorted batches.
+
+    A batch is handed out as soon as it holds batch_size paths or max_latency
+    seconds passed since the previous one, so the first results reach the
+    caller quickly even on slow network shares.
+    """
+    batch = []
+    last_flush = time.monotonic()
+    for path in iter_video_paths(videos_dir, recursive, extensions, directories):
+        batch.append(path)
+        if len(batch) >= batch_size or time.monotonic() - last_flush >= max_latency:
+            yield sorted(batch)
+            batch = []
+            last_flush = time.monotonic()
+
+    if batch:
+        yield sorted(batch)
+
+
+def scan_videos(videos_dir, recursive=False, extensions=SUPPORTED_FORMATS):
+    """Return the sorted list of supported media paths in videos_dir"""
+    return sorted(iter_video_paths(videos_dir, recursive, extensions))
+
+
+def video_name_from_path(video_path):
+    """Return the file name of a video path, for both Windows and POSIX separators"""
+    if "\\" in video_path:
+        return video_path.split("\\")[-1]
+    return video_path.split("/")[-1]